@@ -0,0 +1,142 @@
+import threading
+import time
+
+import numpy as np
+from six.moves import queue
+
+from input_pipeline import map_shape_groups
+
+
+def distort_batch(images, flip_left_right, random_crop, random_scale, random_brightness,
+                  output_height, output_width, rng=np.random):
+    """
+    같은 크기의 2D array 배치 [N, H, W]를 한 번에 변형해 [N, output_height, output_width]로 리턴한다.
+
+    retrain.py의 distortion과 같은 의미로
+    - random_crop(%) 여백과 random_scale(%)까지의 확대로 원본에서 잘라낼 창 크기를 정하고,
+    - 창 위치를 무작위로 골라 output 크기로 bilinear 리사이즈하고,
+    - flip_left_right면 절반 확률로 좌우를 뒤집고,
+    - random_brightness(%) 범위의 배율을 곱한다.
+    이미지마다 반복하지 않고 좌표 배열을 만들어 fancy indexing 네 번으로 처리한다.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    num_images, height, width = images.shape
+
+    margin_scale = 1.0 + random_crop / 100.0
+    resize_scale = 1.0 + random_scale / 100.0
+    scale = margin_scale * rng.uniform(1.0, resize_scale, num_images)
+    window_height = height / scale
+    window_width = width / scale
+    top = rng.uniform(0.0, 1.0, num_images) * (height - window_height)
+    left = rng.uniform(0.0, 1.0, num_images) * (width - window_width)
+
+    rows = (np.arange(output_height) + 0.5) / output_height
+    cols = (np.arange(output_width) + 0.5) / output_width
+    ys = top[:, None] + rows[None, :] * window_height[:, None] - 0.5
+    xs = left[:, None] + cols[None, :] * window_width[:, None] - 0.5
+    if flip_left_right:
+        flip = rng.uniform(0.0, 1.0, num_images) < 0.5
+        xs[flip] = xs[flip, ::-1]
+    ys = np.clip(ys, 0, height - 1)
+    xs = np.clip(xs, 0, width - 1)
+
+    y0 = np.floor(ys).astype(np.int64)
+    x0 = np.floor(xs).astype(np.int64)
+    y1 = np.minimum(y0 + 1, height - 1)
+    x1 = np.minimum(x0 + 1, width - 1)
+    wy = (ys - y0)[:, :, None].astype(np.float32)
+    wx = (xs - x0)[:, None, :].astype(np.float32)
+
+    n = np.arange(num_images)[:, None, None]
+    top_row = (images[n, y0[:, :, None], x0[:, None, :]] * (1 - wx) +
+               images[n, y0[:, :, None], x1[:, None, :]] * wx)
+    bottom_row = (images[n, y1[:, :, None], x0[:, None, :]] * (1 - wx) +
+                  images[n, y1[:, :, None], x1[:, None, :]] * wx)
+    distorted = top_row * (1 - wy) + bottom_row * wy
+
+    if random_brightness:
+        brightness = rng.uniform(1.0 - random_brightness / 100.0, 1.0 + random_brightness / 100.0, num_images)
+        distorted *= brightness[:, None, None].astype(np.float32)
+    return distorted
+
+
+def distort_arrays(image_datas, flip_left_right, random_crop, random_scale, random_brightness,
+                   output_height, output_width, rng=np.random):
+    """크기가 다를 수 있는 2D array 리스트를 같은 shape끼리 묶어 변형하고 입력 순서대로 [N, h, w]로 리턴한다."""
+    return map_shape_groups(lambda images: distort_batch(images, flip_left_right, random_crop, random_scale,
+                                                         random_brightness, output_height, output_width, rng),
+                            image_datas)
+
+
+class DistortedBatchProducer(object):
+    """
+    배경 스레드에서 (샘플링 -> array 로딩 -> 배치 distortion)을 돌려 queue_depth개의 배치를 미리 만들어둔다.
+    학습 스레드가 Inception forward와 FC 레이어 업데이트를 하는 동안 다음 배치가 준비된다.
+
+    sample_fn() -> (파일 경로 리스트, 정답지 [N, class_count])
+    load_fn(경로) -> 2D array
+    distort_fn(2D array 리스트) -> 그래프에 넣을 배치
+    """
+
+    def __init__(self, sample_fn, load_fn, distort_fn, queue_depth=4, num_threads=2):
+        self.sample_fn = sample_fn
+        self.load_fn = load_fn
+        self.distort_fn = distort_fn
+        self.stats = {'samples': 0, 'load_sec': 0.0, 'distort_sec': 0.0, 'consumer_wait_sec': 0.0}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._stop_event = threading.Event()
+        self._error = None
+        self._threads = [threading.Thread(target=self._run) for _ in range(num_threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        rng = np.random.RandomState()
+        while not self._stop_event.is_set():
+            try:
+                image_paths, ground_truths = self.sample_fn()
+                start = time.time()
+                image_datas = [self.load_fn(image_path) for image_path in image_paths]
+                loaded = time.time()
+                images = self.distort_fn(image_datas, rng)
+                distorted = time.time()
+            except Exception as e:
+                self._error = e
+                self._stop_event.set()
+                return
+            with self._lock:
+                self.stats['samples'] += len(image_paths)
+                self.stats['load_sec'] += loaded - start
+                self.stats['distort_sec'] += distorted - loaded
+            while not self._stop_event.is_set():
+                try:
+                    self._queue.put((images, ground_truths), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def get(self):
+        """준비된 (이미지 배치, 정답지)를 하나 꺼낸다."""
+        start = time.time()
+        while True:
+            if self._error is not None:
+                raise RuntimeError('distortion 중 에러 발생: %s' % self._error)
+            try:
+                batch = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        self.stats['consumer_wait_sec'] += time.time() - start
+        return batch
+
+    def stop(self):
+        self._stop_event.set()
+
+    def report(self, elapsed_sec):
+        distort_rate = self.stats['samples'] / self.stats['distort_sec'] if self.stats['distort_sec'] else 0.0
+        print('augmentation: %d samples, distortion만 %.1f samples/sec, 로딩 %.2fs, '
+              '학습 스레드 대기 %.2fs, 전체 %.1f samples/sec' % (
+                  self.stats['samples'], distort_rate, self.stats['load_sec'],
+                  self.stats['consumer_wait_sec'], self.stats['samples'] / elapsed_sec))
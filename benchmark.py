@@ -0,0 +1,282 @@
+"""
+합성 데이터와 로컬 stand-in 그래프로 보틀넥 생성 / 캐싱 / 학습 스텝 / 추론 단계의 속도를 재고 JSON으로 저장한다.
+실제 데이터나 네트워크 없이 CPU만 있는 리눅스에서 커밋마다 같은 조건으로 돌려 비교할 수 있다.
+
+    - 합성 데이터: <work_dir>/data/class_<i>/<j>.<ext> 에 pickle로 저장한 2D array (create_image_lists가 읽는 구조)
+    - stand-in 그래프: Inception과 같은 텐서 이름(DecodeJpeg, ResizeBilinear, pool_3, pool_3/_reshape)을 가진
+      작은 그래프를 <work_dir>/model/classify_image_graph_def.pb로 저장하고 model_source_dir처럼 사용한다.
+
+사용 예:
+    python benchmark.py --work_dir /tmp/bench_ch2 --output bench.json
+    python benchmark.py --classes 6 --per_class 200 --height 128 --width 128 --stages extraction caching
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+from tensorflow.python.platform import gfile
+
+import new_model
+from inference import FrozenClassifier, run_inference
+from input_pipeline import load_image_array
+
+STAGES = ['extraction', 'caching', 'training', 'inference']
+DATASET_CONFIG_FILENAME = 'dataset.json'
+
+
+def make_synthetic_dataset(data_dir, num_classes, per_class, height, width, extension='bin', seed=0):
+    """
+    클래스마다 밝기 평균이 다른 2D array를 pickle로 저장한다. 같은 설정이면 다시 만들지 않는다.
+    값 범위는 min_max_scaling_ch1의 142 ~ 987에 맞춘다.
+    """
+    config = {'num_classes': num_classes, 'per_class': per_class, 'height': height, 'width': width,
+              'extension': extension, 'seed': seed}
+    config_path = os.path.join(data_dir, DATASET_CONFIG_FILENAME)
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            if json.load(f) == config:
+                return data_dir
+    if os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
+
+    rng = np.random.RandomState(seed)
+    for class_index in range(num_classes):
+        class_dir = os.path.join(data_dir, 'class_%d' % class_index)
+        os.makedirs(class_dir)
+        center = new_model.CH1_MIN_VALUE + (class_index + 1.0) / (num_classes + 1) * (
+            new_model.CH1_MAX_VALUE - new_model.CH1_MIN_VALUE)
+        for image_index in range(per_class):
+            image_data = rng.normal(center, 60.0, (height, width))
+            image_data = np.clip(image_data, new_model.CH1_MIN_VALUE, new_model.CH1_MAX_VALUE).astype(np.float32)
+            with open(os.path.join(class_dir, '%05d.%s' % (image_index, extension)), 'wb') as f:
+                pickle.dump(image_data, f, protocol=2)
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+    return data_dir
+
+
+def make_stand_in_graph(model_dir, seed=0, kernel_size=8):
+    """
+    Inception 대신 쓸 작은 그래프를 저장한다.
+    ResizeBilinear:0 [1, 299, 299, 3] -> stride kernel_size의 고정 convolution -> 평균 풀링 -> pool_3:0 [N, 1, 1, 2048]
+    new_model.create_inception_graph가 가져오는 이름과 shape이 같으므로 코드 수정 없이 그대로 쓸 수 있다.
+    """
+    graph_path = os.path.join(model_dir, new_model.MODEL_FILENAME)
+    if os.path.exists(graph_path):
+        return model_dir
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir)
+
+    rng = np.random.RandomState(seed)
+    kernel = rng.normal(0.0, 0.01, (kernel_size, kernel_size, new_model.MODEL_INPUT_DEPTH,
+                                    new_model.BOTTLENECK_TENSOR_SIZE)).astype(np.float32)
+    graph = tf.Graph()
+    with graph.as_default():
+        decoded = tf.placeholder_with_default(
+            tf.zeros([new_model.MODEL_INPUT_HEIGHT, new_model.MODEL_INPUT_WIDTH, new_model.MODEL_INPUT_DEPTH],
+                     dtype=tf.uint8), [None, None, new_model.MODEL_INPUT_DEPTH], name='DecodeJpeg')
+        resized = tf.image.resize_bilinear(
+            tf.expand_dims(tf.cast(decoded, tf.float32), 0),
+            [new_model.MODEL_INPUT_HEIGHT, new_model.MODEL_INPUT_WIDTH], name='ResizeBilinear')
+        features = tf.nn.relu(tf.nn.conv2d(resized, tf.constant(kernel), [1, kernel_size, kernel_size, 1], 'VALID'))
+        pool = tf.reduce_mean(features, axis=[1, 2], keepdims=True, name='pool_3')
+        with tf.name_scope('pool_3/'):
+            tf.reshape(pool, [1, new_model.BOTTLENECK_TENSOR_SIZE], name='_reshape')
+    with gfile.FastGFile(graph_path, 'wb') as f:
+        f.write(graph.as_graph_def().SerializeToString())
+    return model_dir
+
+
+def _percentiles_ms(latencies_sec):
+    latencies_ms = np.array(latencies_sec) * 1000.0
+    if not len(latencies_ms):
+        return {}
+    return {'p50_ms': float(np.percentile(latencies_ms, 50)), 'p90_ms': float(np.percentile(latencies_ms, 90)),
+            'p99_ms': float(np.percentile(latencies_ms, 99))}
+
+
+def bench_extraction(sess, image_paths, jpeg_data_tensor, bottleneck_tensor, batch_size):
+    """한 장씩 / batch_size개씩 Inception forward의 초당 이미지 수 (array는 미리 메모리에 올려둔다)"""
+    image_datas = [load_image_array(image_path) for image_path in image_paths]
+    new_model.run_bottleneck_on_image(sess, image_datas[0], jpeg_data_tensor, bottleneck_tensor)
+
+    latencies = []
+    for image_data in image_datas:
+        start = time.time()
+        new_model.run_bottleneck_on_image(sess, image_data, jpeg_data_tensor, bottleneck_tensor)
+        latencies.append(time.time() - start)
+    per_image_sec = sum(latencies)
+
+    batch_latencies = []
+    for i in range(0, len(image_datas), batch_size):
+        start = time.time()
+        new_model.run_bottleneck_on_arrays(sess, image_datas[i:i + batch_size], jpeg_data_tensor, bottleneck_tensor)
+        batch_latencies.append(time.time() - start)
+    batched_sec = sum(batch_latencies)
+
+    result = {'num_images': len(image_datas), 'batch_size': batch_size,
+              'per_image_images_per_sec': len(image_datas) / per_image_sec,
+              'batched_images_per_sec': len(image_datas) / batched_sec}
+    result['per_image_latency'] = _percentiles_ms(latencies)
+    result['batch_latency'] = _percentiles_ms(batch_latencies)
+    return result
+
+
+def bench_caching(sess, image_lists, image_dir, store_dir, model_dir, jpeg_data_tensor, bottleneck_tensor, batch_size,
+                  num_workers):
+    """빈 저장소에서 cache_bottlenecks (cold)와, 모두 채워진 뒤 다시 부르는 경우 (warm)의 시간"""
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    bottleneck_store = new_model.open_bottleneck_store(store_dir, image_lists, model_dir)
+    num_images = len(new_model.list_image_paths(image_lists, image_dir))
+
+    start = time.time()
+    new_model.cache_bottlenecks(sess, image_lists, image_dir, bottleneck_store, jpeg_data_tensor, bottleneck_tensor,
+                                batch_size, num_workers)
+    cold_sec = time.time() - start
+
+    ## 다시 열어 파일 해시 인덱스만으로 모두 건너뛰는지 확인한다.
+    bottleneck_store = new_model.open_bottleneck_store(store_dir, image_lists, model_dir)
+    start = time.time()
+    new_model.cache_bottlenecks(sess, image_lists, image_dir, bottleneck_store, jpeg_data_tensor, bottleneck_tensor,
+                                batch_size, num_workers)
+    warm_sec = time.time() - start
+    return bottleneck_store, {'num_images': num_images, 'batch_size': batch_size, 'num_workers': num_workers,
+                              'cold_sec': cold_sec, 'cold_images_per_sec': num_images / cold_sec,
+                              'warm_sec': warm_sec, 'store_bytes': bottleneck_store.nbytes_on_disk()}
+
+
+def bench_training(sess, image_lists, image_dir, bottleneck_store, bottleneck_tensor, num_steps, batch_size):
+    """메모리 캐시에서 미니배치를 뽑아 FC 레이어를 학습하는 스텝의 시간"""
+    class_count = len(image_lists.keys())
+    bottleneck_cache = new_model.create_bottleneck_cache(image_lists, image_dir, bottleneck_store, 'memory', 0)
+    train_step, _, bottleneck_input, ground_truth_input, _ = new_model.add_final_training_ops(
+        class_count, new_model.FINAL_TENSOR_NAME, bottleneck_tensor)
+    sess.run(tf.global_variables_initializer())
+
+    sample_latencies = []
+    step_latencies = []
+    for _ in range(num_steps):
+        start = time.time()
+        train_bottlenecks, train_ground_truth, _ = bottleneck_cache.sample('training', batch_size)
+        sampled = time.time()
+        sess.run(train_step, feed_dict={bottleneck_input: train_bottlenecks, ground_truth_input: train_ground_truth})
+        step_latencies.append(time.time() - sampled)
+        sample_latencies.append(sampled - start)
+    total_sec = sum(sample_latencies) + sum(step_latencies)
+    return {'num_steps': num_steps, 'batch_size': batch_size, 'steps_per_sec': num_steps / total_sec,
+            'samples_per_sec': num_steps * batch_size / total_sec,
+            'minibatch_latency': _percentiles_ms(sample_latencies),
+            'train_step_latency': _percentiles_ms(step_latencies)}
+
+
+def bench_inference(sess, graph, image_lists, image_paths, work_dir, batch_size, num_workers):
+    """학습한 그래프를 frozen graph로 저장하고 inference.py의 경로로 분류하는 속도"""
+    graph_path = os.path.join(work_dir, 'output_graph.pb')
+    labels_path = os.path.join(work_dir, 'output_labels.txt')
+    output_graph_def = graph_util.convert_variables_to_constants(
+        sess, graph.as_graph_def(), [new_model.FINAL_TENSOR_NAME])
+    with gfile.FastGFile(graph_path, 'wb') as f:
+        f.write(output_graph_def.SerializeToString())
+    with gfile.FastGFile(labels_path, 'w') as f:
+        f.write('\n'.join(image_lists.keys()) + '\n')
+
+    classifier = FrozenClassifier(graph_path, labels_path)
+    classifier.predict([load_image_array(image_paths[0])])
+    start = time.time()
+    done_paths, _, batch_latencies = run_inference(classifier, image_paths, batch_size, num_workers)
+    elapsed_sec = time.time() - start
+    classifier.close()
+    return {'num_images': len(done_paths), 'batch_size': batch_size, 'images_per_sec': len(done_paths) / elapsed_sec,
+            'batch_latency': _percentiles_ms(batch_latencies), 'graph_bytes': os.path.getsize(graph_path)}
+
+
+def environment_info():
+    info = {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+            'tensorflow': tf.__version__, 'cpu_count': os.cpu_count()}
+    try:
+        info['git_commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['git_commit'] = None
+    return info
+
+
+def run_benchmark(args):
+    stages = args.stages
+    data_dir = make_synthetic_dataset(os.path.join(args.work_dir, 'data'), args.classes, args.per_class,
+                                      args.height, args.width, args.extension, args.seed)
+    model_dir = make_stand_in_graph(os.path.join(args.work_dir, 'model'), args.seed)
+    model_dir = new_model.bootstrap_model(model_dir, model_source_dir=model_dir)
+
+    results = {'config': vars(args), 'environment': environment_info(), 'stages': {}}
+    np.random.seed(args.seed)
+    tf.set_random_seed(args.seed)
+
+    start = time.time()
+    image_lists = new_model.create_image_lists(data_dir, args.testing_percentage, args.validation_percentage)
+    results['stages']['create_image_lists'] = {'sec': time.time() - start}
+    graph, bottleneck_tensor, jpeg_data_tensor, _ = new_model.create_inception_graph(model_dir)
+    image_paths = new_model.list_image_paths(image_lists, data_dir)
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=args.intra_op_threads,
+                            inter_op_parallelism_threads=args.inter_op_threads)
+    with graph.as_default(), tf.Session(graph=graph, config=config) as sess:
+        if 'extraction' in stages:
+            results['stages']['extraction'] = bench_extraction(
+                sess, image_paths[:args.extraction_images], jpeg_data_tensor, bottleneck_tensor, args.batch_size)
+        bottleneck_store = None
+        if set(stages) & {'caching', 'training', 'inference'}:
+            bottleneck_store, results['stages']['caching'] = bench_caching(
+                sess, image_lists, data_dir, os.path.join(args.work_dir, 'bottlenecks'), model_dir, jpeg_data_tensor,
+                bottleneck_tensor, args.batch_size, args.num_workers)
+        if set(stages) & {'training', 'inference'}:
+            results['stages']['training'] = bench_training(
+                sess, image_lists, data_dir, bottleneck_store, bottleneck_tensor, args.train_steps,
+                args.train_batch_size)
+        if 'inference' in stages:
+            results['stages']['inference'] = bench_inference(
+                sess, graph, image_lists, image_paths, args.work_dir, args.batch_size, args.num_workers)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='합성 데이터로 단계별 성능을 재서 JSON으로 저장한다.')
+    parser.add_argument('--work_dir', default='/tmp/benchmark_ch2')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--classes', type=int, default=6)
+    parser.add_argument('--per_class', type=int, default=100)
+    parser.add_argument('--height', type=int, default=299)
+    parser.add_argument('--width', type=int, default=299)
+    parser.add_argument('--extension', default='bin', help="'bin' 또는 'jpg' (내용은 모두 pickle)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--testing_percentage', type=int, default=25)
+    parser.add_argument('--validation_percentage', type=int, default=25)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--extraction_images', type=int, default=128)
+    parser.add_argument('--train_steps', type=int, default=100)
+    parser.add_argument('--train_batch_size', type=int, default=200)
+    parser.add_argument('--intra_op_threads', type=int, default=0)
+    parser.add_argument('--inter_op_threads', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(json.dumps(results['stages'], indent=2, sort_keys=True))
+    print('벤치마크 결과 저장: %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from sampler import Sampler
+
+
+class _BottleneckCacheBase(object):
+    """
+    카테고리마다 보틀넥 저장소의 행 번호와 정수 레이블 배열을 들고 있고,
+    미니배치를 numpy 인덱스 한 번으로 뽑는다.
+    기본은 기존 get_random_cached_bottlenecks처럼 레이블을 균등하게 고른 뒤 그 레이블 안에서 고르고(복원 추출),
+    set_sampling으로 카테고리마다 샘플링 방식(sampler.SAMPLING_STRATEGIES)과 에폭 단위 비복원 추출을 바꾼다.
+    """
+
+    def __init__(self, bottleneck_store, class_count):
+        self.bottleneck_store = bottleneck_store
+        self.class_count = class_count
+        self.rows = {}
+        self.labels = {}
+        self.filenames = {}
+        self.samplers = {}
+        self.epoch_sampling = {}
+        self._one_hot = np.eye(class_count, dtype=np.float32)
+
+    def add_category(self, category, rows, labels, filenames):
+        """rows, labels는 레이블 순서로 정렬되어 있어야 한다."""
+        rows = np.asarray(rows, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int32)
+        self.rows[category] = rows
+        self.labels[category] = labels
+        self.filenames[category] = filenames
+        self.samplers[category] = Sampler(labels, self.class_count)
+        self.epoch_sampling[category] = False
+
+    def set_sampling(self, category, strategy='balanced', class_weights=None, epoch_sampling=False):
+        """
+        category의 sample이 쓸 샘플링 방식을 바꾼다. class_weights는 'weighted'에서 레이블 순서의 클래스 가중치 리스트이다.
+        epoch_sampling이면 에폭 단위로 섞은 순서에서 복원 없이 차례로 뽑는다.
+        """
+        self.samplers[category] = Sampler(self.labels[category], self.class_count, strategy, class_weights)
+        self.epoch_sampling[category] = epoch_sampling
+
+    def sample(self, category, how_many):
+        """
+        (bottlenecks [N, dim], ground_truths [N, class_count], filenames)를 리턴한다.
+        how_many가 음수면 카테고리 전체를 순서대로 리턴한다.
+        """
+        if how_many < 0:
+            indices = np.arange(len(self.labels[category]))
+        elif self.epoch_sampling[category]:
+            indices = self.samplers[category].next_batch(how_many)
+        else:
+            indices = self.samplers[category].sample(how_many)
+        bottlenecks = self._gather(category, indices)
+        ground_truths = self._one_hot[self.labels[category][indices]]
+        filenames = [self.filenames[category][i] for i in indices]
+        return bottlenecks, ground_truths, filenames
+
+    def iter_chunks(self, category, chunk_size):
+        """카테고리 전체를 순서대로 chunk_size개씩 (bottlenecks [n, dim], 정수 레이블 [n])로 나눠 리턴한다."""
+        num_examples = len(self.labels[category])
+        for start in range(0, num_examples, chunk_size):
+            indices = np.arange(start, min(start + chunk_size, num_examples))
+            yield self._gather(category, indices), self.labels[category][indices]
+
+    def _gather(self, category, indices):
+        raise NotImplementedError
+
+
+class InMemoryBottleneckCache(_BottleneckCacheBase):
+    """카테고리 전체 보틀넥을 연속된 float32 배열로 메모리에 올려둔다."""
+
+    def __init__(self, bottleneck_store, class_count):
+        super(InMemoryBottleneckCache, self).__init__(bottleneck_store, class_count)
+        self.bottlenecks = {}
+
+    def add_category(self, category, rows, labels, filenames):
+        super(InMemoryBottleneckCache, self).add_category(category, rows, labels, filenames)
+        self.bottlenecks[category] = np.ascontiguousarray(
+            self.bottleneck_store.get_rows(self.rows[category]), dtype=np.float32)
+
+    def _gather(self, category, indices):
+        return self.bottlenecks[category][indices]
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.bottlenecks.values())
+
+
+class LRUBottleneckCache(_BottleneckCacheBase):
+    """
+    메모리에 다 올라가지 않는 데이터셋을 위한 캐시.
+    저장소를 block_rows 행씩 블록으로 읽어 최근에 쓴 블록만 max_bytes 안에서 유지한다.
+    """
+
+    def __init__(self, bottleneck_store, class_count, max_bytes, block_rows=1024):
+        super(LRUBottleneckCache, self).__init__(bottleneck_store, class_count)
+        self.max_bytes = max_bytes
+        self.block_rows = block_rows
+        self._blocks = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get_block(self, block):
+        if block in self._blocks:
+            self._blocks.move_to_end(block)
+            self.hits += 1
+            return self._blocks[block]
+        self.misses += 1
+        start = block * self.block_rows
+        values = np.array(self.bottleneck_store.data[start:start + self.block_rows], dtype=np.float32)
+        self._blocks[block] = values
+        self._nbytes += values.nbytes
+        while self._nbytes > self.max_bytes and len(self._blocks) > 1:
+            _, evicted = self._blocks.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+        return values
+
+    def _gather(self, category, indices):
+        store_rows = self.rows[category][indices]
+        result = np.empty((len(store_rows), self.bottleneck_store.dim), dtype=np.float32)
+        blocks = store_rows // self.block_rows
+        for block in np.unique(blocks):
+            mask = blocks == block
+            result[mask] = self._get_block(block)[store_rows[mask] - block * self.block_rows]
+        return result
+
+    def nbytes(self):
+        return self._nbytes
+
+
+class ArrayBottleneckCache(_BottleneckCacheBase):
+    """
+    카테고리마다 이미 만든 보틀넥 배열을 그대로 쓴다. 저장소 없이 동작한다.
+    np.load(mmap_mode='r')로 연 배열을 넘기면 여러 프로세스가 같은 파일을 복사 없이 읽기 전용으로 공유한다.
+    """
+
+    def __init__(self, class_count):
+        super(ArrayBottleneckCache, self).__init__(None, class_count)
+        self.bottlenecks = {}
+
+    def add_array(self, category, bottlenecks, labels, filenames=None):
+        """labels는 레이블 순서로 정렬되어 있어야 한다. filenames가 없으면 빈 문자열로 채운다."""
+        if filenames is None:
+            filenames = [''] * len(labels)
+        super(ArrayBottleneckCache, self).add_category(category, np.arange(len(labels)), labels, filenames)
+        self.bottlenecks[category] = bottlenecks
+
+    def _gather(self, category, indices):
+        return np.asarray(self.bottlenecks[category][indices], dtype=np.float32)
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.bottlenecks.values())
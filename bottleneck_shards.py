@@ -0,0 +1,80 @@
+"""
+보틀넥 생성을 여러 프로세스로 나눌 때 쓰는 샤드 계획 / 진행 기록 / 병합
+
+    <bottleneck_dir>/shards/plan.json          : fingerprint와 샤드마다 처리할 파일 경로 리스트
+    <bottleneck_dir>/shards/shard_00/          : 워커 하나가 쓰는 BottleneckStore
+    <bottleneck_dir>/shards/shard_00/progress.json : 끝까지 저장된 작업 리스트 위치(offset)
+
+계획은 처음 한 번만 만들고, 중간에 멈췄다 다시 실행하면 계획을 그대로 읽어
+각 샤드의 offset부터 이어서 처리한다. 모든 샤드가 끝나면 메인 저장소로 병합하고 shards 디렉토리를 지운다.
+"""
+import json
+import os
+import shutil
+
+from bottleneck_store import BottleneckStore, _write_json
+
+PLAN_FILENAME = 'plan.json'
+PROGRESS_FILENAME = 'progress.json'
+
+
+def split_shards(items, num_shards):
+    """정렬한 items를 num_shards개로 번갈아 나눈다. 같은 입력이면 항상 같은 결과가 나온다."""
+    items = sorted(items)
+    return [items[i::num_shards] for i in range(num_shards)]
+
+
+def shard_store_dir(shards_dir, shard_index):
+    return os.path.join(shards_dir, 'shard_%02d' % shard_index)
+
+
+def load_shard_plan(shards_dir, fingerprint):
+    """저장된 계획을 리턴한다. 없거나 fingerprint가 다르면 None"""
+    plan_path = os.path.join(shards_dir, PLAN_FILENAME)
+    if not os.path.exists(plan_path):
+        return None
+    with open(plan_path, 'r') as f:
+        plan = json.load(f)
+    if plan['fingerprint'] != fingerprint:
+        return None
+    return plan['shards']
+
+
+def save_shard_plan(shards_dir, shards, fingerprint):
+    if not os.path.exists(shards_dir):
+        os.makedirs(shards_dir)
+    _write_json(os.path.join(shards_dir, PLAN_FILENAME), {'fingerprint': fingerprint, 'shards': shards})
+
+
+def load_shard_offset(shard_dir):
+    progress_path = os.path.join(shard_dir, PROGRESS_FILENAME)
+    if not os.path.exists(progress_path):
+        return 0
+    with open(progress_path, 'r') as f:
+        return json.load(f)['offset']
+
+
+def save_shard_offset(shard_dir, offset):
+    """샤드 저장소를 flush한 뒤에 불러야 offset까지의 보틀넥이 디스크에 있음이 보장된다."""
+    _write_json(os.path.join(shard_dir, PROGRESS_FILENAME), {'offset': offset})
+
+
+def merge_shards(bottleneck_store, shards_dir, num_shards):
+    """
+    각 샤드 저장소의 valid한 행을 메인 저장소로 복사하고 메인 저장소를 flush한다.
+    같은 키는 같은 값이므로 중간에 멈춘 뒤 다시 병합해도 결과가 같다. 복사한 행 수를 리턴한다.
+    """
+    merged = 0
+    for shard_index in range(num_shards):
+        shard_dir = shard_store_dir(shards_dir, shard_index)
+        if not os.path.exists(os.path.join(shard_dir, BottleneckStore.INDEX_FILENAME)):
+            continue
+        shard_store = BottleneckStore(shard_dir, bottleneck_store.dim, readonly=True)
+        merged += bottleneck_store.merge(shard_store)
+    bottleneck_store.flush()
+    return merged
+
+
+def remove_shards(shards_dir):
+    if os.path.exists(shards_dir):
+        shutil.rmtree(shards_dir)
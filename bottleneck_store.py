@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def array_hash(array):
+    """array의 shape, dtype, 값으로 만든 SHA1 해시"""
+    array = np.ascontiguousarray(array)
+    hasher = hashlib.sha1('{}:{}:'.format(array.shape, array.dtype.str).encode('ascii'))
+    hasher.update(array.view(np.uint8).reshape(-1))
+    return hasher.hexdigest()
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    hasher = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def content_key(input_hash, fingerprint):
+    """입력 array 해시와 그래프 / 전처리 fingerprint로 보틀넥 키를 만든다."""
+    return hashlib.sha1('{}:{}'.format(fingerprint, input_hash).encode('ascii')).hexdigest()
+
+
+def _write_json(path, value):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+class InputHashIndex(object):
+    """
+    파일 경로 -> [mtime_ns, size, 입력 해시]를 저장한다.
+    파일의 mtime과 크기가 그대로면 array를 다시 불러와 해시하지 않는다.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.entries = {}
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                self.entries = json.load(f)
+
+    def lookup(self, file_path):
+        """파일이 바뀌지 않았으면 저장된 입력 해시를, 아니면 None을 리턴한다."""
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if stat.st_mtime_ns != entry[0] or stat.st_size != entry[1]:
+            return None
+        return entry[2]
+
+    def update(self, file_path, input_hash, stat):
+        """stat은 array를 읽기 전에 얻은 os.stat 결과여야 읽는 사이 바뀐 파일을 놓치지 않는다."""
+        self.entries[file_path] = [stat.st_mtime_ns, stat.st_size, input_hash]
+
+    def retain(self, file_paths):
+        """file_paths에 없는 항목을 지우고 지운 개수를 리턴한다."""
+        removed = [path for path in self.entries if path not in file_paths]
+        for path in removed:
+            del self.entries[path]
+        return len(removed)
+
+    def flush(self):
+        _write_json(self.index_path, self.entries)
+
+
+class BottleneckStore(object):
+    """
+    보틀넥 벡터를 미리 할당한 하나의 행렬 파일에 저장하고 np.memmap으로 읽는다.
+
+    - bottlenecks.dat : [capacity, dim] float32 (또는 float16) 행렬
+    - valid.dat       : [capacity] uint8, 행이 채워졌는지 표시하는 비트맵 (행마다 1바이트)
+    - index.json      : 키 -> 행 번호, dim, dtype, capacity
+    - inputs.json     : 파일 경로 -> 입력 해시 (InputHashIndex)
+
+    키는 content_key(입력 해시, fingerprint)로, 같은 입력은 파일 이름이나 위치와 상관없이 한 번만 계산되고
+    그래프나 전처리가 바뀌면 fingerprint가 달라져 예전 행을 쓰지 않는다.
+    행은 키가 처음 나올 때 순서대로 할당되고, 값이 쓰여야 valid가 된다.
+    get은 memmap의 view를 리턴하므로 복사 없이 읽는다.
+    """
+
+    DATA_FILENAME = 'bottlenecks.dat'
+    VALID_FILENAME = 'valid.dat'
+    INDEX_FILENAME = 'index.json'
+    INPUTS_FILENAME = 'inputs.json'
+
+    def __init__(self, store_dir, dim, dtype='float32', capacity=1024, readonly=False, fingerprint=''):
+        self.store_dir = store_dir
+        self.readonly = readonly
+        self.fingerprint = fingerprint
+        index_path = os.path.join(store_dir, self.INDEX_FILENAME)
+
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index['dim'] != dim:
+                raise ValueError('Bottleneck store %s has dim %d, expected %d' % (store_dir, index['dim'], dim))
+            self.dim = index['dim']
+            self.dtype = np.dtype(index['dtype'])
+            self.capacity = index['capacity']
+            self.rows = index['rows']
+            self._open('r' if readonly else 'r+')
+            if not readonly:
+                ## index.json에 기록되지 않은 행은 재할당되므로 valid 표시를 지운다.
+                self.valid[len(self.rows):] = 0
+        else:
+            if readonly:
+                raise IOError('Bottleneck store not found: %s' % store_dir)
+            if not os.path.exists(store_dir):
+                os.makedirs(store_dir)
+            self.dim = dim
+            self.dtype = np.dtype(dtype)
+            self.capacity = max(int(capacity), 1)
+            self.rows = {}
+            self._open('w+')
+        self.input_hashes = InputHashIndex(os.path.join(store_dir, self.INPUTS_FILENAME))
+        if not os.path.exists(index_path):
+            self.flush()
+
+    def _open(self, mode):
+        self.data = np.memmap(os.path.join(self.store_dir, self.DATA_FILENAME), dtype=self.dtype,
+                              mode=mode, shape=(self.capacity, self.dim))
+        self.valid = np.memmap(os.path.join(self.store_dir, self.VALID_FILENAME), dtype=np.uint8,
+                               mode=mode, shape=(self.capacity,))
+
+    def _grow(self, min_capacity):
+        """파일 크기를 두 배씩 늘리고 memmap을 다시 연다."""
+        new_capacity = self.capacity
+        while new_capacity < min_capacity:
+            new_capacity *= 2
+        self.data.flush()
+        self.valid.flush()
+        self._resize(new_capacity)
+
+    def _resize(self, new_capacity):
+        del self.data, self.valid
+        for filename, row_bytes in [(self.DATA_FILENAME, self.dim * self.dtype.itemsize),
+                                    (self.VALID_FILENAME, 1)]:
+            with open(os.path.join(self.store_dir, filename), 'r+b') as f:
+                f.truncate(new_capacity * row_bytes)
+        self.capacity = new_capacity
+        self._open('r+')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return self.is_valid(key)
+
+    def row(self, key, create=False):
+        """키에 해당하는 행 번호를 리턴한다. 없으면 create일 때 새 행을 할당하고 아니면 None."""
+        row = self.rows.get(key)
+        if row is None and create:
+            row = len(self.rows)
+            if row >= self.capacity:
+                self._grow(row + 1)
+            self.rows[key] = row
+        return row
+
+    def is_valid(self, key):
+        row = self.rows.get(key)
+        return row is not None and bool(self.valid[row])
+
+    def get(self, key):
+        """valid한 행의 view를 리턴한다. 없으면 None."""
+        row = self.rows.get(key)
+        if row is None or not self.valid[row]:
+            return None
+        return self.data[row]
+
+    def get_rows(self, rows):
+        """행 번호 배열로 [N, dim] 행렬을 가져온다."""
+        return self.data[rows]
+
+    def put(self, key, values):
+        row = self.row(key, create=True)
+        self.data[row] = values
+        self.valid[row] = 1
+
+    def put_many(self, keys, values):
+        rows = [self.row(key, create=True) for key in keys]
+        self.data[rows] = values
+        self.valid[rows] = 1
+
+    def merge(self, other):
+        """other 저장소에서 valid하고 여기에는 없는 행과 입력 해시를 복사하고 복사한 행 수를 리턴한다."""
+        keys = [key for key, row in other.rows.items() if other.valid[row] and not self.is_valid(key)]
+        if keys:
+            self.put_many(keys, other.get_rows([other.rows[key] for key in keys]))
+        self.input_hashes.entries.update(other.input_hashes.entries)
+        return len(keys)
+
+    def compact(self, keep_keys):
+        """
+        keep_keys에 없는 행을 지우고 남은 행을 앞으로 모은 뒤 파일 크기를 줄인다.
+        중간에 멈춰도 잘못된 값을 읽지 않도록 먼저 모든 행을 invalid로 기록해둔다.
+        지운 행 수를 리턴한다.
+        """
+        kept = sorted((row, key) for key, row in self.rows.items() if key in keep_keys and self.valid[row])
+        removed = len(self.rows) - len(kept)
+        self.valid[:] = 0
+        self.valid.flush()
+        new_rows = {}
+        for new_row, (old_row, key) in enumerate(kept):
+            if new_row != old_row:
+                self.data[new_row] = self.data[old_row]
+            new_rows[key] = new_row
+        self.rows = new_rows
+        self.valid[:len(kept)] = 1
+        self.flush()
+
+        new_capacity = max(len(kept), 1)
+        if new_capacity < self.capacity:
+            self._resize(new_capacity)
+            self.flush()
+        return removed
+
+    def nbytes_on_disk(self):
+        return self.capacity * (self.dim * self.dtype.itemsize + 1)
+
+    def flush(self):
+        """값과 valid 비트맵을 먼저 쓰고 index.json을 원자적으로 교체한다."""
+        if self.readonly:
+            return
+        self.data.flush()
+        self.valid.flush()
+        _write_json(os.path.join(self.store_dir, self.INDEX_FILENAME),
+                    {'dim': self.dim, 'dtype': self.dtype.name, 'capacity': self.capacity, 'rows': self.rows})
+        self.input_hashes.flush()
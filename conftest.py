@@ -0,0 +1 @@
+## tests/의 테스트가 저장소 루트의 모듈을 import할 수 있도록 pytest가 이 디렉토리를 sys.path에 넣는다.
@@ -0,0 +1,457 @@
+"""
+보틀넥(또는 학습한 FC 레이어의 마지막 은닉층 출력)을 임베딩으로 저장해두고 비슷한 예제를 찾는 최근접 이웃 인덱스.
+중복 데이터 찾기나 "이 예제와 비슷한 예제" 조회에 쓴다.
+
+임베딩은 L2 정규화해서 BottleneckStore(기본 float16)에 저장하므로 내적이 코사인 유사도이고,
+키는 원래 보틀넥 저장소와 같아 이미 저장한 임베딩은 다시 계산하지 않는다.
+
+    - ExactIndex : 전체 임베딩과 쿼리의 내적을 batch_size개씩 행렬곱으로 계산한다. 결과가 정확하다.
+    - IVFIndex   : k-means로 나눈 num_lists개의 리스트 중 쿼리와 가까운 num_probe개만 본다. 근사 결과이고 빠르다.
+
+두 인덱스 모두 add로 벡터를 계속 추가할 수 있다. (IVFIndex는 처음 맞춘 중심점에 배정만 한다)
+
+사용 예:
+    python new_model.py embed
+    python embedding_index.py --embedding_dir /tmp/embeddings_ch2 --index ivf --benchmark --output index_bench.json
+    python embedding_index.py --embedding_dir /tmp/embeddings_ch2 --duplicates 0.99
+    python embedding_index.py --embedding_dir /tmp/embeddings_ch2 --similar data/cat/0001.bin --k 5
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from bottleneck_store import BottleneckStore, _write_json
+
+EMBEDDING_SOURCES = ['bottleneck', 'hidden']
+INDEX_TYPES = ['exact', 'ivf']
+
+
+def l2_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.sqrt(np.sum(vectors * vectors, axis=1, keepdims=True))
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, ids, k):
+    """행마다 점수가 큰 k개를 내림차순으로 고른다. scores, ids는 [n, m]. 후보가 k개보다 적으면 -inf / -1로 채운다."""
+    if scores.shape[1] < k:
+        pad = k - scores.shape[1]
+        scores = np.concatenate([scores, np.full((len(scores), pad), -np.inf, dtype=np.float32)], axis=1)
+        ids = np.concatenate([ids, np.full((len(ids), pad), -1, dtype=np.int64)], axis=1)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind='mergesort')
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class ExactIndex(object):
+    """벡터를 [capacity, dim] 배열에 모아두고 쿼리와의 내적 전체에서 top-k를 고른다. 용량은 두 배씩 늘린다."""
+
+    def __init__(self, dim, capacity=1024):
+        self.dim = dim
+        self.vectors = np.zeros((max(int(capacity), 1), dim), dtype=np.float32)
+        self.ids = np.zeros(len(self.vectors), dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, vectors, ids):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        new_size = self.size + len(vectors)
+        if new_size > len(self.vectors):
+            capacity = len(self.vectors)
+            while capacity < new_size:
+                capacity *= 2
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = grown, grown_ids
+        self.vectors[self.size:new_size] = vectors
+        self.ids[self.size:new_size] = ids
+        self.size = new_size
+
+    def all_ids(self):
+        return self.ids[:self.size]
+
+    def search(self, queries, k=10, batch_size=256):
+        """리턴: (내적 [N, k], id [N, k]) 내적이 큰 순서"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        vectors = self.vectors[:self.size]
+        for start in range(0, len(queries), batch_size):
+            batch_scores = np.dot(queries[start:start + batch_size], vectors.T)
+            batch_ids = np.broadcast_to(self.ids[:self.size], batch_scores.shape)
+            scores[start:start + batch_size], ids[start:start + batch_size] = _top_k(batch_scores, batch_ids, k)
+        return scores, ids
+
+    def save(self, path):
+        np.savez(path, index_type='exact', vectors=self.vectors[:self.size], ids=self.ids[:self.size])
+
+    @classmethod
+    def from_arrays(cls, vectors, ids):
+        index = cls(vectors.shape[1], len(vectors))
+        index.add(vectors, ids)
+        return index
+
+
+class IVFIndex(object):
+    """
+    inverted file 인덱스. 벡터를 내적이 가장 큰 중심점의 리스트(ExactIndex)에 넣고,
+    쿼리는 내적이 큰 num_probe개 중심점의 리스트만 비교한다. num_probe를 늘리면 느려지고 recall이 올라간다.
+    """
+
+    def __init__(self, centroids, num_probe=8):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.dim = self.centroids.shape[1]
+        self.num_probe = num_probe
+        self.lists = [ExactIndex(self.dim, 64) for _ in range(len(self.centroids))]
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return sum(len(inverted_list) for inverted_list in self.lists)
+
+    @classmethod
+    def train(cls, vectors, num_lists, num_probe=8, num_iterations=10, max_train_examples=50000, seed=0):
+        """vectors(정규화한 임베딩)에서 최대 max_train_examples개를 뽑아 spherical k-means로 중심점을 맞춘다."""
+        random_state = np.random.RandomState(seed)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > max_train_examples:
+            vectors = vectors[np.sort(random_state.choice(len(vectors), max_train_examples, replace=False))]
+        num_lists = max(1, min(num_lists, len(vectors)))
+        centroids = vectors[random_state.choice(len(vectors), num_lists, replace=False)]
+        for _ in range(num_iterations):
+            assignments = cls._assign(centroids, vectors)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=num_lists)
+            ## 비어버린 리스트는 임의의 벡터로 다시 시작한다.
+            empty = np.flatnonzero(counts == 0)
+            sums[empty] = vectors[random_state.choice(len(vectors), len(empty))]
+            centroids = l2_normalize(sums)
+        return cls(centroids, num_probe)
+
+    @staticmethod
+    def _assign(centroids, vectors, chunk_size=4096):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            assignments[start:start + chunk_size] = np.argmax(
+                np.dot(vectors[start:start + chunk_size], centroids.T), axis=1)
+        return assignments
+
+    def add(self, vectors, ids):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=np.int64)
+        assignments = self._assign(self.centroids, vectors)
+        for list_index in np.unique(assignments):
+            mask = assignments == list_index
+            self.lists[list_index].add(vectors[mask], ids[mask])
+
+    def all_ids(self):
+        return np.concatenate([inverted_list.all_ids() for inverted_list in self.lists])
+
+    def search(self, queries, k=10, batch_size=256, num_probe=None):
+        """리턴: (내적 [N, k], id [N, k]) 내적이 큰 순서. 살펴본 리스트의 후보가 k개보다 적으면 -inf / -1로 채운다."""
+        num_probe = min(num_probe or self.num_probe, self.num_lists)
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            probes = np.argpartition(-np.dot(batch, self.centroids.T), num_probe - 1, axis=1)[:, :num_probe]
+            best_scores = np.full((len(batch), k), -np.inf, dtype=np.float32)
+            best_ids = np.full((len(batch), k), -1, dtype=np.int64)
+            ## 리스트마다 그 리스트를 보는 쿼리만 모아 한 번의 행렬곱으로 계산하고 지금까지의 top-k와 합친다.
+            for list_index in np.unique(probes):
+                inverted_list = self.lists[list_index]
+                if not len(inverted_list):
+                    continue
+                query_rows = np.flatnonzero(np.any(probes == list_index, axis=1))
+                list_scores = np.dot(batch[query_rows], inverted_list.vectors[:inverted_list.size].T)
+                list_ids = np.broadcast_to(inverted_list.all_ids(), list_scores.shape)
+                best_scores[query_rows], best_ids[query_rows] = _top_k(
+                    np.concatenate([best_scores[query_rows], list_scores], axis=1),
+                    np.concatenate([best_ids[query_rows], list_ids], axis=1), k)
+            scores[start:start + batch_size] = best_scores
+            ids[start:start + batch_size] = best_ids
+        return scores, ids
+
+    def save(self, path):
+        list_sizes = np.array([len(inverted_list) for inverted_list in self.lists], dtype=np.int64)
+        vectors = np.concatenate([inverted_list.vectors[:inverted_list.size] for inverted_list in self.lists])
+        np.savez(path, index_type='ivf', centroids=self.centroids, num_probe=self.num_probe, list_sizes=list_sizes,
+                 vectors=vectors, ids=self.all_ids())
+
+
+def load_index(path):
+    with np.load(path) as f:
+        if str(f['index_type']) == 'exact':
+            return ExactIndex.from_arrays(f['vectors'], f['ids'])
+        index = IVFIndex(f['centroids'], int(f['num_probe']))
+        start = 0
+        for list_index, list_size in enumerate(f['list_sizes']):
+            index.lists[list_index].add(f['vectors'][start:start + list_size], f['ids'][start:start + list_size])
+            start += list_size
+        return index
+
+
+def create_index(index_type, vectors, ids, num_lists=64, num_probe=8, seed=0, chunk_size=4096):
+    """
+    vectors로 인덱스를 만든다. 'ivf'는 먼저 중심점을 맞춘다.
+    리턴: (인덱스, {'train_sec', 'add_sec', 'adds_per_sec'})
+    """
+    start = time.time()
+    if index_type == 'exact':
+        index = ExactIndex(vectors.shape[1], len(vectors))
+    elif index_type == 'ivf':
+        index = IVFIndex.train(vectors, num_lists, num_probe, seed=seed)
+    else:
+        raise ValueError('Unknown index type: %s' % index_type)
+    train_sec = time.time() - start
+    add_sec = add_to_index(index, vectors, ids, chunk_size)
+    return index, {'train_sec': train_sec, 'add_sec': add_sec, 'adds_per_sec': len(vectors) / max(add_sec, 1e-9)}
+
+
+def add_to_index(index, vectors, ids, chunk_size=4096):
+    """chunk_size개씩 나눠 추가하고 걸린 시간을 리턴한다."""
+    start = time.time()
+    for chunk_start in range(0, len(vectors), chunk_size):
+        index.add(np.asarray(vectors[chunk_start:chunk_start + chunk_size], dtype=np.float32),
+                  ids[chunk_start:chunk_start + chunk_size])
+    return time.time() - start
+
+
+############################################ 임베딩 저장소 ###############################################################
+
+class EmbeddingStore(object):
+    """
+    <embedding_dir>/features : L2 정규화한 임베딩 BottleneckStore (키는 원래 보틀넥 저장소와 같다)
+    <embedding_dir>/embedding.json : source, dim, fingerprint, 행마다의 [레이블, 파일 경로]
+    fingerprint가 바뀌면(원래 보틀넥 저장소나 frozen graph가 바뀐 경우) 디렉토리를 비우고 다시 만든다.
+    """
+
+    METADATA_FILENAME = 'embedding.json'
+
+    def __init__(self, embedding_dir, source, dim, fingerprint, dtype='float16', capacity=1024):
+        metadata_path = os.path.join(embedding_dir, self.METADATA_FILENAME)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+            if metadata['fingerprint'] != fingerprint or metadata['dim'] != dim:
+                shutil.rmtree(embedding_dir)
+        self.embedding_dir = embedding_dir
+        self.source = source
+        self.fingerprint = fingerprint
+        self.store = BottleneckStore(os.path.join(embedding_dir, 'features'), dim, dtype=dtype, capacity=capacity,
+                                     fingerprint=fingerprint)
+        self.items = self._load_items()
+
+    def _load_items(self):
+        metadata_path = os.path.join(self.embedding_dir, self.METADATA_FILENAME)
+        if not os.path.exists(metadata_path):
+            return []
+        with open(metadata_path, 'r') as f:
+            return json.load(f)['items']
+
+    def add(self, source_store, keys, items, transform_fn=None, chunk_size=4096):
+        """
+        keys(원래 저장소의 키)의 보틀넥을 transform_fn으로 바꾸고 정규화해 저장한다. 이미 저장된 키는 건너뛴다.
+        items[i]는 keys[i]의 [레이블, 파일 경로]. 리턴: (새로 저장한 수, 걸린 시간)
+        """
+        start = time.time()
+        missing = [i for i, key in enumerate(keys) if not self.store.is_valid(key)]
+        for chunk_start in range(0, len(missing), chunk_size):
+            chunk_keys = [keys[i] for i in missing[chunk_start:chunk_start + chunk_size]]
+            vectors = np.asarray(source_store.get_rows([source_store.row(key) for key in chunk_keys]),
+                                 dtype=np.float32)
+            if transform_fn is not None:
+                vectors = transform_fn(vectors)
+            self.store.put_many(chunk_keys, l2_normalize(vectors))
+        self.items += [None] * (len(self.store) - len(self.items))
+        for key, item in zip(keys, items):
+            self.items[self.store.row(key)] = list(item)
+        self.flush()
+        return len(missing), time.time() - start
+
+    def vectors(self):
+        """valid한 행의 (행 번호, 임베딩 [N, dim] memmap view 또는 복사본)"""
+        rows = np.flatnonzero(self.store.valid[:len(self.store)])
+        if len(rows) == len(self.store):
+            return rows, self.store.data[:len(rows)]
+        return rows, self.store.get_rows(rows)
+
+    def flush(self):
+        self.store.flush()
+        _write_json(os.path.join(self.embedding_dir, self.METADATA_FILENAME),
+                    {'source': self.source, 'dim': self.store.dim, 'fingerprint': self.fingerprint,
+                     'items': self.items})
+
+    @classmethod
+    def open(cls, embedding_dir):
+        with open(os.path.join(embedding_dir, cls.METADATA_FILENAME), 'r') as f:
+            metadata = json.load(f)
+        return cls(embedding_dir, metadata['source'], metadata['dim'], metadata['fingerprint'])
+
+
+def embedding_fingerprint(source, source_fingerprint, graph_hash=''):
+    return hashlib.sha1('{}:{}:{}'.format(source, source_fingerprint, graph_hash).encode('ascii')).hexdigest()
+
+
+def load_or_create_index(embedding_store, index_path, index_type='exact', num_lists=64, num_probe=8, seed=0):
+    """
+    index_path에 저장한 인덱스가 있으면 불러와 아직 없는 행만 추가하고, 없으면 새로 만든다. 바뀌었으면 다시 저장한다.
+    리턴: (인덱스, 비용 기록 dict)
+    """
+    rows, vectors = embedding_store.vectors()
+    if index_path and os.path.exists(index_path):
+        start = time.time()
+        index = load_index(index_path)
+        load_sec = time.time() - start
+        new = np.flatnonzero(~np.isin(rows, index.all_ids()))
+        add_sec = add_to_index(index, vectors[new], rows[new])
+        report = {'load_sec': load_sec, 'add_sec': add_sec, 'num_added': len(new)}
+    else:
+        index, report = create_index(index_type, vectors, rows, num_lists, num_probe, seed)
+        report['num_added'] = len(rows)
+    if index_path and report['num_added']:
+        index.save(index_path)
+    report['size'] = len(index)
+    return index, report
+
+
+################################################ 활용 ##################################################################
+
+def find_duplicates(index, vectors, ids, threshold=0.99, k=5, batch_size=256):
+    """
+    vectors마다 k개의 이웃을 찾아 내적이 threshold 이상인 쌍 (id_a, id_b, 내적)을 id_a < id_b로 한 번씩 리턴한다.
+    """
+    pairs = {}
+    for start in range(0, len(vectors), batch_size):
+        scores, neighbors = index.search(vectors[start:start + batch_size], k + 1, batch_size)
+        for query_id, row_scores, row_neighbors in zip(ids[start:start + batch_size], scores, neighbors):
+            for score, neighbor in zip(row_scores, row_neighbors):
+                if score < threshold:
+                    break
+                if neighbor >= 0 and neighbor != query_id:
+                    pair = (min(query_id, neighbor), max(query_id, neighbor))
+                    pairs[pair] = max(pairs.get(pair, score), score)
+    return sorted(((int(a), int(b), float(score)) for (a, b), score in pairs.items()), key=lambda pair: -pair[2])
+
+
+def benchmark_index(index, queries, k=10, batch_sizes=(1, 32, 256), reference=None, num_probes=None):
+    """
+    batch_size마다 queries 전체를 검색하는 초당 쿼리 수와 배치 지연 시간을 잰다.
+    reference(ExactIndex)를 넘기면 그 결과 대비 recall@k도 계산한다. IVFIndex면 num_probes마다 따로 잰다.
+    """
+    if reference is not None:
+        _, exact_ids = reference.search(queries, k)
+    results = []
+    for num_probe in (num_probes or [None]) if isinstance(index, IVFIndex) else [None]:
+        for batch_size in batch_sizes:
+            kwargs = {} if num_probe is None else {'num_probe': num_probe}
+            latencies = []
+            found = []
+            for start in range(0, len(queries), batch_size):
+                batch_start = time.time()
+                _, ids = index.search(queries[start:start + batch_size], k, batch_size, **kwargs)
+                latencies.append(time.time() - batch_start)
+                found.append(ids)
+            total_sec = max(sum(latencies), 1e-9)
+            result = {'batch_size': batch_size, 'num_queries': len(queries), 'qps': len(queries) / total_sec}
+            if num_probe is not None:
+                result['num_probe'] = num_probe
+            latencies_ms = np.array(latencies) * 1000.0
+            result.update({'p50_ms': float(np.percentile(latencies_ms, 50)),
+                           'p99_ms': float(np.percentile(latencies_ms, 99))})
+            if reference is not None:
+                found = np.concatenate(found)
+                hits = sum(len(np.intersect1d(a[a >= 0], b[b >= 0])) for a, b in zip(found, exact_ids))
+                result['recall_at_k'] = hits / float(max(np.sum(exact_ids >= 0), 1))
+            results.append(result)
+    return results
+
+
+def print_neighbors(embedding_store, query_row, scores, neighbors):
+    label, filename = embedding_store.items[query_row]
+    print('%s (%s)와 비슷한 예제:' % (filename, label))
+    for score, neighbor in zip(scores, neighbors):
+        if neighbor >= 0 and neighbor != query_row:
+            print('  %.4f  %-20s %s' % (score, embedding_store.items[neighbor][0],
+                                         embedding_store.items[neighbor][1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='저장한 임베딩으로 최근접 이웃 인덱스를 만들어 조회 / 중복 찾기 / 벤치마크를 한다.')
+    parser.add_argument('--embedding_dir', default='/tmp/embeddings_ch2')
+    parser.add_argument('--index', choices=INDEX_TYPES, default='exact')
+    parser.add_argument('--index_path', default=None, help='인덱스를 저장 / 불러올 .npz 경로. 있으면 새 행만 추가한다.')
+    parser.add_argument('--num_lists', type=int, default=64)
+    parser.add_argument('--num_probe', type=int, default=8)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--similar', nargs='+', default=[], help='비슷한 예제를 찾을 파일 경로 (임베딩을 저장한 경로)')
+    parser.add_argument('--duplicates', type=float, default=None, help='이 내적(코사인 유사도) 이상인 쌍을 출력한다.')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--num_queries', type=int, default=1000)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('--num_probes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--output', default=None, help='중복 쌍 / 벤치마크 결과를 저장할 JSON 경로')
+    args = parser.parse_args()
+
+    embedding_store = EmbeddingStore.open(args.embedding_dir)
+    index, index_report = load_or_create_index(embedding_store, args.index_path, args.index, args.num_lists,
+                                               args.num_probe, args.seed)
+    print('인덱스 (%s): %d개, %s' % (args.index, len(index), json.dumps(index_report, sort_keys=True)))
+    rows, vectors = embedding_store.vectors()
+    results = {'config': vars(args), 'index': index_report}
+
+    row_by_filename = dict((item[1], row) for row, item in enumerate(embedding_store.items) if item)
+    for filename in args.similar:
+        if filename not in row_by_filename:
+            print('임베딩이 없습니다: %s' % filename)
+            continue
+        query_row = row_by_filename[filename]
+        scores, neighbors = index.search(embedding_store.store.get_rows([query_row]), args.k + 1)
+        print_neighbors(embedding_store, query_row, scores[0], neighbors[0])
+
+    if args.duplicates is not None:
+        start = time.time()
+        pairs = find_duplicates(index, vectors, rows, args.duplicates)
+        print('내적 %.4f 이상인 쌍 %d개 (%.2fs)' % (args.duplicates, len(pairs), time.time() - start))
+        for a, b, score in pairs:
+            print('  %.4f  %s  %s' % (score, embedding_store.items[a][1], embedding_store.items[b][1]))
+        results['duplicates'] = [[embedding_store.items[a][1], embedding_store.items[b][1], score]
+                                 for a, b, score in pairs]
+
+    if args.benchmark:
+        queries = np.asarray(vectors[np.random.RandomState(args.seed).choice(
+            len(rows), min(args.num_queries, len(rows)), replace=False)], dtype=np.float32)
+        reference = index if isinstance(index, ExactIndex) else ExactIndex.from_arrays(
+            np.asarray(vectors, dtype=np.float32), rows)
+        results['benchmark'] = benchmark_index(index, queries, args.k, args.batch_sizes, reference, args.num_probes)
+        print('%9s %10s %10s %9s %9s %9s' % ('num_probe', 'batch_size', 'qps', 'p50_ms', 'p99_ms', 'recall'))
+        for result in results['benchmark']:
+            print('%9s %10d %10.1f %9.2f %9.2f %8.1f%%' % (
+                result.get('num_probe', '-'), result['batch_size'], result['qps'], result['p50_ms'],
+                result['p99_ms'], result['recall_at_k'] * 100))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('결과 저장: %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+보틀넥 배열을 청크 단위로 분류해 정확도, 클래스별 precision / recall, confusion matrix를 계산하고
+결과를 JSON / CSV 파일로 저장한다. 그림은 화면에 띄우지 않고 파일로 저장하므로 headless 환경에서도 멈추지 않는다.
+"""
+import csv
+import json
+import os
+
+import numpy as np
+
+
+def confusion_matrix(labels, predictions, class_count):
+    """[class_count, class_count] 행렬. 행은 정답, 열은 예측. bincount 한 번으로 계산한다."""
+    labels = np.asarray(labels, dtype=np.int64)
+    predictions = np.asarray(predictions, dtype=np.int64)
+    return np.bincount(labels * class_count + predictions,
+                       minlength=class_count * class_count).reshape(class_count, class_count)
+
+
+def evaluate_chunks(predict_fn, chunks, class_count):
+    """
+    chunks가 내는 (입력, 정수 레이블)마다 predict_fn(입력) -> 예측 레이블을 불러 confusion matrix를 누적한다.
+    리턴: (confusion matrix, 입력 순서대로의 예측 레이블, 정답 레이블)
+    """
+    cm = np.zeros((class_count, class_count), dtype=np.int64)
+    predictions = []
+    all_labels = []
+    for inputs, labels in chunks:
+        chunk_predictions = np.asarray(predict_fn(inputs))
+        cm += confusion_matrix(labels, chunk_predictions, class_count)
+        predictions.append(chunk_predictions)
+        all_labels.append(np.asarray(labels))
+    if not predictions:
+        return cm, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return cm, np.concatenate(predictions), np.concatenate(all_labels)
+
+
+def classification_metrics(cm, class_names):
+    """confusion matrix로 정확도와 클래스별 precision / recall / f1 / support를 계산한다."""
+    cm = np.asarray(cm, dtype=np.float64)
+    true_positives = np.diag(cm)
+    support = cm.sum(axis=1)
+    predicted = cm.sum(axis=0)
+    total = cm.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        'accuracy': float(true_positives.sum() / total) if total else 0.0,
+        'num_examples': int(total),
+        'per_class': [{'class': class_name, 'precision': float(p), 'recall': float(r), 'f1': float(f),
+                       'support': int(s)}
+                      for class_name, p, r, f, s in zip(class_names, precision, recall, f1, support)],
+        'macro_precision': float(precision.mean()),
+        'macro_recall': float(recall.mean()),
+    }
+
+
+def write_metrics(metrics_dir, name, cm, class_names, extra=None):
+    """
+    <metrics_dir>/<name>_metrics.json : 정확도, 클래스별 지표, confusion matrix
+    <metrics_dir>/<name>_confusion_matrix.csv : 행은 정답, 열은 예측
+    """
+    if not os.path.exists(metrics_dir):
+        os.makedirs(metrics_dir)
+    metrics = classification_metrics(cm, class_names)
+    metrics['confusion_matrix'] = np.asarray(cm).tolist()
+    metrics['class_names'] = list(class_names)
+    if extra:
+        metrics.update(extra)
+    with open(os.path.join(metrics_dir, name + '_metrics.json'), 'w') as f:
+        json.dump(metrics, f, indent=2)
+    with open(os.path.join(metrics_dir, name + '_confusion_matrix.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['true\\predicted'] + list(class_names))
+        for class_name, row in zip(class_names, np.asarray(cm)):
+            writer.writerow([class_name] + [int(v) for v in row])
+    return metrics
+
+
+def write_history(metrics_dir, history):
+    """평가 스텝마다의 기록(dict 리스트)을 <metrics_dir>/history.csv로 저장한다."""
+    if not history:
+        return
+    if not os.path.exists(metrics_dir):
+        os.makedirs(metrics_dir)
+    columns = sorted(history[0].keys(), key=lambda column: (column != 'epoch', column))
+    with open(os.path.join(metrics_dir, 'history.csv'), 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in history:
+            writer.writerow(row)
+
+
+def print_metrics(name, metrics):
+    print('%s 정확도 = %.1f%% (N=%d)' % (name, metrics['accuracy'] * 100, metrics['num_examples']))
+    for row in metrics['per_class']:
+        print('  %-10s precision %.3f  recall %.3f  f1 %.3f  (N=%d)' % (
+            row['class'], row['precision'], row['recall'], row['f1'], row['support']))
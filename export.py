@@ -0,0 +1,229 @@
+"""
+new_model.py가 저장한 frozen graph(output_graph)를 CPU 추론용으로 줄여서 저장하고,
+원래 그래프와 테스트셋 정확도 / latency / 파일 크기를 비교한다.
+
+    - 공통: 드롭아웃 스위치를 False로 고정, 쓰지 않는 노드(DecodeJpeg 등) 제거, 상수 접기, batch norm 접기
+    - 'int8'    : 가중치를 8비트로 양자화해서 저장한다. (실행할 때 float으로 복원)
+    - 'float16' : 큰 가중치 상수를 float16으로 저장하고 Cast로 float32로 되돌린다.
+
+사용 예:
+    python export.py --graph /tmp/output_graph_ch2.pb --labels /tmp/output_labels_ch2.txt \
+        --modes int8 float16 --image_dir data --report /tmp/export_report.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2
+from tensorflow.python.framework import tensor_util
+from tensorflow.python.platform import gfile
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from inference import DROPOUT_TENSOR_NAME, FrozenClassifier, INPUT_TENSOR_NAME, OUTPUT_TENSOR_NAME, run_inference
+
+EXPORT_MODES = ['float32', 'int8', 'float16']
+BASE_TRANSFORMS = [
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+]
+
+
+def load_graph_def(graph_path):
+    with gfile.FastGFile(graph_path, 'rb') as f:
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def _input_type_name(graph_def, input_name):
+    """strip_unused_nodes에 넘길 입력 placeholder의 타입 이름 ('uint8' / 'float')"""
+    for node in graph_def.node:
+        if node.name == input_name:
+            dtype = tf.as_dtype(node.attr['dtype'].type)
+            return 'float' if dtype == tf.float32 else dtype.name
+    raise ValueError('입력 노드가 그래프에 없습니다: %s' % input_name)
+
+
+def freeze_dropout(graph_def, dropout_name=DROPOUT_TENSOR_NAME.split(':')[0]):
+    """
+    드롭아웃 스위치(기본값 True인 placeholder_with_default)를 False 상수로 바꾼다.
+    상수 접기가 스위치를 기본값으로 접어 추론 때 드롭아웃이 켜지는 것을 막고, 드롭아웃 노드도 함께 접힌다.
+    """
+    output_graph_def = tf.GraphDef()
+    output_graph_def.CopyFrom(graph_def)
+    for node in output_graph_def.node:
+        if node.name == dropout_name:
+            node.op = 'Const'
+            del node.input[:]
+            node.attr.clear()
+            node.attr['dtype'].CopyFrom(attr_value_pb2.AttrValue(type=tf.bool.as_datatype_enum))
+            node.attr['value'].CopyFrom(attr_value_pb2.AttrValue(
+                tensor=tensor_util.make_tensor_proto(False, tf.bool)))
+    return output_graph_def
+
+
+def cast_weights_to_float16(graph_def, min_elements=1024):
+    """
+    원소가 min_elements개 이상인 float32 Const를 float16 Const + Cast(float32)로 바꾼다.
+    Cast 노드가 원래 이름을 쓰므로 이 상수를 쓰던 노드는 고치지 않아도 된다.
+    """
+    output_graph_def = tf.GraphDef()
+    for node in graph_def.node:
+        if node.op == 'Const' and node.attr['dtype'].type == tf.float32.as_datatype_enum:
+            value = tensor_util.MakeNdarray(node.attr['value'].tensor)
+            if value.size >= min_elements:
+                half_node = output_graph_def.node.add()
+                half_node.op = 'Const'
+                half_node.name = node.name + '/float16'
+                half_node.device = node.device
+                half_node.attr['dtype'].CopyFrom(attr_value_pb2.AttrValue(type=tf.float16.as_datatype_enum))
+                half_node.attr['value'].CopyFrom(attr_value_pb2.AttrValue(
+                    tensor=tensor_util.make_tensor_proto(value.astype(np.float16), tf.float16, value.shape)))
+
+                cast_node = output_graph_def.node.add()
+                cast_node.op = 'Cast'
+                cast_node.name = node.name
+                cast_node.device = node.device
+                cast_node.input.append(half_node.name)
+                cast_node.attr['SrcT'].CopyFrom(attr_value_pb2.AttrValue(type=tf.float16.as_datatype_enum))
+                cast_node.attr['DstT'].CopyFrom(attr_value_pb2.AttrValue(type=tf.float32.as_datatype_enum))
+                continue
+        output_graph_def.node.extend([node])
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    return output_graph_def
+
+
+def transform_graph(graph_def, mode, input_name=INPUT_TENSOR_NAME.split(':')[0],
+                    output_name=OUTPUT_TENSOR_NAME.split(':')[0]):
+    """mode('float32' / 'int8' / 'float16')에 맞게 graph transform을 적용한 GraphDef를 리턴한다."""
+    if mode not in EXPORT_MODES:
+        raise ValueError('Unknown export mode: %s' % mode)
+    transforms = (['strip_unused_nodes(type=%s)' % _input_type_name(graph_def, input_name)] + BASE_TRANSFORMS)
+    if mode == 'int8':
+        transforms.append('quantize_weights')
+    transforms.append('sort_by_execution_order')
+    transformed = TransformGraph(freeze_dropout(graph_def), [input_name], [output_name], transforms)
+    if mode == 'float16':
+        transformed = cast_weights_to_float16(transformed)
+    return transformed
+
+
+def export_variants(graph_path, modes):
+    """
+    graph_path 옆에 <이름>_<mode>.pb로 변환한 그래프를 저장하고 {mode: 경로}를 리턴한다.
+    'float32'는 변환만 하고 정밀도는 그대로 둔 그래프이다.
+    """
+    graph_def = load_graph_def(graph_path)
+    base_path = os.path.splitext(graph_path)[0]
+    paths = {}
+    for mode in modes:
+        start = time.time()
+        transformed = transform_graph(graph_def, mode)
+        paths[mode] = '%s_%s.pb' % (base_path, mode)
+        with gfile.FastGFile(paths[mode], 'wb') as f:
+            f.write(transformed.SerializeToString())
+        print('export %-8s: %s (%.1f MB, 노드 %d -> %d개, %.2fs)' % (
+            mode, paths[mode], os.path.getsize(paths[mode]) / 1024.0 ** 2, len(graph_def.node),
+            len(transformed.node), time.time() - start))
+    return paths
+
+
+def compare_graphs(graph_paths, labels_path, image_paths, true_labels, batch_size=32, num_workers=4):
+    """
+    graph_paths({이름: 경로})의 각 그래프로 image_paths를 분류해
+    정확도, 기준 그래프('original')와의 정확도 차이 / 예측 일치율, 처리량, 배치 latency, 파일 크기를 리턴한다.
+    """
+    label_of = dict(zip(image_paths, true_labels))
+    predictions = {}
+    report = {}
+    for name, graph_path in graph_paths.items():
+        classifier = FrozenClassifier(graph_path, labels_path)
+        start = time.time()
+        done_paths, probabilities, batch_latencies = run_inference(classifier, image_paths, batch_size, num_workers)
+        elapsed_sec = time.time() - start
+        classifier.close()
+
+        order = np.argsort(done_paths)
+        predicted = probabilities.argmax(axis=1)[order]
+        labels = np.array([label_of[done_paths[i]] for i in order])
+        predictions[name] = predicted
+        latencies_ms = np.array(batch_latencies) * 1000.0
+        report[name] = {
+            'graph': graph_path,
+            'size_bytes': os.path.getsize(graph_path),
+            'accuracy': float(np.mean(predicted == labels)) if len(labels) else 0.0,
+            'images_per_sec': len(done_paths) / elapsed_sec if elapsed_sec else 0.0,
+            'batch_latency_p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0.0,
+            'batch_latency_p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0.0,
+        }
+    if 'original' in report:
+        for name, row in report.items():
+            row['accuracy_delta'] = row['accuracy'] - report['original']['accuracy']
+            row['agreement'] = float(np.mean(predictions[name] == predictions['original']))
+    return report
+
+
+def print_export_report(report):
+    print('%-10s %9s %9s %9s %10s %9s %9s' % ('variant', 'size(MB)', 'accuracy', 'delta', 'agreement',
+                                             'images/s', 'p50(ms)'))
+    for name, row in report.items():
+        print('%-10s %9.1f %8.2f%% %+8.2f%% %9.2f%% %9.1f %9.1f' % (
+            name, row['size_bytes'] / 1024.0 ** 2, row['accuracy'] * 100, row.get('accuracy_delta', 0.0) * 100,
+            row.get('agreement', 1.0) * 100, row['images_per_sec'], row['batch_latency_p50_ms']))
+
+
+def export_and_compare(graph_path, labels_path, modes, image_paths, true_labels, report_path=None,
+                       batch_size=32, num_workers=4):
+    """변환한 그래프를 저장하고 원래 그래프와 비교한 결과를 출력 / 저장한다."""
+    graph_paths = {'original': graph_path}
+    graph_paths.update(export_variants(graph_path, modes))
+    if not image_paths:
+        print('비교할 테스트 이미지가 없어 변환만 했습니다.')
+        return None
+    report = compare_graphs(graph_paths, labels_path, image_paths, true_labels, batch_size, num_workers)
+    print_export_report(report)
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('export 비교 결과 저장: %s' % report_path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='frozen graph를 양자화 / float16으로 변환하고 정확도와 속도를 비교한다.')
+    parser.add_argument('--graph', default='/tmp/output_graph_ch2.pb')
+    parser.add_argument('--labels', default='/tmp/output_labels_ch2.txt')
+    parser.add_argument('--modes', nargs='+', choices=EXPORT_MODES, default=['int8', 'float16'])
+    parser.add_argument('--image_dir', help='클래스 폴더가 있는 디렉토리. 주면 testing split으로 비교한다.')
+    parser.add_argument('--testing_percentage', type=int, default=25)
+    parser.add_argument('--validation_percentage', type=int, default=25)
+    parser.add_argument('--report', default='/tmp/export_report_ch2.json')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    args = parser.parse_args()
+
+    image_paths = []
+    true_labels = []
+    if args.image_dir:
+        import new_model
+        with open(args.labels, 'r') as f:
+            label_names = [line.strip() for line in f if line.strip()]
+        image_lists = new_model.create_image_lists(args.image_dir, args.testing_percentage,
+                                                   args.validation_percentage)
+        for label_index, label_name in enumerate(label_names):
+            for index in range(len(image_lists.get(label_name, {}).get('testing', []))):
+                image_paths.append(new_model.get_image_path(image_lists, label_name, index, args.image_dir,
+                                                            'testing'))
+                true_labels.append(label_index)
+    export_and_compare(args.graph, args.labels, args.modes, image_paths, true_labels, args.report,
+                       args.batch_size, args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
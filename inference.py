@@ -0,0 +1,150 @@
+"""
+new_model.py가 저장한 frozen graph(output_graph)로 pickle array를 분류한다.
+그래프는 한 번만 불러오고, 입력은 워커 스레드가 미리 불러와 batch_size개씩 한 번에 넣는다.
+
+사용 예:
+    python inference.py --graph /tmp/output_graph_ch2.pb --labels /tmp/output_labels_ch2.txt \
+        --output /tmp/predictions.npz data/new_samples
+"""
+import argparse
+import csv
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.platform import gfile
+
+from input_pipeline import PrefetchPipeline, list_input_files, load_image_array, map_shape_groups
+
+INPUT_TENSOR_NAME = 'batch_input/BatchInput:0'
+OUTPUT_TENSOR_NAME = 'final_result:0'
+DROPOUT_TENSOR_NAME = 'FC_layer/dropout_while_training:0'
+
+
+class FrozenClassifier(object):
+    """frozen graph를 한 번 불러와 세션을 열어두고 배치 단위로 분류한다."""
+
+    def __init__(self, graph_path, labels_path=None, intra_op_threads=0, inter_op_threads=0):
+        graph = tf.Graph()
+        with graph.as_default():
+            with gfile.FastGFile(graph_path, 'rb') as f:
+                graph_def = tf.GraphDef()
+                graph_def.ParseFromString(f.read())
+            tf.import_graph_def(graph_def, name='')
+        self.graph = graph
+        self.input_tensor = graph.get_tensor_by_name(INPUT_TENSOR_NAME)
+        self.output_tensor = graph.get_tensor_by_name(OUTPUT_TENSOR_NAME)
+
+        ## 학습 때 기본값이 True인 드롭아웃 스위치가 그래프에 남아있으므로 추론할 때는 꺼야 한다.
+        self.feed_defaults = {}
+        try:
+            self.feed_defaults[graph.get_tensor_by_name(DROPOUT_TENSOR_NAME)] = False
+        except KeyError:
+            pass
+
+        self.labels = None
+        if labels_path:
+            with open(labels_path, 'r') as f:
+                self.labels = [line.strip() for line in f if line.strip()]
+
+        config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                inter_op_parallelism_threads=inter_op_threads)
+        self.sess = tf.Session(graph=graph, config=config)
+
+    def predict_batch(self, image_batch):
+        """[N, H, W, 1] 배치의 클래스 확률 [N, class_count]를 리턴한다."""
+        feed_dict = dict(self.feed_defaults)
+        feed_dict[self.input_tensor] = image_batch
+        return self.sess.run(self.output_tensor, feed_dict)
+
+    def predict(self, image_datas):
+        """크기가 다를 수 있는 array 리스트를 같은 shape끼리 묶어 분류하고 입력 순서대로 확률을 리턴한다."""
+        return map_shape_groups(self.predict_batch, image_datas)
+
+    def close(self):
+        self.sess.close()
+
+
+def run_inference(classifier, image_paths, batch_size=32, num_workers=4, queue_depth=64):
+    """
+    image_paths를 배치로 분류한다.
+    리턴: (처리한 경로 리스트, 확률 [N, class_count], 배치마다 sess.run에 걸린 시간 리스트)
+    """
+    pipeline = PrefetchPipeline(image_paths, load_image_array, num_workers, queue_depth)
+    done_paths = []
+    probabilities = []
+    batch_latencies = []
+    for chunk in pipeline.batches(batch_size):
+        start = time.time()
+        probabilities.append(classifier.predict([image_data for _, image_data in chunk]))
+        batch_latencies.append(time.time() - start)
+        done_paths.extend(image_path for image_path, _ in chunk)
+    pipeline.report()
+    if probabilities:
+        probabilities = np.concatenate(probabilities)
+    else:
+        probabilities = np.zeros((0, 0), dtype=np.float32)
+    return done_paths, probabilities, batch_latencies
+
+
+def write_predictions(output_path, image_paths, probabilities, labels=None):
+    """
+    예측 결과를 열 단위로 저장한다.
+    .csv면 path, prediction, label, 클래스별 확률 열을, 그 외에는 같은 열을 가진 .npz를 쓴다.
+    """
+    predictions = probabilities.argmax(axis=1) if len(probabilities) else np.zeros(0, dtype=np.int64)
+    if labels is None:
+        labels = [str(i) for i in range(probabilities.shape[1])]
+    predicted_labels = [labels[i] for i in predictions]
+
+    if output_path.endswith('.csv'):
+        with open(output_path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'prediction', 'label'] + ['p_' + label for label in labels])
+            for image_path, prediction, label, row in zip(image_paths, predictions, predicted_labels,
+                                                          probabilities):
+                writer.writerow([image_path, prediction, label] + ['%.6f' % p for p in row])
+    else:
+        np.savez(output_path, path=np.array(image_paths), prediction=predictions,
+                 label=np.array(predicted_labels), probabilities=probabilities,
+                 class_names=np.array(labels))
+
+
+def report_throughput(num_images, batch_latencies, elapsed_sec):
+    if not batch_latencies:
+        print('분류할 입력이 없습니다.')
+        return
+    latencies_ms = np.array(batch_latencies) * 1000.0
+    print('추론: %d개, %.1f images/sec, 배치 latency p50 %.1fms / p99 %.1fms' % (
+        num_images, num_images / elapsed_sec,
+        np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='frozen graph로 pickle array를 배치 분류한다.')
+    parser.add_argument('inputs', nargs='+', help='입력 파일 또는 디렉토리')
+    parser.add_argument('--graph', default='/tmp/output_graph_ch2.pb')
+    parser.add_argument('--labels', default='/tmp/output_labels_ch2.txt')
+    parser.add_argument('--output', default='/tmp/predictions_ch2.npz', help='.npz 또는 .csv')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--queue_depth', type=int, default=64)
+    args = parser.parse_args()
+
+    classifier = FrozenClassifier(args.graph, args.labels)
+    image_paths = list_input_files(args.inputs)
+
+    start = time.time()
+    done_paths, probabilities, batch_latencies = run_inference(
+        classifier, image_paths, args.batch_size, args.num_workers, args.queue_depth)
+    elapsed_sec = time.time() - start
+    classifier.close()
+
+    if done_paths:
+        write_predictions(args.output, done_paths, probabilities, classifier.labels)
+        print('예측 결과 저장: %s' % args.output)
+    report_throughput(len(done_paths), batch_latencies, elapsed_sec)
+
+
+if __name__ == '__main__':
+    main()
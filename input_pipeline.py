@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import pickle
+import resource
+import threading
+import time
+
+import numpy as np
+from numpy import newaxis
+from six.moves import queue
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'JPG', 'JPEG', 'bin']
+
+
+def load_raw_array(image_path):
+    """pickle로 저장된 2D array를 그대로 불러온다."""
+    with open(image_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def add_channel_axis(image_data):
+    """2D array에 채널 축만 붙여 [H, W, 1] view를 리턴한다. 3채널 복사는 그래프 안에서 한다."""
+    return image_data[:, :, newaxis]
+
+
+def stack_channels(image_data):
+    """2D array를 호스트에서 [H, W, 3]으로 쌓는 이전 방식. benchmark_preprocessing 비교용"""
+    image_data = image_data[:, :, newaxis]
+    image_data = np.concatenate((image_data, image_data, image_data), axis = 2)
+    return image_data
+
+
+def load_image_array(image_path):
+    """pickle로 저장된 2D array를 불러와 그래프 입력 [H, W, 1]로 만든다."""
+    ##############################################입력 데이터 수정 부분#################################################################
+    ################################pickle 불러와서 array로 넣는 부분################################
+    return add_channel_axis(load_raw_array(image_path))
+
+
+def group_by_shape(image_datas):
+    """array 리스트의 인덱스를 shape이 같은 것끼리 묶은 리스트. 그룹은 shape이 처음 나온 순서이다."""
+    groups = {}
+    for i, image_data in enumerate(image_datas):
+        groups.setdefault(image_data.shape, []).append(i)
+    return list(groups.values())
+
+
+def map_shape_groups(batch_fn, image_datas):
+    """
+    크기가 다를 수 있는 array 리스트를 같은 shape끼리 np.stack해 batch_fn(배치) -> [n, ...]으로 처리하고
+    결과를 입력 순서대로 모은 [N, ...] 배열을 리턴한다. 리스트가 비어 있으면 빈 float32 배열을 리턴한다.
+    """
+    results = None
+    for indices in group_by_shape(image_datas):
+        batch_results = np.asarray(batch_fn(np.stack([image_datas[i] for i in indices])))
+        if results is None:
+            results = np.zeros((len(image_datas),) + batch_results.shape[1:], dtype=batch_results.dtype)
+        results[indices] = batch_results
+    return results if results is not None else np.zeros((0,), dtype=np.float32)
+
+
+def _measure_preprocessing(image_paths, preprocess_name):
+    preprocess_fn = stack_channels if preprocess_name == 'stack_channels' else add_channel_axis
+    start = time.time()
+    image_datas = [preprocess_fn(load_raw_array(image_path)) for image_path in image_paths]
+    ## 같은 shape끼리 배치로 묶어 그래프에 넘길 배열까지 만든다.
+    groups = {}
+    for image_data in image_datas:
+        groups.setdefault(image_data.shape, []).append(image_data)
+    feed_bytes = sum(np.stack(group).nbytes for group in groups.values())
+    per_image_sec = (time.time() - start) / len(image_paths)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return per_image_sec, peak_rss, feed_bytes
+
+
+def benchmark_preprocessing(image_paths):
+    """
+    호스트에서 3채널로 쌓던 이전 전처리와 채널 축만 붙이는 지금 전처리를 비교한다.
+    최대 RSS는 프로세스 전체에서 줄어들지 않는 값이므로 방식마다 새 프로세스에서 잰다.
+    """
+    if not image_paths:
+        print('벤치마크할 이미지가 없습니다.')
+        return None
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for preprocess_name in ['stack_channels', 'add_channel_axis']:
+        pool = context.Pool(1)
+        try:
+            results[preprocess_name] = pool.apply(_measure_preprocessing, (image_paths, preprocess_name))
+        finally:
+            pool.close()
+            pool.join()
+        per_image_sec, peak_rss, feed_bytes = results[preprocess_name]
+        print('전처리 %-16s: %.2f ms/image, 최대 RSS %.1f MB, 그래프에 넘기는 크기 %.1f MB (N=%d)' % (
+            preprocess_name, per_image_sec * 1000, peak_rss / 1024.0 ** 2, feed_bytes / 1024.0 ** 2,
+            len(image_paths)))
+    return results
+
+
+def list_input_files(paths):
+    """파일은 그대로, 디렉토리는 하위의 입력 파일을 모두 찾아 정렬된 리스트로 리턴한다."""
+    image_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                for file_name in file_names:
+                    if os.path.splitext(file_name)[1][1:] in IMAGE_EXTENSIONS:
+                        image_paths.append(os.path.join(dir_path, file_name))
+        else:
+            image_paths.append(path)
+    return sorted(image_paths)
+
+
+class _WorkerError(object):
+    def __init__(self, item, error):
+        self.item = item
+        self.error = error
+
+
+_DONE = object()
+
+
+class PrefetchPipeline(object):
+    """
+    items를 워커 스레드에서 load_fn으로 불러와 크기가 queue_depth인 큐에 미리 채워둔다.
+    소비하는 쪽(세션 스레드)은 디스크 읽기나 unpickle을 기다리지 않고 큐에서 꺼내기만 한다.
+    결과는 끝난 순서대로 (item, 결과)로 나오며, num_workers가 0이면 소비하는 스레드에서 직접 불러온다.
+
+    stats
+    - load_sec          : 워커가 load_fn에 쓴 시간의 합
+    - producer_wait_sec : 큐가 가득 차서 워커가 기다린 시간의 합 (소비가 느림)
+    - consumer_wait_sec : 큐가 비어서 소비하는 쪽이 기다린 시간의 합 (불러오기가 느림)
+    """
+
+    def __init__(self, items, load_fn, num_workers=4, queue_depth=64):
+        self.items = list(items)
+        self.load_fn = load_fn
+        self.num_workers = num_workers
+        self.queue_depth = max(1, queue_depth)
+        self.stats = {'items': 0, 'load_sec': 0.0, 'producer_wait_sec': 0.0, 'consumer_wait_sec': 0.0}
+        self._lock = threading.Lock()
+
+    def _add_stat(self, name, value):
+        with self._lock:
+            self.stats[name] += value
+
+    def _worker(self, item_queue, result_queue, stop_event):
+        while not stop_event.is_set():
+            try:
+                item = item_queue.get_nowait()
+            except queue.Empty:
+                break
+            start = time.time()
+            try:
+                result = (item, self.load_fn(item))
+            except Exception as e:
+                result = _WorkerError(item, e)
+            loaded = time.time()
+            self._add_stat('load_sec', loaded - start)
+            self._put(result_queue, result, stop_event)
+            self._add_stat('producer_wait_sec', time.time() - loaded)
+        self._put(result_queue, _DONE, stop_event)
+
+    @staticmethod
+    def _put(result_queue, value, stop_event):
+        """소비하는 쪽이 중간에 멈추면 워커가 큐에서 영영 막히지 않도록 stop_event를 확인하며 넣는다."""
+        while not stop_event.is_set():
+            try:
+                result_queue.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        if self.num_workers <= 0:
+            for item in self.items:
+                start = time.time()
+                value = self.load_fn(item)
+                self._add_stat('load_sec', time.time() - start)
+                self.stats['items'] += 1
+                yield item, value
+            return
+
+        item_queue = queue.Queue()
+        for item in self.items:
+            item_queue.put(item)
+        result_queue = queue.Queue(maxsize=self.queue_depth)
+        stop_event = threading.Event()
+        threads = [threading.Thread(target=self._worker, args=(item_queue, result_queue, stop_event))
+                   for _ in range(self.num_workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            done = 0
+            while done < len(threads):
+                start = time.time()
+                result = result_queue.get()
+                self._add_stat('consumer_wait_sec', time.time() - start)
+                if result is _DONE:
+                    done += 1
+                    continue
+                if isinstance(result, _WorkerError):
+                    raise RuntimeError('파일 처리 중 에러 발생: %s (%s)' % (result.item, result.error))
+                self.stats['items'] += 1
+                yield result
+        finally:
+            stop_event.set()
+
+    def batches(self, batch_size):
+        """batch_size개씩 묶은 [(item, 결과), ...] 리스트를 리턴한다."""
+        batch = []
+        for result in self:
+            batch.append(result)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def report(self):
+        print('전처리 파이프라인: %d개, load %.2fs, 워커 대기(큐 가득) %.2fs, 세션 대기(큐 비어있음) %.2fs' % (
+            self.stats['items'], self.stats['load_sec'], self.stats['producer_wait_sec'],
+            self.stats['consumer_wait_sec']))
@@ -0,0 +1,125 @@
+"""
+학습 / 보틀넥 생성 구간별 시간 측정과 구조화된 로그
+
+    with timers.phase('train_step'):
+        sess.run(...)
+    timers.count('bottleneck_store_hit')
+
+timers는 모듈 전역 PhaseTimer로, 어디서든 import해서 같은 기록에 쌓는다.
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class PhaseTimer(object):
+    """
+    구간 이름마다 전체 횟수 / 누적 시간과 최근 window개의 소요 시간을 기록하고,
+    이름마다 정수 카운터를 둔다. 워커 스레드에서 불러도 된다.
+    """
+
+    def __init__(self, window=10000):
+        self.window = window
+        self.totals = {}
+        self.counters = collections.Counter()
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            if name not in self._durations:
+                self._durations[name] = collections.deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0]
+            self._durations[name].append(seconds)
+            self.totals[name][0] += 1
+            self.totals[name][1] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        """구간마다 {count, total_sec, mean_ms, p50_ms, p90_ms, p99_ms}. 백분위는 최근 window개 기준"""
+        with self._lock:
+            durations = dict((name, np.array(values) * 1000.0) for name, values in self._durations.items())
+            totals = dict((name, list(total)) for name, total in self.totals.items())
+        summary = {}
+        for name, values_ms in durations.items():
+            count, total_sec = totals[name]
+            summary[name] = {
+                'count': count,
+                'total_sec': total_sec,
+                'mean_ms': total_sec * 1000.0 / count,
+                'p50_ms': float(np.percentile(values_ms, 50)),
+                'p90_ms': float(np.percentile(values_ms, 90)),
+                'p99_ms': float(np.percentile(values_ms, 99)),
+            }
+        return summary
+
+    def report(self):
+        summary = self.summary()
+        print('%-28s %8s %10s %9s %9s %9s' % ('phase', 'count', 'total(s)', 'p50(ms)', 'p90(ms)', 'p99(ms)'))
+        for name, row in sorted(summary.items(), key=lambda item: -item[1]['total_sec']):
+            print('%-28s %8d %10.2f %9.2f %9.2f %9.2f' % (
+                name, row['count'], row['total_sec'], row['p50_ms'], row['p90_ms'], row['p99_ms']))
+        for name, value in sorted(self.counters.items()):
+            print('%-28s %8d' % (name, value))
+
+
+class ThroughputMeter(object):
+    """mark를 부를 때마다 직전 mark 이후의 steps/sec, samples/sec를 리턴한다."""
+
+    def __init__(self, steps=0, samples=0):
+        self._last = (time.time(), steps, samples)
+
+    def mark(self, steps, samples):
+        now = time.time()
+        last_time, last_steps, last_samples = self._last
+        self._last = (now, steps, samples)
+        elapsed_sec = max(now - last_time, 1e-9)
+        return (steps - last_steps) / elapsed_sec, (samples - last_samples) / elapsed_sec
+
+
+class JsonLinesLog(object):
+    """이벤트마다 {"time", "event", ...} 한 줄을 JSON으로 덧붙여 쓴다."""
+
+    def __init__(self, path):
+        log_dir = os.path.dirname(path)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self.path = path
+        self._file = open(path, 'a')
+
+    def write(self, event, **fields):
+        record = {'time': time.time(), 'event': event}
+        record.update(fields)
+        self._file.write(json.dumps(record, sort_keys=True, default=_to_builtin) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _to_builtin(value):
+    """numpy 스칼라 / 배열을 json으로 쓸 수 있게 바꾼다."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+timers = PhaseTimer()
@@ -0,0 +1,85 @@
+"""
+serve.py에 동시에 요청을 보내 처리량과 latency를 잰다.
+
+사용 예:
+    python load_test.py --port 8500 --concurrency 16 --requests 50 --height 299 --width 299
+    python load_test.py --port 8500 --inputs data/some_class
+"""
+import argparse
+import io
+import json
+import pickle
+import threading
+import time
+
+import numpy as np
+from six.moves import urllib
+
+from input_pipeline import list_input_files
+
+
+def post_array(url, image_data):
+    buffer = io.BytesIO()
+    np.save(buffer, image_data, allow_pickle=False)
+    request = urllib.request.Request(url, data=buffer.getvalue(),
+                                     headers={'Content-Type': 'application/octet-stream'})
+    response = urllib.request.urlopen(request)
+    return json.loads(response.read().decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='분류 서버 부하 테스트')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50, help='클라이언트 스레드마다 보낼 요청 수')
+    parser.add_argument('--inputs', nargs='*', help='보낼 pickle array 파일 또는 디렉토리. 없으면 임의 array')
+    parser.add_argument('--height', type=int, default=299)
+    parser.add_argument('--width', type=int, default=299)
+    args = parser.parse_args()
+
+    base_url = 'http://%s:%d' % (args.host, args.port)
+    if args.inputs:
+        samples = []
+        for image_path in list_input_files(args.inputs):
+            with open(image_path, 'rb') as f:
+                samples.append(pickle.load(f))
+    else:
+        samples = [np.random.uniform(0, 255, (args.height, args.width)).astype(np.float32) for _ in range(8)]
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(client_index):
+        for i in range(args.requests):
+            image_data = samples[(client_index + i) % len(samples)]
+            start = time.time()
+            try:
+                post_array(base_url + '/predict', image_data)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_sec = time.time() - start
+
+    latencies_ms = np.array(latencies) * 1000.0
+    print('요청 %d개 (실패 %d개), %.1f requests/sec' % (len(latencies), errors[0], len(latencies) / elapsed_sec))
+    if len(latencies_ms):
+        print('클라이언트 latency p50 %.1fms / p90 %.1fms / p99 %.1fms' % (
+            np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 90), np.percentile(latencies_ms, 99)))
+    metrics = json.loads(urllib.request.urlopen(base_url + '/metrics').read().decode('utf-8'))
+    print('서버 metrics: %s' % json.dumps(metrics, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
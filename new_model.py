@@ -1,15 +1,15 @@
 from datetime import datetime
 import hashlib
+import json
 import os.path
-import random
 import re
 import struct
 import sys
 import tarfile
-from tqdm import tqdm
+import threading
 import time
 import os
-import pickle
+import multiprocessing
 
 import numpy as np
 from numpy import newaxis
@@ -18,24 +18,109 @@ import tensorflow as tf
 
 from tensorflow.python.framework import graph_util
 from tensorflow.python.framework import tensor_shape
+from tensorflow.python.client import timeline
 from tensorflow.python.platform import gfile
 from tensorflow.python.util import compat
 
-import matplotlib.pyplot as plt
+from augmentation import DistortedBatchProducer, distort_arrays
+from bottleneck_cache import InMemoryBottleneckCache, LRUBottleneckCache
+from bottleneck_shards import (load_shard_offset, load_shard_plan, merge_shards, remove_shards, save_shard_offset,
+                               save_shard_plan, shard_store_dir, split_shards)
+from bottleneck_store import BottleneckStore, array_hash, content_key, file_hash
+from evaluation import evaluate_chunks, print_metrics, write_history, write_metrics
+from instrumentation import JsonLinesLog, ThroughputMeter, timers
+from input_pipeline import (IMAGE_EXTENSIONS, PrefetchPipeline, add_channel_axis, benchmark_preprocessing,
+                            load_image_array, load_raw_array, map_shape_groups)
+from projection import load_or_fit_projection, project_store, projection_dir
+from sampler import Sampler
 
 DATA_URL = 'http://download.tensorflow.org/models/image/imagenet/inception-2015-12-05.tgz'
 BOTTLENECK_TENSOR_NAME = 'pool_3/_reshape:0'
+POOL_TENSOR_NAME = 'pool_3:0'
 BOTTLENECK_TENSOR_SIZE = 2048
 MODEL_INPUT_WIDTH = 299
 MODEL_INPUT_HEIGHT = 299
 MODEL_INPUT_DEPTH = 3
+CH1_MAX_VALUE = 987
+CH1_MIN_VALUE = 142
 JPEG_DATA_TENSOR_NAME = 'DecodeJpeg:0'
 RESIZED_INPUT_TENSOR_NAME = 'ResizeBilinear:0'
+FINAL_TENSOR_NAME = 'final_result'
+BATCH_BOTTLENECK_TENSOR_NAME = 'batch_bottleneck:0'
 MAX_NUM_IMAGES_PER_CLASS = 2 ** 27 - 1
 
 
-def create_image_lists(image_dir, testing_percentage, validation_percentage):
-    """이미지 디렉토리에서 인풋 데이터를 찾아 데이터로 변환한다"""
+def get_split(file_name, testing_percentage, validation_percentage):
+    """파일 경로의 해시로 'training' / 'testing' / 'validation' 중 하나를 정한다. 같은 경로는 항상 같은 곳에 들어간다."""
+    hash_name = re.sub(r'_nohash_.*$', '', file_name)
+    hash_name_hashed = hashlib.sha1(compat.as_bytes(hash_name)).hexdigest()
+    percentage_hash = ((int(hash_name_hashed, 16) %
+                       (MAX_NUM_IMAGES_PER_CLASS + 1)) *
+                      (100.0 / MAX_NUM_IMAGES_PER_CLASS))
+
+    if percentage_hash < validation_percentage:
+        return 'validation'
+    elif percentage_hash < (testing_percentage + validation_percentage):
+        return 'testing'
+    else:
+        return 'training'
+
+
+def load_image_manifest(manifest_path, image_dir, testing_percentage, validation_percentage):
+    """
+    이전 실행에서 저장한 manifest를 읽는다.
+    image_dir나 split 비율이 바뀌었으면 쓸 수 없으므로 빈 manifest를 리턴한다.
+    """
+    empty_manifest = {'image_dir': image_dir, 'testing_percentage': testing_percentage,
+                      'validation_percentage': validation_percentage, 'dirs': {}}
+    if not manifest_path or not os.path.exists(manifest_path):
+        return empty_manifest
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if (manifest.get('image_dir') != image_dir or
+            manifest.get('testing_percentage') != testing_percentage or
+            manifest.get('validation_percentage') != validation_percentage):
+        print('데이터셋 설정이 바뀌어 manifest를 새로 만듭니다.')
+        return empty_manifest
+    return manifest
+
+
+def save_image_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def scan_image_dir(image_dir, dir_name, testing_percentage, validation_percentage, cached_files=None):
+    """
+    디렉토리를 한 번 읽어 [파일 이름, mtime_ns, size, split] 리스트를 만든다.
+    이전 manifest에 있던 파일은 split을 그대로 유지한다.
+    """
+    cached_splits = dict((entry[0], entry[3]) for entry in (cached_files or []))
+    files = []
+    for entry in os.scandir(os.path.join(image_dir, dir_name)):
+        extension = os.path.splitext(entry.name)[1][1:]
+        if extension not in IMAGE_EXTENSIONS or not entry.is_file():
+            continue
+        stat = entry.stat()
+        split = cached_splits.get(entry.name)
+        if split is None:
+            split = get_split(os.path.join(image_dir, dir_name, entry.name),
+                              testing_percentage, validation_percentage)
+        files.append([entry.name, stat.st_mtime_ns, stat.st_size, split])
+    files.sort()
+    return files
+
+
+def create_image_lists(image_dir, testing_percentage, validation_percentage, manifest_path=None, verbose=True):
+    """
+    이미지 디렉토리에서 인풋 데이터를 찾아 데이터로 변환한다
+
+    manifest_path를 주면 디렉토리마다 (mtime, 파일 이름 / mtime / size / split)을 저장해두고,
+    다음 실행에서는 mtime이 바뀐 디렉토리만 다시 읽는다.
+    verbose가 False면 폴더마다의 안내 / 경고를 출력하지 않는다. (watch 모드에서 주기마다 반복되지 않도록)
+    """
 
     ## image_dir가 존재하지 않는다면 오류 출력
     if not gfile.Exists(image_dir):
@@ -43,80 +128,108 @@ def create_image_lists(image_dir, testing_percentage, validation_percentage):
         return None
 
     result = {}
+    manifest = load_image_manifest(manifest_path, image_dir, testing_percentage, validation_percentage)
+    scanned_dirs = {}
 
     ### image_dir 내 하위 디렉토리(label)를 가져온다
-    sub_dirs = [x[0] for x in gfile.Walk(image_dir)]
+    sub_dirs = sorted(entry.name for entry in os.scandir(image_dir) if entry.is_dir())
 
-    is_root_dir = True
-    for sub_dir in sub_dirs:
-        if is_root_dir:
-            is_root_dir = False
-            continue
-        extensions = ['jpg', 'jpeg', 'JPG', 'JPEG','bin']
-
-        file_list = []
-        dir_name = os.path.basename(sub_dir)
-        if dir_name == image_dir:
-            continue
-
-        print("Looking for images in '" + dir_name + "'")
-        for extension in extensions:
-            file_glob = os.path.join(image_dir, dir_name, '*.' + extension)
-            file_list.extend(gfile.Glob(file_glob))
+    for dir_name in sub_dirs:
+        label_name = re.sub(r'[^a-z0-9]+', ' ', dir_name.lower())
+        dir_mtime = os.stat(os.path.join(image_dir, dir_name)).st_mtime_ns
+        cached = manifest['dirs'].get(dir_name)
+        if cached is not None and cached['mtime'] == dir_mtime:
+            files = cached['files']
+        else:
+            if verbose:
+                print("Looking for images in '" + dir_name + "'")
+            files = scan_image_dir(image_dir, dir_name, testing_percentage, validation_percentage,
+                                   cached['files'] if cached is not None else None)
+        scanned_dirs[dir_name] = {'mtime': dir_mtime, 'label': label_name, 'files': files}
 
         ## 파일이 없거나 데이터가 작으면 예외 처리
-        if not file_list:
-            print('No files found')
+        if not files:
+            if verbose:
+                print('No files found')
             continue
-        if len(file_list) < 20:
+        if verbose and len(files) < 20:
             print("WARNING: Folder has less than 20 images, which may cause issues.")
-        elif len(file_list) > MAX_NUM_IMAGES_PER_CLASS:
+        elif verbose and len(files) > MAX_NUM_IMAGES_PER_CLASS:
             print("WARNING: Folder {} has more than {} images. Some images will never be selected".format(dir_name, MAX_NUM_IMAGES_PER_CLASS))
-        label_name = re.sub(r'[^a-z0-9]+', ' ', dir_name.lower())
 
         ## 트레이닝 / 밸리데이션 / 테스트셋으로 나눈다.
-        training_images = []
-        testing_images = []
-        validation_images = []
-        for file_name in file_list:
-            base_name = os.path.basename(file_name)
-
-            hash_name = re.sub(r'_nohash_.*$', '', file_name)
-            hash_name_hashed = hashlib.sha1(compat.as_bytes(hash_name)).hexdigest()
-            percentage_hash = ((int(hash_name_hashed, 16) %
-                               (MAX_NUM_IMAGES_PER_CLASS + 1)) *
-                              (100.0 / MAX_NUM_IMAGES_PER_CLASS))
-
-            if percentage_hash < validation_percentage:
-                validation_images.append(base_name)
-            elif percentage_hash < (testing_percentage + validation_percentage):
-                testing_images.append(base_name)
-            else:
-                training_images.append(base_name)
+        image_lists = {'training': [], 'testing': [], 'validation': []}
+        for base_name, _, _, split in files:
+            image_lists[split].append(base_name)
 
         result[label_name] = {
             'dir': dir_name,
-            'training': training_images,
-            'testing': testing_images,
-            'validation': validation_images,
+            'training': image_lists['training'],
+            'testing': image_lists['testing'],
+            'validation': image_lists['validation'],
         }
 
+    if manifest_path:
+        manifest['dirs'] = scanned_dirs
+        save_image_manifest(manifest_path, manifest)
+
     return result
 
 
-## 데이터를 다운로드받을 때 사용할 Tqdm 클래스를 정의한다.
-class TqdmUpTo(tqdm):
-    def update_to(self, b=1, bsize=1, tsize=None):
-        if tsize is not None:
-            self.total = tsize
-        self.update(b * bsize - self.n)
+MODEL_FILENAME = 'classify_image_graph_def.pb'
+EXTRACT_MANIFEST_FILENAME = 'extract_manifest.json'
+
+
+def model_file_sha1(dest_directory, filename=MODEL_FILENAME, trust_stat=False):
+    """
+    파일 내용을 읽어 SHA1을 리턴한다. 파일이 없으면 None.
+    trust_stat이면 파일 크기와 mtime이 압축을 풀 때의 기록과 같을 때 다시 읽지 않고 기록된 SHA1을 리턴한다.
+    (내용을 확인하지 않는 빠른 경로이므로 이미 검증한 파일에만 쓴다)
+    """
+    file_path = os.path.join(dest_directory, filename)
+    if not os.path.exists(file_path):
+        return None
+    manifest_path = os.path.join(dest_directory, EXTRACT_MANIFEST_FILENAME)
+    if trust_stat and os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            entry = json.load(f)['files'].get(filename)
+        stat = os.stat(file_path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha1']
+    return file_hash(file_path)
+
+
+def verify_model_files(dest_directory, verify=True):
+    """
+    압축을 푼 그래프 파일이 있고 extract_manifest.json에 기록된 SHA1과 같으면 True.
+    verify면 파일 내용을 해시해서 비교하고, 아니면 크기와 mtime만 비교한다.
+    """
+    manifest_path = os.path.join(dest_directory, EXTRACT_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, 'r') as f:
+        entry = json.load(f)['files'].get(MODEL_FILENAME)
+    return entry is not None and model_file_sha1(dest_directory, trust_stat=not verify) == entry['sha1']
 
 
+def write_extract_manifest(dest_directory):
+    file_path = os.path.join(dest_directory, MODEL_FILENAME)
+    stat = os.stat(file_path)
+    manifest = {'source': DATA_URL,
+                'files': {MODEL_FILENAME: {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                           'sha1': file_hash(file_path)}}}
+    with open(os.path.join(dest_directory, EXTRACT_MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f)
 
-def maybe_download_and_extract():
-    dest_directory = model_dir
+
+def maybe_download_and_extract(dest_directory, verify=True):
     ensure_dir_exists(dest_directory)
 
+    ## 이미 압축을 푼 그래프 파일이 온전하면(verify면 내용을 해시해서 확인) 다운로드와 압축 해제를 모두 건너뛴다.
+    if verify_model_files(dest_directory, verify):
+        print("압축을 푼 그래프 파일이 이미 있습니다.")
+        return
+
     filename = DATA_URL.split("/")[-1]
     filepath = os.path.join(dest_directory, filename)
 
@@ -124,6 +237,16 @@ def maybe_download_and_extract():
 
         print("그래프 파일이 없습니다. 다운로드를 시작합니다.")
 
+        ## 진행 표시줄은 다운로드할 때만 필요하므로 여기서 import한다.
+        from tqdm import tqdm
+
+        ## 데이터를 다운로드받을 때 사용할 Tqdm 클래스를 정의한다.
+        class TqdmUpTo(tqdm):
+            def update_to(self, b=1, bsize=1, tsize=None):
+                if tsize is not None:
+                    self.total = tsize
+                self.update(b * bsize - self.n)
+
         with TqdmUpTo(unit='B', unit_scale=True, miniters=1, desc=DATA_URL) as t:
             urllib.request.urlretrieve(DATA_URL, filepath, reporthook=t.update_to, data=None)
 
@@ -132,85 +255,538 @@ def maybe_download_and_extract():
     else:
         print("그래프 파일이 이미 존재합니다.")
     tarfile.open(filepath, 'r:gz').extractall(dest_directory)
+    write_extract_manifest(dest_directory)
 
 
-def create_inception_graph():
+def bootstrap_model(model_dir, model_source_dir=None):
+    """
+    Inception 그래프 파일이 있는 디렉토리를 준비해서 리턴한다.
+    model_source_dir를 주면 네트워크를 쓰지 않고 미리 받아둔 디렉토리를 그대로 사용한다.
     """
-    저장된 GraphDef 파일에서 그래프를 만들고
+    start = time.time()
+    if model_source_dir:
+        if not os.path.exists(os.path.join(model_source_dir, MODEL_FILENAME)):
+            raise IOError('%s에 %s가 없습니다.' % (model_source_dir, MODEL_FILENAME))
+        print('로컬 모델 디렉토리를 사용합니다: ' + model_source_dir)
+        model_dir = model_source_dir
+    else:
+        maybe_download_and_extract(model_dir)
+    print('모델 준비: %.2fs' % (time.time() - start))
+    return model_dir
+
+
+def create_inception_graph(model_dir, use_min_max_scaling=False):
+    """
+    model_dir에 저장된 GraphDef 파일에서 그래프를 만들고
     Graph 오브젝트를 리턴한다.
+
+    ResizeBilinear:0 입력을 1채널 배치 입력 [N, H, W, 1]을 리사이즈하는 텐서로 교체하여
+    여러 장의 array를 한 번의 sess.run으로 처리할 수 있게 한다.
+    gray-scale을 3채널로 복사하는 일과 min_max_scaling_ch1도 그래프 안에서 하므로
+    호스트는 2D array에 채널 축만 붙여서 넘기면 된다.
+    pool_3/_reshape는 [1, 2048]로 고정되어 있으므로 pool_3을 [N, 2048]로 직접 reshape한다.
+    리턴되는 jpeg_data_tensor는 배치 입력 텐서이다.
     """
+    start = time.time()
     with tf.Graph().as_default() as graph:
-        model_filename = os.path.join(model_dir, 'classify_image_graph_def.pb')
+        model_filename = os.path.join(model_dir, MODEL_FILENAME)
 
         with gfile.FastGFile(model_filename, 'rb') as f:
             graph_def = tf.GraphDef()
             graph_def.ParseFromString(f.read())
-            bottleneck_tensor, jpeg_data_tensor, resized_input_tensor = (
-                tf.import_graph_def(graph_def, name='', return_elements=[
-                    BOTTLENECK_TENSOR_NAME, JPEG_DATA_TENSOR_NAME, RESIZED_INPUT_TENSOR_NAME]))
-    return graph, bottleneck_tensor, jpeg_data_tensor, resized_input_tensor
+
+        ## 스케일링을 하지 않을 때는 DecodeJpeg:0과 같은 uint8 입력을 사용해야 기존 보틀넥과 값이 같다.
+        ## bilinear 리사이즈는 채널마다 따로 계산되므로 1채널로 리사이즈한 뒤 복사해도 값이 같고 연산은 1/3이다.
+        with tf.name_scope('batch_input'):
+            batch_input_tensor = tf.placeholder(
+                tf.float32 if use_min_max_scaling else tf.uint8, [None, None, None, 1], name='BatchInput')
+            input_values = tf.cast(batch_input_tensor, tf.float32)
+            if use_min_max_scaling:
+                input_values = (input_values - CH1_MAX_VALUE) / (CH1_MAX_VALUE - CH1_MIN_VALUE)
+            resized_values = tf.image.resize_bilinear(input_values, [MODEL_INPUT_HEIGHT, MODEL_INPUT_WIDTH])
+            batch_resized_tensor = tf.tile(resized_values, [1, 1, 1, MODEL_INPUT_DEPTH])
+
+        pool_tensor, resized_input_tensor = (
+            tf.import_graph_def(graph_def, name='',
+                                input_map={RESIZED_INPUT_TENSOR_NAME: batch_resized_tensor},
+                                return_elements=[POOL_TENSOR_NAME, RESIZED_INPUT_TENSOR_NAME]))
+        bottleneck_tensor = tf.reshape(pool_tensor, [-1, BOTTLENECK_TENSOR_SIZE], name='batch_bottleneck')
+    print('그래프 로딩: %.2fs' % (time.time() - start))
+    return graph, bottleneck_tensor, batch_input_tensor, resized_input_tensor
 
 
 def should_distort_images(flip_left_right, random_crop, random_scale, random_brightness):
     """이미지 데이터에 변화를 줄지 결정한다."""
     return (flip_left_right or (random_crop != 0) or (random_scale != 0) or (random_brightness != 0))
 
+
+def get_class_weight_list(image_lists, class_weights):
+    """class_weights({클래스 이름: 가중치})를 레이블 순서의 리스트로 바꾼다. 지정하지 않은 클래스는 1이다."""
+    if class_weights is None:
+        return None
+    unknown = set(class_weights) - set(image_lists.keys())
+    if unknown:
+        raise ValueError('class_weights에 없는 클래스가 있습니다: %s' % ', '.join(sorted(unknown)))
+    return [class_weights.get(label_name, 1.0) for label_name in image_lists.keys()]
+
+
+def create_image_sampler(image_lists, category, sampling_strategy='balanced', class_weights=None):
+    """category의 이미지를 레이블 순서로 이어 붙인 인덱스를 뽑는 Sampler. class_weights는 {클래스 이름: 가중치}"""
+    class_sizes = [len(image_lists[label_name][category]) for label_name in image_lists.keys()]
+    return Sampler.from_class_sizes(class_sizes, sampling_strategy, get_class_weight_list(image_lists, class_weights))
+
+
+def sample_image_indices(sampler, how_many, epoch_sampling=False):
+    """sampler에서 how_many개를 뽑아 (레이블 인덱스 배열, 그 레이블 안의 이미지 인덱스 배열)을 리턴한다."""
+    indices = sampler.next_batch(how_many) if epoch_sampling else sampler.sample(how_many)
+    ## 빈 클래스는 시작 위치가 다음 클래스와 같으므로 side='right'로 찾으면 예제가 있는 클래스가 나온다.
+    label_indices = np.searchsorted(sampler.class_starts, indices, side='right') - 1
+    return label_indices, indices - sampler.class_starts[label_indices]
+
+
+def sample_image_paths(image_lists, how_many, category, image_dir, sampler=None, epoch_sampling=False):
+    """
+    sampler(없으면 클래스 균등 샘플러)로 how_many개를 뽑아 (파일 경로 리스트, 정답지)를 리턴한다.
+    """
+    if sampler is None:
+        sampler = create_image_sampler(image_lists, category)
+    label_names = list(image_lists.keys())
+    label_indices, image_indices = sample_image_indices(sampler, how_many, epoch_sampling)
+    image_paths = [get_image_path(image_lists, label_names[label_index], image_index, image_dir, category)
+                   for label_index, image_index in zip(label_indices, image_indices)]
+    ground_truths = np.eye(len(label_names), dtype=np.float32)[label_indices]
+    return image_paths, ground_truths
+
+
+def create_distorted_batch_producer(image_lists, how_many, category, image_dir, flip_left_right, random_crop,
+                                    random_scale, random_brightness, queue_depth, num_threads,
+                                    sampling_strategy='balanced', class_weights=None, epoch_sampling=False):
+    """
+    배경 스레드에서 how_many개씩 array를 불러와 배치 단위로 변형하고
+    배치 입력 텐서에 바로 넣을 수 있는 [N, 299, 299, 1] 배열로 만들어둔다.
+    """
+    def distort_fn(image_datas, rng):
+        distorted = distort_arrays(image_datas, flip_left_right, random_crop, random_scale, random_brightness,
+                                   MODEL_INPUT_HEIGHT, MODEL_INPUT_WIDTH, rng)
+        return distorted[:, :, :, newaxis]
+
+    ## 여러 스레드가 같은 샘플러의 에폭 위치를 옮기므로 샘플링은 lock 안에서 한다.
+    sampler = create_image_sampler(image_lists, category, sampling_strategy, class_weights)
+    sampler_lock = threading.Lock()
+    def sample_fn():
+        with sampler_lock:
+            return sample_image_paths(image_lists, how_many, category, image_dir, sampler, epoch_sampling)
+
+    return DistortedBatchProducer(sample_fn, load_raw_array, distort_fn, queue_depth, num_threads)
+
 def ensure_dir_exists(dir_name):
     if not os.path.exists(dir_name):
         os.makedirs(dir_name)
 
 
-def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir, jpeg_data_tensor, bottleneck_tensor):
+def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_store, jpeg_data_tensor, bottleneck_tensor,
+                      batch_size=1, num_workers=0, queue_depth=64):
+    """
+    저장소에 없는 보틀넥을 모두 만든다.
+    워커 스레드가 array를 불러와 큐에 미리 채워두는 동안
+    세션 스레드는 batch_size개씩 한 번의 sess.run으로 보틀넥을 만든다.
+    """
+    missing = find_missing_bottlenecks(image_lists, image_dir, bottleneck_store)
+    pipeline = PrefetchPipeline(missing, load_hashed_image_array, num_workers, queue_depth)
     how_many_bottlenecks = 0
-    ensure_dir_exists(bottleneck_dir)
+    forward_sec = 0.0
+    for chunk in pipeline.batches(batch_size):
+        forward_sec += store_bottleneck_chunk(sess, chunk, bottleneck_store, jpeg_data_tensor, bottleneck_tensor)
+        how_many_bottlenecks += len(chunk)
+        if how_many_bottlenecks % 100 < len(chunk):
+            print('{} / {} bottleneck files created'.format(how_many_bottlenecks, len(missing)))
+    bottleneck_store.flush()
+    if missing:
+        pipeline.report()
+        print('Inception forward: %.2fs' % forward_sec)
+
+
+def find_missing_bottlenecks(image_lists, image_dir, bottleneck_store):
+    """저장소에 보틀넥이 없거나 파일이 바뀐 이미지 경로 리스트를 리턴한다."""
+    missing = []
     for label_name, label_lists in image_lists.items():
         for category in ['training', 'testing', 'validation']:
-            category_list = label_lists[category]
-            for index, unused_base_name in enumerate(category_list):
-                get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir, category, \
-                                         bottleneck_dir, jpeg_data_tensor, bottleneck_tensor)
-                how_many_bottlenecks += 1
-                if how_many_bottlenecks % 100 == 0:
-                    print('{} bottleneck files created'.format(how_many_bottlenecks))
+            for index, unused_base_name in enumerate(label_lists[category]):
+                key = get_bottleneck_key(image_lists, label_name, index, image_dir, category, bottleneck_store)
+                if key is None or not bottleneck_store.is_valid(key):
+                    missing.append(get_image_path(image_lists, label_name, index, image_dir, category))
+    return missing
 
 
+def store_bottleneck_chunk(sess, chunk, bottleneck_store, jpeg_data_tensor, bottleneck_tensor):
+    """
+    load_hashed_image_array로 불러온 [(경로, 결과), ...]의 보틀넥을 만들어 저장소에 넣는다.
+    forward에 걸린 시간을 리턴한다.
+    """
+    ## 내용이 같은 array는 파일이 달라도 한 번만 계산한다.
+    pending = {}
+    for image_path, (image_data, input_hash, stat) in chunk:
+        bottleneck_store.input_hashes.update(image_path, input_hash, stat)
+        key = content_key(input_hash, bottleneck_store.fingerprint)
+        if not bottleneck_store.is_valid(key):
+            pending[key] = image_data
+    if not pending:
+        return 0.0
+    start = time.time()
+    bottleneck_values = run_bottleneck_on_arrays(sess, list(pending.values()), jpeg_data_tensor, bottleneck_tensor)
+    forward_sec = time.time() - start
+    bottleneck_store.put_many(list(pending.keys()), bottleneck_values)
+    return forward_sec
+
+
+def cache_bottlenecks_sharded(image_lists, image_dir, bottleneck_store, num_shards, model_dir, use_min_max_scaling=False,
+                              intra_op_threads=0, inter_op_threads=1, batch_size=32, num_workers=2,
+                              queue_depth=64, checkpoint_batches=10):
+    """
+    없는 보틀넥을 num_shards개의 프로세스로 나눠 만든다.
+    프로세스마다 세션과 스레드 설정, 샤드 저장소가 따로 있고 끝나면 메인 저장소로 병합한다.
 
-def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir, category, \
-                             bottleneck_dir, jpeg_data_tensor, bottleneck_tensor):
-    label_lists = image_lists[label_name]
-    sub_dir = label_lists['dir']
-    sub_dir_path = os.path.join(bottleneck_dir, sub_dir)
-    ensure_dir_exists(sub_dir_path)
-    bottleneck_path = get_bottleneck_path(image_lists, label_name, index,
-                                    bottleneck_dir, category)
-    if not os.path.exists(bottleneck_path):
-        create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                               image_dir, category, sess, jpeg_data_tensor,
-                               bottleneck_tensor)
-    with open(bottleneck_path, 'r') as bottleneck_file:
-        bottleneck_string = bottleneck_file.read()
-
-    did_hit_error = False
+    작업 계획(샤드마다 처리할 경로)은 <bottleneck_dir>/shards/plan.json에 한 번만 저장하므로
+    중간에 멈춘 뒤 다시 실행하면 이미지를 다시 훑지 않고 각 샤드의 마지막 offset부터 이어서 처리한다.
+    이어서 처리한 뒤에는 없는 보틀넥을 다시 찾아 그 사이 추가된 이미지를 새 계획으로 처리한다.
+    """
+    shards_dir = os.path.join(bottleneck_store.store_dir, 'shards')
+    shards = load_shard_plan(shards_dir, bottleneck_store.fingerprint)
+    if shards is not None:
+        image_paths = set(list_image_paths(image_lists, image_dir))
+        if any(image_path not in image_paths for shard in shards for image_path in shard):
+            ## 이미지가 지워졌으면 계획을 버리되, 이미 만든 보틀넥은 병합해서 살린다.
+            print('이미지 목록이 바뀌어 이전 샤드 계획을 다시 만듭니다.')
+            merge_shards(bottleneck_store, shards_dir, len(shards))
+        else:
+            print('이전 샤드 계획을 이어서 처리합니다.')
+            _run_bottleneck_shards(shards, shards_dir, bottleneck_store, model_dir, use_min_max_scaling,
+                                   intra_op_threads, inter_op_threads, batch_size, num_workers, queue_depth,
+                                   checkpoint_batches)
+
+    remove_shards(shards_dir)
+    missing = find_missing_bottlenecks(image_lists, image_dir, bottleneck_store)
+    if not missing:
+        return
+    shards = split_shards(missing, min(num_shards, len(missing)))
+    save_shard_plan(shards_dir, shards, bottleneck_store.fingerprint)
+    _run_bottleneck_shards(shards, shards_dir, bottleneck_store, model_dir, use_min_max_scaling, intra_op_threads,
+                           inter_op_threads, batch_size, num_workers, queue_depth, checkpoint_batches)
+    remove_shards(shards_dir)
+
+
+def _run_bottleneck_shards(shards, shards_dir, bottleneck_store, model_dir, use_min_max_scaling, intra_op_threads,
+                           inter_op_threads, batch_size, num_workers, queue_depth, checkpoint_batches):
+    """shards(샤드마다의 경로 리스트)를 프로세스마다 하나씩 처리하고 메인 저장소로 병합한다."""
+    if intra_op_threads <= 0:
+        intra_op_threads = max(1, multiprocessing.cpu_count() // len(shards))
+    start = time.time()
+    ## 이미 세션이 열린 프로세스를 fork하면 TensorFlow 런타임 상태가 복사되므로 spawn으로 새로 띄운다.
+    pool = multiprocessing.get_context('spawn').Pool(len(shards))
     try:
-        bottleneck_values = [float(x) for x in bottleneck_string.split(',')]
-    except ValueError:
-        print('Invalid float found, recreating bottleneck')
-        did_hit_error = True
-    if did_hit_error:
-        create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                               image_dir, category, sess, jpeg_data_tensor,
-                               bottleneck_tensor)
-        with open(bottleneck_path, 'r') as bottleneck_file:
-            bottleneck_string = bottleneck_file.read()
-        # Allow exceptions to propagate here, since they shouldn't happen after a
-        # fresh creation
-        bottleneck_values = [float(x) for x in bottleneck_string.split(',')]
-    return bottleneck_values
+        results = pool.starmap(_bottleneck_shard_worker, [
+            (shard_index, shard_paths, shard_store_dir(shards_dir, shard_index), bottleneck_store.fingerprint,
+             bottleneck_store.dtype.name, model_dir, use_min_max_scaling, intra_op_threads, inter_op_threads,
+             batch_size, num_workers, queue_depth, checkpoint_batches)
+            for shard_index, shard_paths in enumerate(shards)])
+    finally:
+        pool.close()
+        pool.join()
+    elapsed_sec = time.time() - start
+
+    for shard_index, processed, forward_sec in results:
+        print('shard %02d: %d개 처리, Inception forward %.2fs' % (shard_index, processed, forward_sec))
+    processed = sum(result[1] for result in results)
+    print('%d개 프로세스로 보틀넥 %d개 생성: %.2fs (%.1f images/sec)' % (
+        len(shards), processed, elapsed_sec, processed / elapsed_sec if elapsed_sec else 0.0))
+    merged = merge_shards(bottleneck_store, shards_dir, len(shards))
+    print('샤드 병합: %d개 행 추가, 저장소 %d개' % (merged, len(bottleneck_store)))
+
+
+def _bottleneck_shard_worker(shard_index, shard_paths, shard_dir, fingerprint, dtype, model_dir, use_min_max_scaling,
+                             intra_op_threads, inter_op_threads, batch_size, num_workers, queue_depth,
+                             checkpoint_batches):
+    """
+    샤드 하나를 처리하는 프로세스. checkpoint_batches개의 배치마다 샤드 저장소를 flush하고 offset을 기록한다.
+    리턴: (shard_index, 이번 실행에서 처리한 수, forward에 걸린 시간)
+    """
+    offset = load_shard_offset(shard_dir) if os.path.exists(shard_dir) else 0
+    if offset >= len(shard_paths):
+        return shard_index, 0, 0.0
+    shard_store = BottleneckStore(shard_dir, BOTTLENECK_TENSOR_SIZE, dtype=dtype,
+                                  capacity=len(shard_paths), fingerprint=fingerprint)
+    graph, bottleneck_tensor, jpeg_data_tensor, _ = create_inception_graph(model_dir, use_min_max_scaling)
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    processed = 0
+    forward_sec = 0.0
+    block_size = batch_size * checkpoint_batches
+    with tf.Session(graph=graph, config=config) as sess:
+        for block_start in range(offset, len(shard_paths), block_size):
+            block_paths = shard_paths[block_start:block_start + block_size]
+            pipeline = PrefetchPipeline(block_paths, load_hashed_image_array, num_workers, queue_depth)
+            for chunk in pipeline.batches(batch_size):
+                forward_sec += store_bottleneck_chunk(sess, chunk, shard_store, jpeg_data_tensor, bottleneck_tensor)
+            shard_store.flush()
+            save_shard_offset(shard_dir, block_start + len(block_paths))
+            processed += len(block_paths)
+    return shard_index, processed, forward_sec
+
+
+def load_hashed_image_array_or_none(image_path):
+    """아직 쓰는 중이거나 깨진 파일이면 None을 리턴한다. (watch 모드에서 다음 주기에 다시 시도)"""
+    try:
+        return load_hashed_image_array(image_path)
+    except Exception as e:
+        print('불러오지 못했습니다. 다음 주기에 다시 시도합니다: %s (%s)' % (image_path, e))
+        return None
+
+
+def watch_image_dir(sess, image_dir, bottleneck_store, jpeg_data_tensor, bottleneck_tensor, manifest_path,
+                    testing_percentage, validation_percentage, interval_sec=5.0, settle_sec=2.0,
+                    batch_size=32, num_workers=4, queue_depth=64, max_polls=None):
+    """
+    interval_sec마다 image_dir를 다시 훑어 새로 들어오거나 바뀐 파일의 보틀넥을 batch_size개씩 만들어 저장소에 추가한다.
+
+    파일 목록은 create_image_lists의 manifest로 mtime이 바뀐 클래스 폴더만 다시 읽고, split은 같은 해시 규칙(get_split)으로 정한다.
+    파일마다 주기마다 os.stat을 해서 mtime / size가 직전 주기와 같고 마지막으로 수정된 지 settle_sec가 지난 파일만 처리한다.
+    (쓰는 중이거나 제자리에서 다시 쓰는 파일은 다음 주기로 미룬다) 불러오지 못했거나 읽는 사이 바뀐 파일은 다음 주기에 다시 시도한다.
+    주기마다 저장소를 flush하므로 다음 학습은 보틀넥을 새로 만들 필요 없이 바로 시작할 수 있다.
+    """
+    known = {}
+    previous_stats = {}
+    polls = 0
+    try:
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            poll_start = time.time()
+            create_image_lists(image_dir, testing_percentage, validation_percentage, manifest_path, verbose=False)
+            manifest = load_image_manifest(manifest_path, image_dir, testing_percentage, validation_percentage)
+
+            settled_before_ns = int((poll_start - settle_sec) * 1e9)
+            stats = {}
+            candidates = {}
+            for dir_name, dir_entry in manifest['dirs'].items():
+                for base_name, _, _, unused_split in dir_entry['files']:
+                    image_path = os.path.join(image_dir, dir_name, base_name)
+                    try:
+                        stat = os.stat(image_path)
+                    except OSError:
+                        continue
+                    current = (stat.st_mtime_ns, stat.st_size)
+                    stats[image_path] = current
+                    if known.get(image_path) == current:
+                        continue
+                    if previous_stats.get(image_path) != current or current[0] > settled_before_ns:
+                        continue
+                    input_hash = bottleneck_store.input_hashes.lookup(image_path)
+                    if input_hash is not None and bottleneck_store.is_valid(
+                            content_key(input_hash, bottleneck_store.fingerprint)):
+                        known[image_path] = current
+                    else:
+                        candidates[image_path] = current
+            previous_stats = stats
+
+            added = 0
+            if candidates:
+                pipeline = PrefetchPipeline(sorted(candidates), load_hashed_image_array_or_none, num_workers,
+                                            queue_depth)
+                for chunk in pipeline.batches(batch_size):
+                    ## 읽기 전의 stat이 이번 주기에 확인한 값과 다르면 읽는 사이 바뀐 것이므로 저장하지 않는다.
+                    loaded = [(image_path, value) for image_path, value in chunk
+                              if value is not None and
+                              (value[2].st_mtime_ns, value[2].st_size) == candidates[image_path]]
+                    store_bottleneck_chunk(sess, loaded, bottleneck_store, jpeg_data_tensor, bottleneck_tensor)
+                    for image_path, _ in loaded:
+                        known[image_path] = candidates[image_path]
+                    added += len(loaded)
+                bottleneck_store.flush()
+            if added:
+                print('%s: 새 파일 %d개의 보틀넥을 추가했습니다. (%.2fs, 저장소 %d개)' % (
+                    datetime.now(), added, time.time() - poll_start, len(bottleneck_store)))
+            time.sleep(max(0.0, interval_sec - (time.time() - poll_start)))
+    except KeyboardInterrupt:
+        print('watch 모드를 종료합니다.')
+    finally:
+        bottleneck_store.flush()
+
+
+def load_hashed_image_array(image_path):
+    """array를 불러와 ([H, W, 1] array, 입력 해시, 읽기 전의 os.stat 결과)를 리턴한다."""
+    stat = os.stat(image_path)
+    raw_data = load_raw_array(image_path)
+    return add_channel_axis(raw_data), array_hash(raw_data), stat
+
+
+def get_bottleneck_fingerprint(model_dir, use_min_max_scaling=False):
+    """
+    model_dir의 Inception 그래프 파일과 전처리 설정으로 fingerprint를 만든다.
+    둘 중 하나라도 바뀌면 모든 보틀넥 키가 바뀌어 예전 보틀넥을 쓰지 않는다.
+    그래프 안에서 채널을 복사해도 값은 호스트에서 쌓던 때와 같으므로 'stack_channels' 설정은 그대로 둔다.
+    """
+    ## 그래프 파일은 bootstrap_model에서 내용을 확인했으므로 여기서는 크기 / mtime 기록을 믿는다. (샤드 프로세스마다 다시 해시하지 않는다)
+    settings = {
+        'graph': model_file_sha1(model_dir, trust_stat=True),
+        'bottleneck_tensor': POOL_TENSOR_NAME,
+        'input_size': [MODEL_INPUT_HEIGHT, MODEL_INPUT_WIDTH, MODEL_INPUT_DEPTH],
+        'input_dtype': 'uint8',
+        'preprocessing': 'stack_channels',
+    }
+    if use_min_max_scaling:
+        settings['input_dtype'] = 'float32'
+        settings['min_max_scaling'] = [CH1_MIN_VALUE, CH1_MAX_VALUE]
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('ascii')).hexdigest()
+
+
+def garbage_collect_bottlenecks(image_lists, image_dir, bottleneck_store):
+    """현재 이미지 목록에서 참조하지 않는 보틀넥 행과 입력 해시를 저장소에서 지운다."""
+    live_paths = set()
+    live_keys = set()
+    for label_name, label_lists in image_lists.items():
+        for category in ['training', 'testing', 'validation']:
+            for index in range(len(label_lists[category])):
+                live_paths.add(get_image_path(image_lists, label_name, index, image_dir, category))
+                key = get_bottleneck_key(image_lists, label_name, index, image_dir, category, bottleneck_store)
+                if key is not None:
+                    live_keys.add(key)
+    removed_inputs = bottleneck_store.input_hashes.retain(live_paths)
+    removed_rows = bottleneck_store.compact(live_keys)
+    print('보틀넥 GC: 보틀넥 %d개, 입력 해시 %d개 삭제, 보틀넥 %d개 유지' % (
+        removed_rows, removed_inputs, len(bottleneck_store)))
+
+
+def open_bottleneck_store(bottleneck_dir, image_lists, model_dir, dtype='float32', use_min_max_scaling=False):
+    """보틀넥 저장소를 연다. 새로 만들 때는 전체 이미지 수만큼 행을 미리 할당한다."""
+    capacity = sum(len(label_lists[category]) for label_lists in image_lists.values()
+                   for category in ['training', 'testing', 'validation'])
+    return BottleneckStore(bottleneck_dir, BOTTLENECK_TENSOR_SIZE, dtype=dtype, capacity=capacity,
+                           fingerprint=get_bottleneck_fingerprint(model_dir, use_min_max_scaling))
+
+
+def create_bottleneck_cache(image_lists, image_dir, bottleneck_store, mode, max_bytes, feature_store=None,
+                            sampling_strategy='balanced', class_weights=None, epoch_sampling=False):
+    """
+    cache_bottlenecks로 채운 training / testing / validation 보틀넥을 캐시에 올린다.
+    mode가 'memory'면 전체를 메모리에 올리고, 'lru'면 max_bytes 안에서 블록 단위로 유지한다.
+    feature_store(사영한 특징 저장소)를 넘기면 키는 bottleneck_store로 찾고 값은 feature_store에서 읽는다.
+    sampling_strategy / class_weights / epoch_sampling은 training 샘플링에만 적용하고 평가용 샘플링은 클래스 균등으로 둔다.
+    """
+    class_count = len(image_lists.keys())
+    if feature_store is None:
+        feature_store = bottleneck_store
+    if mode == 'memory':
+        bottleneck_cache = InMemoryBottleneckCache(feature_store, class_count)
+    elif mode == 'lru':
+        bottleneck_cache = LRUBottleneckCache(feature_store, class_count, max_bytes)
+    else:
+        raise ValueError('Unknown bottleneck cache mode: %s' % mode)
+
+    for category in ['training', 'testing', 'validation']:
+        rows = []
+        labels = []
+        filenames = []
+        for label_index, label_name in enumerate(image_lists.keys()):
+            for index in range(len(image_lists[label_name][category])):
+                key = get_bottleneck_key(image_lists, label_name, index, image_dir, category, bottleneck_store)
+                if key is None or not bottleneck_store.is_valid(key):
+                    raise RuntimeError('보틀넥이 저장소에 없습니다: %s' % get_image_path(
+                        image_lists, label_name, index, image_dir, category))
+                rows.append(feature_store.row(key))
+                labels.append(label_index)
+                filenames.append(get_image_path(image_lists, label_name, index, image_dir, category))
+        bottleneck_cache.add_category(category, rows, labels, filenames)
+    bottleneck_cache.set_sampling('training', sampling_strategy, get_class_weight_list(image_lists, class_weights),
+                                  epoch_sampling)
+
+    print('보틀넥 캐시 (%s): %.1f MB' % (mode, bottleneck_cache.nbytes() / (1024.0 ** 2)))
+    return bottleneck_cache
+
+
+def list_bottleneck_keys(image_lists, image_dir, bottleneck_store, category):
+    """카테고리의 모든 이미지의 보틀넥 키. cache_bottlenecks로 채워져 있어야 한다."""
+    keys = []
+    for label_name in image_lists.keys():
+        for index in range(len(image_lists[label_name][category])):
+            key = get_bottleneck_key(image_lists, label_name, index, image_dir, category, bottleneck_store)
+            if key is None or not bottleneck_store.is_valid(key):
+                raise RuntimeError('보틀넥이 저장소에 없습니다: %s' % get_image_path(
+                    image_lists, label_name, index, image_dir, category))
+            keys.append(key)
+    return keys
+
+
+def create_projected_features(image_lists, image_dir, bottleneck_store, bottleneck_dir, method, dim, seed=0):
+    """
+    training 보틀넥으로 사영(method: 'pca' / 'random')을 맞추고 모든 보틀넥을 dim차원으로 줄여
+    bottleneck_dir/projection_<method>_<dim>에 저장한다. 이미 줄여둔 보틀넥은 다시 계산하지 않는다.
+    리턴: (BottleneckProjection, 줄인 특징 저장소, 비용 기록 dict)
+    """
+    training_keys = list_bottleneck_keys(image_lists, image_dir, bottleneck_store, 'training')
+    keys = (training_keys + list_bottleneck_keys(image_lists, image_dir, bottleneck_store, 'testing') +
+            list_bottleneck_keys(image_lists, image_dir, bottleneck_store, 'validation'))
+    store_dir = projection_dir(bottleneck_dir, method, dim)
+    with timers.phase('fit_projection'):
+        projection = load_or_fit_projection(store_dir, method, bottleneck_store,
+                                            [bottleneck_store.row(key) for key in training_keys], dim, seed)
+    with timers.phase('project_bottlenecks'):
+        feature_store, num_projected, project_sec = project_store(bottleneck_store, projection, store_dir, keys)
+
+    report = {
+        'method': method,
+        'input_dim': projection.input_dim,
+        'dim': projection.dim,
+        'explained_variance_ratio': projection.explained_variance_ratio,
+        'fit_sec': projection.fit_sec,
+        'num_fit_examples': projection.num_fit_examples,
+        'num_projected': num_projected,
+        'project_sec': project_sec,
+        'feature_bytes': len(keys) * projection.input_dim * bottleneck_store.dtype.itemsize,
+        'projected_feature_bytes': len(keys) * projection.dim * 4,
+    }
+    print('보틀넥 사영 (%s, %d -> %d): 설명 분산 %s, 맞추기 %.2fs (N=%d), 사영 %.2fs (새로 %d개), '
+          '특징 크기 %.1f MB -> %.1f MB' % (
+              method, projection.input_dim, projection.dim,
+              '-' if projection.explained_variance_ratio is None else
+              '%.1f%%' % (projection.explained_variance_ratio * 100),
+              projection.fit_sec, projection.num_fit_examples, project_sec, num_projected,
+              report['feature_bytes'] / 1024.0 ** 2, report['projected_feature_bytes'] / 1024.0 ** 2))
+    return projection, feature_store, report
 
 
+def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir, category, \
+                             bottleneck_store, jpeg_data_tensor, bottleneck_tensor):
+    key = get_bottleneck_key(image_lists, label_name, index, image_dir, category, bottleneck_store)
+    if key is not None:
+        bottleneck_values = bottleneck_store.get(key)
+        if bottleneck_values is not None:
+            timers.count('bottleneck_store_hit')
+            return bottleneck_values
+
+    timers.count('bottleneck_store_miss')
+    image_path = get_image_path(image_lists, label_name, index, image_dir, category)
+    if not gfile.Exists(image_path):
+        tf.logging.fatal('File does not exist %s', image_path)
+    with timers.phase('load_image_array'):
+        image_data, input_hash, stat = load_hashed_image_array(image_path)
+    bottleneck_store.input_hashes.update(image_path, input_hash, stat)
+    key = content_key(input_hash, bottleneck_store.fingerprint)
+    if not bottleneck_store.is_valid(key):
+        create_bottleneck(bottleneck_store, key, image_path, image_data, sess, jpeg_data_tensor,
+                          bottleneck_tensor)
+    return bottleneck_store.get(key)
+
 
-def get_bottleneck_path(image_lists, label_name, index, bottleneck_dir, category):
-    return get_image_path(image_lists, label_name, index, bottleneck_dir, category) + '.txt'
+
+def get_bottleneck_key(image_lists, label_name, index, image_dir, category, bottleneck_store):
+    """
+    입력 array의 해시와 그래프 fingerprint로 만든 보틀넥 키를 리턴한다.
+    파일이 처음 보이거나 마지막으로 해시한 뒤 바뀌었으면 불러오기 전에는 알 수 없으므로 None.
+    """
+    image_path = get_image_path(image_lists, label_name, index, image_dir, category)
+    input_hash = bottleneck_store.input_hashes.lookup(image_path)
+    if input_hash is None:
+        return None
+    return content_key(input_hash, bottleneck_store.fingerprint)
 
 
 def get_image_path(image_lists, label_name, index, image_dir, category):
@@ -239,27 +815,15 @@ def min_max_scaling_ch1(arr):
 	max value : 987
 	min value : 142
 	"""
-	max_val = 987
-	min_val = 142
+	max_val = CH1_MAX_VALUE
+	min_val = CH1_MIN_VALUE
 	re_arr = (arr - max_val) / (max_val - min_val)
 
 	return re_arr
 
-def create_bottleneck_file(bottleneck_path, image_lists, label_name, index, image_dir,
-                          category, sess, jpeg_data_tensor, bottleneck_tensor):
-    print('보틀넥 파일 생성 시작 - {}'.format(bottleneck_path))
-    image_path = get_image_path(image_lists, label_name, index, image_dir, category)
-
-    if not gfile.Exists(image_path):
-        tf.logging.fata('File does nto exist %s', image_path)
-    # image_data = gfile.FastGFile(image_path, 'rb').read()
-    ##############################################입력 데이터 수정 부분#################################################################
-    ################################pickle 불러와서 array로 넣는 부분################################
-    ################################concatenate 하는것도 여기서 진행 ################################
-    image_data = pickle.load(open(image_path, 'rb'))
-    # image_data = min_max_scaling_ch1(image_data)
-    image_data = image_data[:, :, newaxis]
-    image_data = np.concatenate((image_data, image_data, image_data), axis = 2)
+def create_bottleneck(bottleneck_store, key, image_path, image_data, sess, jpeg_data_tensor,
+                      bottleneck_tensor):
+    print('보틀넥 생성 시작 - {}'.format(image_path))
     print(image_data.shape)
 
 
@@ -269,51 +833,123 @@ def create_bottleneck_file(bottleneck_path, image_lists, label_name, index, imag
     except:
         raise RuntimeError('파일 처리 중 에러 발생: %s' % image_path)
 
-    bottleneck_string = ','.join(str(x) for x in bottleneck_values)
-    with open(bottleneck_path, 'w') as bottleneck_file:
-        bottleneck_file.write(bottleneck_string)
+    bottleneck_store.put(key, bottleneck_values)
 
 
 
 def run_bottleneck_on_image(sess, image_data, image_data_tensor, bottleneck_tensor):
-    bottleneck_values = sess.run(
-        bottleneck_tensor, {image_data_tensor: image_data})
+    with timers.phase('run_bottleneck_on_image'):
+        bottleneck_values = sess.run(
+            bottleneck_tensor, {image_data_tensor: image_data[newaxis]})
     bottleneck_values = np.squeeze(bottleneck_values)
     return bottleneck_values
 
 
+def run_bottleneck_on_batch(sess, image_batch, image_data_tensor, bottleneck_tensor):
+    """[N, H, W, 1] 배치를 한 번에 그래프에 넣어 [N, 2048] 보틀넥을 리턴한다."""
+    with timers.phase('run_bottleneck_on_batch'):
+        return sess.run(bottleneck_tensor, {image_data_tensor: image_batch})
 
-####################################################  FC layer  #######################################################################
-def add_final_training_ops(class_count, final_tensor_name, bottleneck_tensor):
-    with tf.name_scope('input'):
-        bottleneck_input = tf.placeholder_with_default(
-            bottleneck_tensor, shape=[None, BOTTLENECK_TENSOR_SIZE],
-            name='BottleneckInputPlaceholder')
 
-        ground_truth_input = tf.placeholder(tf.float32, [None, class_count], name='GroundTruthInput')
+def run_bottleneck_on_arrays(sess, image_datas, image_data_tensor, bottleneck_tensor):
+    """
+    크기가 다를 수 있는 array 리스트를 같은 shape끼리 묶어 배치로 처리하고
+    입력 순서대로 [N, 2048] 보틀넥을 리턴한다.
+    """
+    return map_shape_groups(
+        lambda image_batch: run_bottleneck_on_batch(sess, image_batch, image_data_tensor, bottleneck_tensor),
+        image_datas)
+
+
+def list_image_paths(image_lists, image_dir):
+    """image_lists의 모든 이미지 경로를 클래스, 카테고리 순서로 리턴한다."""
+    image_paths = []
+    for label_name, label_lists in image_lists.items():
+        for category in ['training', 'testing', 'validation']:
+            for index in range(len(label_lists[category])):
+                image_paths.append(get_image_path(image_lists, label_name, index, image_dir, category))
+    return image_paths
+
+
+def benchmark_bottleneck_extraction(sess, image_lists, image_dir, jpeg_data_tensor, bottleneck_tensor,
+                                    num_images, batch_size):
+    """한 장씩 처리하는 기존 방식과 배치 처리 방식의 초당 이미지 수를 비교한다."""
+    image_paths = list_image_paths(image_lists, image_dir)[:num_images]
+    if not image_paths:
+        print('벤치마크할 이미지가 없습니다.')
+        return None
+    image_datas = [load_image_array(image_path) for image_path in image_paths]
+
+    ## 그래프 초기화 비용이 결과에 섞이지 않도록 한 번 먼저 실행한다.
+    run_bottleneck_on_image(sess, image_datas[0], jpeg_data_tensor, bottleneck_tensor)
+
+    start = time.time()
+    for image_data in image_datas:
+        run_bottleneck_on_image(sess, image_data, jpeg_data_tensor, bottleneck_tensor)
+    per_image_rate = len(image_datas) / (time.time() - start)
 
+    start = time.time()
+    for i in range(0, len(image_datas), batch_size):
+        run_bottleneck_on_arrays(sess, image_datas[i:i + batch_size], jpeg_data_tensor, bottleneck_tensor)
+    batched_rate = len(image_datas) / (time.time() - start)
 
-    with tf.name_scope('FC_layer'):
+    print('보틀넥 추출 벤치마크 (N=%d): 한 장씩 %.1f images/sec, 배치(%d) %.1f images/sec (x%.2f)' % (
+        len(image_datas), per_image_rate, batch_size, batched_rate, batched_rate / per_image_rate))
+    return per_image_rate, batched_rate
+
+
+
+####################################################  FC layer  #######################################################################
+def add_fc_layers(inputs, class_count, dropout_while_training=None, dropout_rate=0.2,
+                  hidden_units=(1000, 1000, 1000, 500)):
+    """
+    보틀넥 위에 붙이는 FC 레이어. 같은 그래프에서 여러 번 부르면 가중치를 공유한다.
+    dropout_while_training을 넘기지 않으면 기본값이 True인 드롭아웃 스위치 placeholder를 만든다.
+    hidden_units의 크기마다 hidden1, hidden2, ... 레이어를 쌓고 출력은 class_count개이다.
+    """
+    with tf.variable_scope('FC_layer', reuse=tf.AUTO_REUSE):
 
         he_init = tf.contrib.layers.variance_scaling_initializer()
-        dropout_while_training = tf.placeholder_with_default(True, shape= (), name = 'dropout_while_training')# 드롭아웃 스위치
-        dropout_rate = 0.2
+        if dropout_while_training is None:
+            dropout_while_training = tf.placeholder_with_default(True, shape= (), name = 'dropout_while_training')# 드롭아웃 스위치
+
+        hidden_drop = tf.layers.dropout(inputs, dropout_rate, training = dropout_while_training)
+        for layer_index, units in enumerate(hidden_units):
+            hidden = tf.layers.dense(hidden_drop, units = units, activation = tf.nn.elu,
+                                     name = 'hidden%d' % (layer_index + 1), kernel_initializer = he_init)
+            hidden_drop = tf.layers.dropout(hidden, dropout_rate, training = dropout_while_training)
 
-        X_drop = tf.layers.dropout(bottleneck_input, dropout_rate, training = dropout_while_training)
-        hidden1 = tf.layers.dense(X_drop, units = 1000, activation = tf.nn.elu, name = 'hidden1', kernel_initializer = he_init)
-        hidden1_drop = tf.layers.dropout(hidden1, dropout_rate, training = dropout_while_training)
+        logits = tf.layers.dense(inputs = hidden_drop, units = class_count, name = 'logits')
 
-        hidden2 = tf.layers.dense(hidden1_drop, units = 1000, activation = tf.nn.elu, name = 'hidden2', kernel_initializer = he_init)
-        hidden2_drop = tf.layers.dropout(hidden2, dropout_rate, training = dropout_while_training)
+    return logits
 
-        hidden3 = tf.layers.dense(hidden2_drop, units = 1000, activation = tf.nn.elu, name = 'hidden3', kernel_initializer = he_init)
-        hidden3_drop = tf.layers.dropout(hidden3, dropout_rate, training = dropout_while_training)
 
-        hidden4 = tf.layers.dense(hidden3_drop, units = 500, activation = tf.nn.elu, name = 'hidden4', kernel_initializer = he_init)
-        hidden4_drop = tf.layers.dropout(hidden4, dropout_rate, training = dropout_while_training)
+def add_final_training_ops(class_count, final_tensor_name, bottleneck_tensor, train_input=None, projection=None,
+                           learning_rate=0.0001, dropout_rate=0.2, hidden_units=(1000, 1000, 1000, 500)):
+    """
+    train_input에 (보틀넥, 정답지) 텐서를 넘기면 (tf.data iterator 등) train_step은 feed_dict 없이
+    그 텐서로 학습한다. 같은 가중치를 쓰는 평가 / 추론용 분기는 기존처럼 placeholder로 입력받는다.
+    projection(BottleneckProjection)을 넘기면 보틀넥을 그래프 안에서 사영한 값이 기본 입력이 되고,
+    BottleneckInputPlaceholder에는 사영한 특징(projection.dim차원)을 넣는다.
+    입력 크기는 bottleneck_tensor의 마지막 차원을 따른다.
+    """
+    bottleneck_size = bottleneck_tensor.get_shape()[-1].value
+    if projection is not None:
+        with tf.name_scope('projection'):
+            bottleneck_tensor = tf.matmul(bottleneck_tensor - tf.constant(projection.mean, name='mean'),
+                                          tf.constant(projection.components, name='components'),
+                                          name='projected_bottleneck')
+        bottleneck_size = projection.dim
+
+    with tf.name_scope('input'):
+        bottleneck_input = tf.placeholder_with_default(
+            bottleneck_tensor, shape=[None, bottleneck_size],
+            name='BottleneckInputPlaceholder')
+
+        ground_truth_input = tf.placeholder(tf.float32, [None, class_count], name='GroundTruthInput')
 
-        logits = tf.layers.dense(inputs = hidden4_drop, units = 6)
 
+    logits = add_fc_layers(bottleneck_input, class_count, dropout_rate=dropout_rate, hidden_units=hidden_units)
 
     final_tensor = tf.nn.softmax(logits, name=final_tensor_name)
 
@@ -323,12 +959,165 @@ def add_final_training_ops(class_count, final_tensor_name, bottleneck_tensor):
         with tf.name_scope('total'):
             cross_entropy_mean = tf.reduce_mean(cross_entropy)
 
+    train_loss = cross_entropy_mean
+    if train_input is not None:
+        train_bottlenecks, train_ground_truth = train_input
+        train_logits = add_fc_layers(train_bottlenecks, class_count, dropout_while_training=True,
+                                     dropout_rate=dropout_rate, hidden_units=hidden_units)
+        with tf.name_scope('train_cross_entropy'):
+            train_loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(
+                labels=train_ground_truth, logits=train_logits))
+
     with tf.name_scope('train'):
         optimizer = tf.train.AdamOptimizer(learning_rate)
-        train_step = optimizer.minimize(cross_entropy_mean)
+        train_step = optimizer.minimize(train_loss, global_step=tf.train.get_or_create_global_step())
 
     return (train_step, cross_entropy_mean, bottleneck_input, ground_truth_input, final_tensor)
 
+
+def create_bottleneck_dataset(bottleneck_cache, category, batch_size):
+    """
+    메모리에 올린 보틀넥에서 캐시의 Sampler가 뽑은 인덱스로 배치를 모으는 tf.data 파이프라인을 만든다.
+    배열은 iterator를 초기화할 때 placeholder로 한 번만 넘기므로 그래프에 상수로 들어가지 않고,
+    인덱스 배치만 Python에서 만들어 그래프 안에서 gather한다. 샘플링 방식은 feed_dict 학습과 같다. (set_sampling)
+    리턴: (iterator, iterator 초기화에 쓸 feed_dict)
+    """
+    if not isinstance(bottleneck_cache, InMemoryBottleneckCache):
+        raise ValueError("tf.data 입력은 bottleneck_cache_mode = 'memory'에서만 사용할 수 있습니다.")
+    bottlenecks = bottleneck_cache.bottlenecks[category]
+    labels = bottleneck_cache.labels[category]
+    ## 인덱스는 TF 스레드에서 뽑고 평가 스텝은 캐시의 Sampler로 따로 뽑으므로, 같은 설정의 Sampler를 하나 더 만든다.
+    ## (class_probs는 이미 정규화한 가중치이므로 그대로 class_weights로 넘겨도 같은 확률이 된다)
+    cache_sampler = bottleneck_cache.samplers[category]
+    sampler = Sampler(labels, bottleneck_cache.class_count, cache_sampler.strategy, cache_sampler.class_probs)
+    epoch_sampling = bottleneck_cache.epoch_sampling[category]
+
+    def index_batches():
+        while True:
+            yield sampler.next_batch(batch_size) if epoch_sampling else sampler.sample(batch_size)
+
+    with tf.name_scope('dataset_' + category):
+        bottleneck_data = tf.placeholder(tf.float32, bottlenecks.shape, name='bottlenecks')
+        label_data = tf.placeholder(tf.int32, labels.shape, name='labels')
+        dataset = tf.data.Dataset.from_generator(index_batches, tf.int64, tf.TensorShape([batch_size]))
+        dataset = dataset.map(lambda indices: (tf.gather(bottleneck_data, indices),
+                                               tf.one_hot(tf.gather(label_data, indices), bottleneck_cache.class_count)))
+        dataset = dataset.prefetch(1)
+        iterator = dataset.make_initializable_iterator()
+    return iterator, {bottleneck_data: bottlenecks, label_data: labels}
+
+
+def warm_start_fc_layers(sess, checkpoint_path):
+    """
+    체크포인트에서 FC_layer의 가중치만 불러온다. optimizer 상태와 global step은 새로 시작한다.
+    클래스 수가 바뀐 logits처럼 shape이 다른 변수는 건너뛰고 초기값을 그대로 둔다.
+    """
+    if os.path.isdir(checkpoint_path):
+        checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+    if not checkpoint_path:
+        print('warm start할 체크포인트가 없습니다.')
+        return
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    saved_shapes = reader.get_variable_to_shape_map()
+    restored = []
+    skipped = []
+    for variable in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='FC_layer'):
+        name = variable.op.name
+        if saved_shapes.get(name) == variable.shape.as_list():
+            variable.load(reader.get_tensor(name), sess)
+            restored.append(name)
+        else:
+            skipped.append(name)
+    print('warm start: %s에서 %d개 변수를 불러옴, 건너뜀 %s' % (checkpoint_path, len(restored), skipped))
+
+
+def restore_or_initialize(sess, saver, checkpoint_dir, resume=False, warm_start_checkpoint=None,
+                          how_many_training_steps=None):
+    """
+    변수를 초기화한 뒤 warm_start_checkpoint의 FC_layer 가중치로 새 학습을 시작하거나,
+    resume이면 checkpoint_dir의 마지막 체크포인트에서 이어서 학습한다. 시작할 스텝을 리턴한다.
+    warm_start_checkpoint를 주면 resume보다 우선한다.
+    마지막 체크포인트가 how_many_training_steps까지 끝났거나 변수 shape이 다르면 (클래스가 추가된 경우 등)
+    이어서 학습하지 않고 그 체크포인트로 warm start한다.
+    """
+    sess.run(tf.global_variables_initializer())
+    latest = None
+    if resume and checkpoint_dir and not warm_start_checkpoint:
+        latest = tf.train.latest_checkpoint(checkpoint_dir)
+    if latest:
+        reader = tf.train.NewCheckpointReader(latest)
+        saved_shapes = reader.get_variable_to_shape_map()
+        global_step_name = tf.train.get_global_step().op.name
+        saved_step = reader.get_tensor(global_step_name) if global_step_name in saved_shapes else 0
+        if how_many_training_steps is not None and saved_step >= how_many_training_steps:
+            print('체크포인트가 이미 %d 스텝까지 학습되어 이어서 학습하지 않고 warm start합니다: %s' % (
+                saved_step, latest))
+            warm_start_checkpoint = latest
+        elif all(saved_shapes.get(variable.op.name) == variable.shape.as_list()
+                 for variable in tf.global_variables()):
+            saver.restore(sess, latest)
+            start_step = sess.run(tf.train.get_global_step())
+            print('체크포인트에서 이어서 학습합니다: %s (step %d)' % (latest, start_step))
+            return start_step
+        else:
+            print('체크포인트의 변수 shape이 달라 이어서 학습하지 않고 warm start합니다: %s' % latest)
+            warm_start_checkpoint = latest
+    if warm_start_checkpoint:
+        warm_start_fc_layers(sess, warm_start_checkpoint)
+    return 0
+
+
+def save_checkpoint(sess, saver, checkpoint_dir, step):
+    ensure_dir_exists(checkpoint_dir)
+    with timers.phase('checkpoint'):
+        return saver.save(sess, os.path.join(checkpoint_dir, 'model.ckpt'), global_step=step)
+
+
+def run_train_step(sess, train_step, feed_dict, summary_writer, step, trace_dir, trace=False):
+    """
+    train_step을 한 번 실행한다. trace면 FULL_TRACE로 실행해 TensorBoard에 run metadata를 남기고
+    chrome://tracing에서 열 수 있는 timeline_step_<step>.json을 trace_dir에 저장한다.
+    """
+    if not trace:
+        sess.run(train_step, feed_dict=feed_dict)
+        return
+    run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    run_metadata = tf.RunMetadata()
+    sess.run(train_step, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+    summary_writer.add_run_metadata(run_metadata, 'step%05d' % step)
+    trace_path = os.path.join(trace_dir, 'timeline_step_%05d.json' % step)
+    with open(trace_path, 'w') as f:
+        f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+    print('step %d 프로파일러 trace 저장: %s' % (step, trace_path))
+
+
+def write_scalar_summaries(summary_writer, step, values):
+    """{태그: 값}을 그래프에 op를 추가하지 않고 TensorBoard scalar로 쓴다."""
+    summary = tf.Summary(value=[tf.Summary.Value(tag=tag, simple_value=float(value))
+                                for tag, value in sorted(values.items())])
+    summary_writer.add_summary(summary, step)
+
+
+def log_training_progress(train_log, summary_writer, throughput, step, batch_size, bottleneck_cache=None):
+    """직전 기록 이후의 steps/sec, samples/sec와 구간별 백분위 시간을 JSON 로그와 TensorBoard에 쓴다."""
+    steps_per_sec, samples_per_sec = throughput.mark(step + 1, (step + 1) * batch_size)
+    phases = timers.summary()
+    counters = dict(timers.counters)
+    if isinstance(bottleneck_cache, LRUBottleneckCache):
+        counters['lru_cache_hit'] = bottleneck_cache.hits
+        counters['lru_cache_miss'] = bottleneck_cache.misses
+    train_log.write('progress', step=step, steps_per_sec=steps_per_sec, samples_per_sec=samples_per_sec,
+                    phases=phases, counters=counters)
+
+    values = {'throughput/steps_per_sec': steps_per_sec, 'throughput/samples_per_sec': samples_per_sec}
+    for name in ['minibatch', 'train_step']:
+        if name in phases:
+            for percentile in ['p50_ms', 'p90_ms', 'p99_ms']:
+                values['latency/%s/%s' % (name, percentile)] = phases[name][percentile]
+    for name, value in counters.items():
+        values['counters/' + name] = value
+    write_scalar_summaries(summary_writer, step, values)
+
 #####################################################################################################################################
 
 
@@ -345,23 +1134,25 @@ def add_evaluation_step(result_tensor, ground_truth_tensor):
 
 
 
-def get_random_cached_bottlenecks(sess, image_lists, how_many, category, bottleneck_dir, image_dir,
-                                 jpeg_data_tensor, bottleneck_tensor):
+def get_random_cached_bottlenecks(sess, image_lists, how_many, category, bottleneck_store, image_dir,
+                                 jpeg_data_tensor, bottleneck_tensor, sampler=None, epoch_sampling=False):
+    """sampler(create_image_sampler, 없으면 클래스 균등)로 how_many개를 뽑는다. how_many가 음수면 전체를 가져온다."""
     class_count = len(image_lists.keys())
     bottlenecks = []
     ground_truths = []
     filenames = []
     if how_many >= 0:
         # 샘플링한 보틀넥을 가져온다.
-        for unused_i in range(how_many):
-            label_index = random.randrange(class_count)
-            label_name = list(image_lists.keys())[label_index]
-            image_index = random.randrange(MAX_NUM_IMAGES_PER_CLASS + 1)
+        if sampler is None:
+            sampler = create_image_sampler(image_lists, category)
+        label_names = list(image_lists.keys())
+        for label_index, image_index in zip(*sample_image_indices(sampler, how_many, epoch_sampling)):
+            label_name = label_names[label_index]
             image_name = get_image_path(image_lists, label_name, image_index,
                                       image_dir, category)
             bottleneck = get_or_create_bottleneck(sess, image_lists, label_name,
                                                 image_index, image_dir, category,
-                                                bottleneck_dir, jpeg_data_tensor,
+                                                bottleneck_store, jpeg_data_tensor,
                                                 bottleneck_tensor)
             ground_truth = np.zeros(class_count, dtype=np.float32)
             ground_truth[label_index] = 1.0
@@ -376,7 +1167,7 @@ def get_random_cached_bottlenecks(sess, image_lists, how_many, category, bottlen
                                             image_dir, category)
                 bottleneck = get_or_create_bottleneck(sess, image_lists, label_name,
                                                       image_index, image_dir, category,
-                                                      bottleneck_dir, jpeg_data_tensor,
+                                                      bottleneck_store, jpeg_data_tensor,
                                                       bottleneck_tensor)
                 ground_truth = np.zeros(class_count, dtype=np.float32)
                 ground_truth[label_index] = 1.0
@@ -386,224 +1177,625 @@ def get_random_cached_bottlenecks(sess, image_lists, how_many, category, bottlen
     return bottlenecks, ground_truths, filenames
 
 
-
-
-##############################################하이퍼파라미터 설정####################################################
-image_dir = 'data'
-output_graph = '/tmp/output_graph_ch2.pb'
-output_labels = '/tmp/output_labels_ch2.txt'
-summaries_dir = '/tmp/retrain_logs_ch2'
-how_many_training_steps = 1000
-learning_rate = 0.0001
-testing_percentage = 25
-validation_percentage = 25
-eval_step_interval = 10
-train_batch_size = 200
-test_batch_size = -1
-validation_batch_size = 200
-print_misclassified_test_images = False
-model_dir = '/tmp/imagenet_ch2'
-bottleneck_dir = '/tmp/bottleneck_ch2'
-final_tensor_name = 'final_result'
-flip_left_right = False
-random_crop = 0
-random_scale = 0
-random_brightness = 0
-log_frequency = 10
-log_device_placement = False
-
-dropout_while_training = tf.placeholder_with_default(True, shape= (), name = 'dropout_while_training') # dropout중에 어덯게 할건지.
-dropout_while_testing = tf.placeholder_with_default(False, shape= (), name = 'dropout_while_testing')
-
-
-
-## inception_v3를 다운받아 압축을 푼다.
-maybe_download_and_extract()
-
-## 그래프와 보틀넥 텐서, 이미지데이터 텐서, 리사이즈 이미지 텐서를 불러온다.
-graph, bottleneck_tensor, jpeg_data_tensor, resize_image_tensor = (create_inception_graph())
-
-## 재학습할 폴더를 가져와서 레이블화한다.
-image_lists = create_image_lists(image_dir, testing_percentage, validation_percentage)
-
-class_count = len(image_lists.keys())
-
-if class_count == 0:
-    print('이미지가 해당 경로에 없습니다: ' + image_dir)
-
-elif class_count == 1:
-    print('해당 경로에 클래스가 1개만 발견되었습니다: ' + image_dir + ' - 분류를 위해 2개 이상의 클래스가 필요합니다.')
-
-else:
-    print("클래스가 2개 이상 있습니다. 학습을 시작합니다.")
-
-
-## Image distortion // 현재 설정: False
-do_distort_images = should_distort_images(flip_left_right, random_crop, random_scale, random_brightness)
-
-
-
-
-
-
-##################################### 모델 학습 시작 ###################################################################
-# 텐서플로우 세션을 열고, 보틀넥 파일을 가져오고, Inception_v3 끝에 학습시킬 마지막 classifier 레이어를 붙인다.
-# 이후 에폭을 돌면서 이미지를 넣어 Training / Validation Accuracy를 산출한다.
-# 학습이 완료되면 테스트셋 이미지를 넣어 최종 테스트셋 정확도를 평가한다.
-
-acc_list = []
-
-with tf.Session(graph=graph) as sess:
-    if do_distort_images:
-        (distorted_jpeg_data_tensor, distorted_image_tensor) = add_input_distortion(
-            flip_left_right, random_crop, random_scale, random_brightness)
+def get_evaluation_chunks(sess, image_lists, category, chunk_size, bottleneck_cache, bottleneck_store, image_dir,
+                          jpeg_data_tensor, bottleneck_tensor):
+    """
+    카테고리 전체를 (보틀넥, 정수 레이블) 청크로 나눈 iterator와 같은 순서의 파일 이름을 리턴한다.
+    캐시가 있으면 캐시 배열을 그대로 잘라 쓰고, 없으면 저장소에서 한 번에 읽어 자른다.
+    """
+    if bottleneck_cache is not None:
+        return bottleneck_cache.iter_chunks(category, chunk_size), bottleneck_cache.filenames[category]
+    bottlenecks, ground_truths, filenames = get_random_cached_bottlenecks(
+        sess, image_lists, -1, category, bottleneck_store, image_dir, jpeg_data_tensor, bottleneck_tensor)
+    bottlenecks = np.array(bottlenecks, dtype=np.float32).reshape(-1, BOTTLENECK_TENSOR_SIZE)
+    labels = np.argmax(np.array(ground_truths).reshape(len(bottlenecks), -1), 1)
+    chunks = ((bottlenecks[i:i + chunk_size], labels[i:i + chunk_size])
+              for i in range(0, len(labels), chunk_size))
+    return chunks, filenames
+
+
+def sample_evaluation_chunk(sess, image_lists, category, how_many, bottleneck_cache, bottleneck_store, image_dir,
+                            jpeg_data_tensor, bottleneck_tensor):
+    """how_many개를 샘플링해 청크 하나짜리 리스트 [(보틀넥, 정수 레이블)]와 파일 이름을 리턴한다."""
+    if bottleneck_cache is not None:
+        bottlenecks, ground_truths, filenames = bottleneck_cache.sample(category, how_many)
     else:
-        cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir, jpeg_data_tensor, bottleneck_tensor)
-
-    ## 네트워크의 끝에 우리가 원하는 분류 레이어를 붙인다.
-    (train_step, cross_entropy, bottleneck_input,
-     ground_truth_input, final_tensor) = add_final_training_ops(len(image_lists.keys()),
-                                                                final_tensor_name,
-                                                                bottleneck_tensor)
-
-    ## 정확도 평가를 위한 새로운 오퍼레이션
-    evaluation_step, prediction = add_evaluation_step(final_tensor, ground_truth_input)
-
-    ## 가중치 초기화
-    init = tf.global_variables_initializer()
-    sess.run(init)
+        bottlenecks, ground_truths, filenames = get_random_cached_bottlenecks(
+            sess, image_lists, how_many, category, bottleneck_store, image_dir, jpeg_data_tensor,
+            bottleneck_tensor)
+    return [(np.array(bottlenecks), np.argmax(ground_truths, 1))], filenames
 
-    for i in range(how_many_training_steps):
 
-        ## 보틀넥과 정답지를 준비한다.
-        if do_distort_images:
-            (train_bottlenecks, train_ground_truth) = get_random_distorted_bottlenecks(
-                sess, image_lists, train_batch_size, 'training', image_dir, distorted_jpeg_data_tensor,
-                distorted_image_tensor, resized_image_tensor, bottleneck_tensor)
-        else:
-            (train_bottlenecks, train_ground_truth, _) = get_random_cached_bottlenecks(
-                sess, image_lists, train_batch_size, 'training', bottleneck_dir, image_dir,
-                jpeg_data_tensor, bottleneck_tensor)
+def plot_confusion_matrix(cm, classes, normalize=False, title='Confusion matrix', cmap=None):
+    """
+    confusion matrix를 현재 figure에 그린다.
+    normalize=True면 행(정답)마다 합이 1이 되도록 나눈다. 클래스가 많으면 칸마다 숫자를 쓰지 않는다.
+    """
+    import matplotlib.pyplot as plt
 
+    if normalize:
+        cm = cm.astype('float') / np.maximum(cm.sum(axis=1), 1)[:, np.newaxis]
 
-        ## 보틀넥과 정답지를 모델에 집어넣어 학습시킨다.
-        _ = sess.run(
-            [train_step],
-            feed_dict={bottleneck_input: train_bottlenecks,
-                      ground_truth_input: train_ground_truth})
+    plt.imshow(cm, interpolation='nearest', cmap=cmap or plt.cm.Blues)
+    plt.title(title)
+    plt.colorbar()
+    tick_marks = np.arange(len(classes))
+    plt.xticks(tick_marks, classes, rotation=45)
+    plt.yticks(tick_marks, classes)
 
-        ## 특정 구간마다 트레이닝 정확도와 cross entropy 로그, 밸리데이션 정확도를 출력한다.
-        is_last_step = (i + 1 == how_many_training_steps)
-        if (i % eval_step_interval) == 0 or is_last_step:
-            train_accuracy, cross_entropy_value = sess.run(
-                [evaluation_step, cross_entropy],
-                feed_dict = {bottleneck_input: train_bottlenecks,
-                            ground_truth_input: train_ground_truth})
+    if len(classes) <= 30:
+        fmt = '.2f' if normalize else 'd'
+        thresh = cm.max() / 2.
+        for (i, j), value in np.ndenumerate(cm):
+            plt.text(j, i, format(value, fmt),
+                     horizontalalignment="center",
+                     color="white" if value > thresh else "black")
 
-            print('%s: Step %d: Train accuracy = %.1f%%'% (datetime.now(), i, train_accuracy * 100))
-            print('%s: Step %d: Cross entropy = %f' % (datetime.now(), i, cross_entropy_value))
+    plt.tight_layout()
+    plt.ylabel('True label')
+    plt.xlabel('Predicted label')
 
-            validation_bottlenecks, validation_ground_truth, _ = (
-                get_random_cached_bottlenecks(
-                    sess, image_lists, validation_batch_size, 'validation', bottleneck_dir,
-                    image_dir, jpeg_data_tensor, bottleneck_tensor))
 
-            validation_accuracy = sess.run(
-                evaluation_step,
-                feed_dict = {bottleneck_input: validation_bottlenecks,
-                            ground_truth_input: validation_ground_truth})
-            print('%s: Step %d: Validation accuracy = %.1f%% (N=%d)'% (datetime.now(), i,
-                                                                       validation_accuracy * 100,
-                                                                       len(validation_bottlenecks)))
+def save_evaluation_plots(metrics_dir, history, cm, class_names, show=False):
+    """
+    learning curve와 confusion matrix를 <metrics_dir>에 png로 저장한다. show일 때만 화면에 띄운다.
+    matplotlib은 그림을 그릴 때만 import하므로 학습 / 추론 코드만 쓰는 쪽은 불러오지 않는다.
+    """
+    import matplotlib.pyplot as plt
 
-            ## 시각화를 위해 로그를 한벌 더 저장한다.
-            acc_list.append({"epoch": i, "train_accuracy": train_accuracy, "validation_accuracy": validation_accuracy})
+    if history:
+        f, ax = plt.subplots(figsize=(10, 5))
+        epochs = [row['epoch'] for row in history]
+        for column in ['train_accuracy', 'validation_accuracy']:
+            ax.plot(epochs, [row[column] for row in history], label=column)
+        ax.set_xlabel('epoch')
+        ax.legend()
+        f.savefig(os.path.join(metrics_dir, 'learning_curve.png'))
 
-    ## 테스트셋에 사용할 보틀넥과 정답지를 가져온다.
-    test_bottlenecks, test_ground_truth, test_filenames = (
-        get_random_cached_bottlenecks(sess, image_lists, test_batch_size, 'testing', bottleneck_dir,
-                                     image_dir, jpeg_data_tensor, bottleneck_tensor))
+    plt.figure()
+    plot_confusion_matrix(cm, classes=class_names, title='Confusion matrix, without normalization')
+    plt.savefig(os.path.join(metrics_dir, 'confusion_matrix.png'))
+    if show:
+        plt.show()
+    plt.close('all')
 
-    ## 테스트셋 정확도와 예측 분류값을 가져온다.
-    dropout_while_training = dropout_while_testing # dropout 때문에 추가한 코드. test 시에는 training을 False로 바꿔줘야함.
 
-    test_accuracy, predictions = sess.run(
-        [evaluation_step, prediction],
-        feed_dict={bottleneck_input: test_bottlenecks,
-                  ground_truth_input: test_ground_truth})
-    print('최종 학습 정확도 = %.1f%% (N=%d)' % (test_accuracy * 100, len(test_bottlenecks)))
+##############################################하이퍼파라미터 설정####################################################
+class PipelineConfig(object):
+    """
+    학습 파이프라인 설정. 클래스 속성이 기본값이고, 바꿀 값만 키워드로 넘긴다.
 
-    output_graph_def = graph_util.convert_variables_to_constants(
-        sess, graph.as_graph_def(), [final_tensor_name])
-    with gfile.FastGFile(output_graph, 'wb') as f:
-        f.write(output_graph_def.SerializeToString())
-    with gfile.FastGFile(output_labels, 'w') as f:
-        f.write('\n'.join(image_lists.keys()) + '\n')
+        config = PipelineConfig(image_dir='data', how_many_training_steps=100)
+        main(config)
+    """
+    image_dir = 'data'
+    image_manifest_path = '/tmp/image_manifest_ch2.json' # None이면 매번 모든 디렉토리를 다시 읽는다.
+    output_graph = '/tmp/output_graph_ch2.pb'
+    output_labels = '/tmp/output_labels_ch2.txt'
+    summaries_dir = '/tmp/retrain_logs_ch2'
+    how_many_training_steps = 1000
+    learning_rate = 0.0001
+    dropout_rate = 0.2 # FC 레이어의 드롭아웃 비율
+    hidden_units = [1000, 1000, 1000, 500] # FC 레이어의 은닉층 크기. 출력층은 클래스 수만큼 만든다.
+    testing_percentage = 25
+    validation_percentage = 25
+    eval_step_interval = 10
+    train_batch_size = 200
+    test_batch_size = -1
+    validation_batch_size = 200
+    print_misclassified_test_images = False
+    full_validation = False # True면 평가 스텝마다 밸리데이션셋 전체를 평가한다. (보틀넥 캐시 필요)
+    eval_chunk_size = 4096 # 평가할 때 한 번의 sess.run에 넣는 보틀넥 수
+    metrics_dir = '/tmp/metrics_ch2' # 평가 지표(JSON / CSV)와 그림을 저장하는 디렉토리
+    export_modes = [] # 'float32' / 'int8' / 'float16' 중 output_graph 옆에 추가로 저장할 변환 그래프. 예: ['int8', 'float16']
+    show_plots = False # True면 그림을 저장한 뒤 화면에도 띄운다.
+    model_dir = '/tmp/imagenet_ch2'
+    model_source_dir = None # classify_image_graph_def.pb를 미리 넣어둔 디렉토리. 지정하면 다운로드하지 않는다.
+    bottleneck_dir = '/tmp/bottleneck_ch2'
+    bottleneck_store_dtype = 'float32' # 'float16'으로 바꾸면 보틀넥 저장소 크기가 절반이 된다.
+    bottleneck_cache_mode = 'memory' # 'memory': 전체를 메모리에, 'lru': 최근 블록만 메모리에, 'disk': 매번 저장소에서 샘플링
+    bottleneck_cache_max_bytes = 2 * 1024 ** 3 # 'lru' 모드에서 메모리에 유지할 최대 크기
+    use_tf_data = False # True면 feed_dict 대신 tf.data 파이프라인으로 학습한다. ('memory' 캐시 필요)
+    final_tensor_name = FINAL_TENSOR_NAME
+    flip_left_right = False
+    random_crop = 0
+    random_scale = 0
+    random_brightness = 0
+    distortion_queue_depth = 4 # 미리 만들어둘 변형된 배치 수
+    distortion_threads = 2 # 배치를 불러와 변형하는 스레드 수
+    log_frequency = 10 # 이 스텝마다 처리량과 구간별 시간을 summaries_dir에 기록한다.
+    checkpoint_dir = '/tmp/checkpoints_ch2' # FC 레이어와 optimizer 상태를 저장하는 디렉토리
+    checkpoint_every_steps = 100 # 이 스텝마다 체크포인트를 저장한다. 0이면 저장하지 않는다.
+    max_checkpoints_to_keep = 3
+    resume_from_checkpoint = False # True면 checkpoint_dir의 마지막 체크포인트에서 이어서 학습한다. (끝난 학습이면 그 가중치로 새로 학습한다)
+    warm_start_checkpoint = None # 체크포인트 경로 / 디렉토리. 새 학습을 이 FC 가중치로 시작한다. resume_from_checkpoint보다 우선한다. (새 보틀넥 추가 후 재학습용)
+    profile_steps = [] # 이 스텝들에서 TF 스텝 프로파일러 trace(timeline)를 summaries_dir에 남긴다. 예: [10, 500]
+    log_device_placement = False
+    bottleneck_batch_size = 32 # 보틀넥을 만들 때 한 번의 sess.run에 넣는 이미지 수. 1이면 한 장씩 처리
+    preprocess_workers = 4 # array를 불러와 전처리하는 워커 스레드 수. 0이면 세션 스레드에서 직접 처리
+    preprocess_queue_depth = 64 # 미리 불러둘 array 수
+    bottleneck_shards = 0 # 1 이상이면 보틀넥을 이 수만큼의 프로세스로 나눠 만든다. 0이면 한 프로세스에서 만든다.
+    shard_intra_op_threads = 0 # 샤드 프로세스마다의 intra-op 스레드 수. 0이면 CPU 코어 수 / 샤드 수
+    shard_inter_op_threads = 1 # 샤드 프로세스마다의 inter-op 스레드 수
+    shard_checkpoint_batches = 10 # 이 수의 배치마다 샤드 저장소를 flush하고 진행 위치를 기록한다.
+    run_extraction_benchmark = False # True면 보틀넥 생성 전에 한 장씩 / 배치 처리 속도를 비교한다.
+    run_preprocessing_benchmark = False # True면 호스트에서 3채널로 쌓던 전처리와 지금 전처리의 시간 / 메모리를 비교한다.
+    benchmark_num_images = 256
+    watch_interval_sec = 5.0 # watch 모드에서 image_dir를 다시 훑는 주기
+    watch_settle_sec = 2.0 # watch 모드에서 수정된 지 이 시간이 지나지 않은 파일은 다음 주기로 미룬다.
+    use_min_max_scaling = False # True면 그래프 안에서 min_max_scaling_ch1을 적용한다. (float32 입력)
+    bottleneck_projection = None # 'pca' / 'random'이면 보틀넥을 projection_dim차원으로 줄여 저장해두고 그 위에서 학습한다. ('memory' / 'lru' 캐시 필요)
+    projection_dim = 256
+    projection_seed = 0 # 'random' 사영 행렬의 seed
+    sweep_space = {'learning_rate': [0.0001, 0.001], 'dropout_rate': [0.2, 0.5], 'hidden_units': [[1000, 1000, 1000, 500], [1024, 256]]} # python new_model.py sweep 으로 비교할 하이퍼파라미터
+    sweep_search = 'grid' # 'grid': sweep_space의 모든 조합, 'random': sweep_space에서 sweep_trials개를 뽑는다.
+    sweep_trials = 8
+    sweep_workers = 2 # trial을 동시에 학습하는 프로세스 수
+    sweep_seed = 0
+    sweep_dir = '/tmp/sweep_ch2' # sweep이 공유하는 보틀넥 배열과 결과(results.json / results.csv)를 저장하는 디렉토리
+    embedding_source = 'bottleneck' # python new_model.py embed 로 저장할 임베딩. 'bottleneck': 보틀넥, 'hidden': output_graph의 마지막 은닉층 출력
+    embedding_dir = '/tmp/embeddings_ch2' # 임베딩 저장소. 인덱스 / 조회는 embedding_index.py --embedding_dir
+    embedding_dtype = 'float16'
+    sampling_strategy = 'balanced' # 학습 배치 샘플링. 'balanced': 클래스 균등, 'uniform': 예제 균등, 'weighted': class_weights 비율
+    class_weights = None # 'weighted'에서 쓸 {클래스 이름: 가중치}. 지정하지 않은 클래스는 1
+    epoch_sampling = False # True면 복원 추출 대신 에폭마다 섞은 순서에서 복원 없이 뽑는다.
+
+    def __init__(self, **overrides):
+        for name, value in overrides.items():
+            if name.startswith('_') or callable(getattr(PipelineConfig, name, None)) or \
+                    not hasattr(PipelineConfig, name):
+                raise ValueError('Unknown config: %s' % name)
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in dir(PipelineConfig)
+                    if not name.startswith('_') and not callable(getattr(PipelineConfig, name)))
+
+
+def load_pipeline(config):
+    """
+    Inception 그래프 파일을 준비하고 그래프, 이미지 목록, 보틀넥 저장소를 연다.
+    config.model_dir는 실제로 쓰는 모델 디렉토리(model_source_dir를 주면 그 디렉토리)로 바뀐다.
+    리턴: (graph, bottleneck_tensor, jpeg_data_tensor, image_lists, bottleneck_store)
+    """
+    ## inception_v3를 다운받아 압축을 푼다. (이미 풀려 있으면 건너뛴다)
+    config.model_dir = bootstrap_model(config.model_dir, config.model_source_dir)
+
+    ## 그래프와 보틀넥 텐서, 이미지데이터 텐서를 불러온다.
+    with timers.phase('create_inception_graph'):
+        graph, bottleneck_tensor, jpeg_data_tensor, _ = create_inception_graph(config.model_dir,
+                                                                               config.use_min_max_scaling)
+
+    ## 재학습할 폴더를 가져와서 레이블화한다.
+    with timers.phase('create_image_lists'):
+        image_lists = create_image_lists(config.image_dir, config.testing_percentage, config.validation_percentage,
+                                         config.image_manifest_path) or {}
+
+    ## 보틀넥 저장소(memmap)를 연다.
+    bottleneck_store = open_bottleneck_store(config.bottleneck_dir, image_lists, config.model_dir,
+                                             config.bottleneck_store_dtype, config.use_min_max_scaling)
+    return graph, bottleneck_tensor, jpeg_data_tensor, image_lists, bottleneck_store
+
+
+def fill_bottleneck_store(config, sess, image_lists, bottleneck_store, jpeg_data_tensor, bottleneck_tensor):
+    """저장소에 없는 보틀넥을 (bottleneck_shards가 있으면 여러 프로세스로) 만든다."""
+    if config.run_preprocessing_benchmark:
+        benchmark_preprocessing(list_image_paths(image_lists, config.image_dir)[:config.benchmark_num_images])
+    if config.run_extraction_benchmark:
+        benchmark_bottleneck_extraction(sess, image_lists, config.image_dir, jpeg_data_tensor, bottleneck_tensor,
+                                        config.benchmark_num_images, config.bottleneck_batch_size)
+    with timers.phase('cache_bottlenecks'):
+        if config.bottleneck_shards > 0:
+            cache_bottlenecks_sharded(image_lists, config.image_dir, bottleneck_store, config.bottleneck_shards,
+                                      config.model_dir, config.use_min_max_scaling,
+                                      config.shard_intra_op_threads, config.shard_inter_op_threads,
+                                      config.bottleneck_batch_size, config.preprocess_workers,
+                                      config.preprocess_queue_depth, config.shard_checkpoint_batches)
+        else:
+            cache_bottlenecks(sess, image_lists, config.image_dir, bottleneck_store, jpeg_data_tensor,
+                              bottleneck_tensor, config.bottleneck_batch_size, config.preprocess_workers,
+                              config.preprocess_queue_depth)
 
 
+def prepare_bottleneck_cache(config, sess, image_lists, bottleneck_store, jpeg_data_tensor, bottleneck_tensor,
+                             do_distort_images=False):
+    """
+    없는 보틀넥을 만들어 저장소를 채우고, 설정에 따라 사영한 뒤 캐시에 올린다.
+    이미지를 변형해서 학습하면 보틀넥은 학습 스텝 안에서 계산하므로 미리 만들지 않는다.
+    리턴: (bottleneck_cache, projection, 사영 비용 기록). 쓰지 않는 것은 None
+    """
+    if not do_distort_images:
+        fill_bottleneck_store(config, sess, image_lists, bottleneck_store, jpeg_data_tensor, bottleneck_tensor)
+
+    ## bottleneck_projection이면 보틀넥을 줄인 특징을 만들어(이미 있으면 불러와) 캐시에 대신 올린다.
+    projection = None
+    feature_store = None
+    projection_report = None
+    if config.bottleneck_projection is not None:
+        if do_distort_images or config.bottleneck_cache_mode == 'disk':
+            raise ValueError("보틀넥 사영은 이미지 변형 없이 bottleneck_cache_mode = 'memory' / 'lru'에서만 "
+                             "사용할 수 있습니다.")
+        projection, feature_store, projection_report = create_projected_features(
+            image_lists, config.image_dir, bottleneck_store, config.bottleneck_dir, config.bottleneck_projection,
+            config.projection_dim, config.projection_seed)
+
+    ## 보틀넥을 한 번에 numpy 배열로 올려두고 미니배치는 인덱싱으로 뽑는다.
+    bottleneck_cache = None
+    if not do_distort_images and config.bottleneck_cache_mode != 'disk':
+        bottleneck_cache = create_bottleneck_cache(image_lists, config.image_dir, bottleneck_store,
+                                                   config.bottleneck_cache_mode, config.bottleneck_cache_max_bytes,
+                                                   feature_store, config.sampling_strategy, config.class_weights,
+                                                   config.epoch_sampling)
+    return bottleneck_cache, projection, projection_report
+
+
+def run_config_sweep(config, image_lists, bottleneck_cache):
+    """
+    config.sweep_space를 config.sweep_search 방식으로 펼쳐 sweep을 돌린다. 나머지 하이퍼파라미터는 config 값을 쓴다.
+    trial도 실제 학습과 같은 방식(sampling_strategy / class_weights / epoch_sampling)으로 training 배치를 뽑는다.
+    """
+    from sweep import grid_search, random_search, run_sweep
 
+    if bottleneck_cache is None:
+        raise ValueError("sweep은 이미지 변형 없이 bottleneck_cache_mode = 'memory' / 'lru'에서만 사용할 수 있습니다.")
+    if config.sweep_search == 'grid':
+        trials = grid_search(config.sweep_space)
+    else:
+        trials = random_search(config.sweep_space, config.sweep_trials, config.sweep_seed)
+    base_params = {'learning_rate': config.learning_rate, 'train_batch_size': config.train_batch_size,
+                   'dropout_rate': config.dropout_rate, 'hidden_units': config.hidden_units,
+                   'how_many_training_steps': config.how_many_training_steps}
+    return run_sweep(bottleneck_cache, trials, config.sweep_dir, base_params, config.sweep_workers,
+                     config.eval_step_interval, config.eval_chunk_size, seed=config.sweep_seed,
+                     sampling_strategy=config.sampling_strategy,
+                     class_weights=get_class_weight_list(image_lists, config.class_weights),
+                     epoch_sampling=config.epoch_sampling)
+
+
+def export_config_embeddings(config, image_lists, bottleneck_store):
+    """
+    모든 카테고리의 보틀넥(embedding_source = 'bottleneck') 또는 output_graph에 저장된 FC 레이어의
+    마지막 은닉층 출력('hidden')을 정규화해 embedding_dir에 저장한다. 이미 저장한 예제는 건너뛴다.
+    인덱스 생성과 조회는 embedding_index.py에서 한다.
+    """
+    from embedding_index import EmbeddingStore, embedding_fingerprint
+
+    keys = []
+    items = []
+    for category in ['training', 'testing', 'validation']:
+        keys += list_bottleneck_keys(image_lists, config.image_dir, bottleneck_store, category)
+        items += [[label_name, get_image_path(image_lists, label_name, index, config.image_dir, category)]
+                  for label_name in image_lists.keys() for index in range(len(image_lists[label_name][category]))]
+
+    hidden_sess = None
+    transform_fn = None
+    if config.embedding_source == 'bottleneck':
+        dim = BOTTLENECK_TENSOR_SIZE
+        graph_hash = ''
+    elif config.embedding_source == 'hidden':
+        if not config.hidden_units:
+            raise ValueError("embedding_source = 'hidden'에는 은닉층(hidden_units)이 있어야 합니다.")
+        ## frozen graph의 보틀넥 텐서에 저장된 보틀넥을 넣고 드롭아웃을 끈 채 마지막 은닉층 출력을 가져온다.
+        dim = config.hidden_units[-1]
+        graph_hash = file_hash(config.output_graph)
+        with tf.Graph().as_default() as hidden_graph:
+            with gfile.FastGFile(config.output_graph, 'rb') as f:
+                graph_def = tf.GraphDef()
+                graph_def.ParseFromString(f.read())
+            bottleneck_input, hidden_output, dropout_input = tf.import_graph_def(
+                graph_def, name='', return_elements=[BATCH_BOTTLENECK_TENSOR_NAME,
+                                                     'FC_layer/hidden%d/Elu:0' % len(config.hidden_units),
+                                                     'FC_layer/dropout_while_training:0'])
+        hidden_sess = tf.Session(graph=hidden_graph)
+        transform_fn = lambda bottlenecks: hidden_sess.run(hidden_output, {bottleneck_input: bottlenecks,
+                                                                           dropout_input: False})
+    else:
+        raise ValueError('Unknown embedding source: %s' % config.embedding_source)
 
-##################################### learning curve 그리기 #############################################################
+    embedding_store = EmbeddingStore(config.embedding_dir, config.embedding_source, dim,
+                                     embedding_fingerprint(config.embedding_source, bottleneck_store.fingerprint,
+                                                           graph_hash),
+                                     config.embedding_dtype, capacity=len(keys))
+    try:
+        with timers.phase('export_embeddings'):
+            num_added, export_sec = embedding_store.add(bottleneck_store, keys, items, transform_fn,
+                                                        config.eval_chunk_size)
+    finally:
+        if hidden_sess is not None:
+            hidden_sess.close()
+    print('임베딩 저장 (%s, %d차원, %s): 새로 %d개 / 전체 %d개, %.2fs, %.1f MB -> %s' % (
+        config.embedding_source, dim, config.embedding_dtype, num_added, len(embedding_store.store), export_sec,
+        embedding_store.store.nbytes_on_disk() / 1024.0 ** 2, config.embedding_dir))
+    return embedding_store
+
+
+def train_and_evaluate(config, graph, bottleneck_tensor, jpeg_data_tensor, image_lists, bottleneck_store):
+    """
+    Inception_v3 끝에 분류 레이어를 붙여 학습하고, 테스트셋을 평가한 뒤 output_graph / output_labels를 저장한다.
+    리턴: (평가 스텝마다의 기록, 테스트 confusion matrix, 테스트 파일 이름, 테스트 정답 레이블)
+    """
+    ## Image distortion // 현재 설정: False
+    do_distort_images = should_distort_images(config.flip_left_right, config.random_crop, config.random_scale,
+                                              config.random_brightness)
+    class_count = len(image_lists.keys())
 
-import pandas as pd
-acc_df = pd.DataFrame.from_dict(acc_list)
-acc_df.set_index('epoch', inplace=True)
+    ##################################### 모델 학습 시작 ###################################################################
+    # 텐서플로우 세션을 열고, 보틀넥 파일을 가져오고, Inception_v3 끝에 학습시킬 마지막 classifier 레이어를 붙인다.
+    # 이후 에폭을 돌면서 이미지를 넣어 Training / Validation Accuracy를 산출한다.
+    # 학습이 완료되면 테스트셋 이미지를 넣어 최종 테스트셋 정확도를 평가한다.
 
-f, ax = plt.subplots(figsize=(10, 5))
-acc_df.plot(ax=ax)
-plt.show()
+    acc_list = []
 
-#####################################confusion_matrix 그리기 ###########################################################
-print(predictions.shape)
-test_ground_truth = np.argmax(test_ground_truth, 1)
-test_ground_truth = np.array(test_ground_truth)
+    with tf.Session(graph=graph) as sess:
+        if do_distort_images:
+            ## 변형된 배치는 배경 스레드가 미리 만들고, 학습 스텝은 배치 입력 텐서에 바로 넣어
+            ## Inception forward와 FC 레이어 업데이트를 한 번의 sess.run으로 처리한다.
+            distorted_batches = create_distorted_batch_producer(
+                image_lists, config.train_batch_size, 'training', config.image_dir, config.flip_left_right,
+                config.random_crop, config.random_scale, config.random_brightness, config.distortion_queue_depth,
+                config.distortion_threads, config.sampling_strategy, config.class_weights, config.epoch_sampling)
+            distortion_start = time.time()
+
+        bottleneck_cache, projection, projection_report = prepare_bottleneck_cache(
+            config, sess, image_lists, bottleneck_store, jpeg_data_tensor, bottleneck_tensor, do_distort_images)
+
+        ## tf.data를 쓰면 학습 배치를 feed_dict로 복사하지 않고 그래프 안에서 바로 가져온다.
+        train_input = None
+        if config.use_tf_data and not do_distort_images:
+            train_iterator, train_iterator_feed = create_bottleneck_dataset(
+                bottleneck_cache, 'training', config.train_batch_size)
+            train_input = train_iterator.get_next()
+
+        ## 'disk' 모드는 저장소에서 직접 뽑으므로 training 샘플러를 한 번 만들어 스텝마다 쓴다.
+        train_sampler = None
+        if bottleneck_cache is None and not do_distort_images:
+            train_sampler = create_image_sampler(image_lists, 'training', config.sampling_strategy,
+                                                 config.class_weights)
+
+        ## 네트워크의 끝에 우리가 원하는 분류 레이어를 붙인다.
+        (train_step, cross_entropy, bottleneck_input,
+         ground_truth_input, final_tensor) = add_final_training_ops(len(image_lists.keys()),
+                                                                    config.final_tensor_name,
+                                                                    bottleneck_tensor,
+                                                                    train_input,
+                                                                    projection,
+                                                                    config.learning_rate,
+                                                                    config.dropout_rate,
+                                                                    config.hidden_units)
+
+        ## 정확도 평가를 위한 새로운 오퍼레이션
+        evaluation_step, prediction = add_evaluation_step(final_tensor, ground_truth_input)
+
+        ## 평가할 때는 드롭아웃을 끈다.
+        dropout_input = graph.get_tensor_by_name('FC_layer/dropout_while_training:0')
+        def predict_labels(bottlenecks):
+            return sess.run(prediction, feed_dict={bottleneck_input: bottlenecks, dropout_input: False})
+
+        ## 가중치 초기화. warm_start_checkpoint가 있으면 FC 가중치를 불러오고, 아니면 설정에 따라 체크포인트에서 이어서 학습한다.
+        saver = tf.train.Saver(tf.global_variables(), max_to_keep=config.max_checkpoints_to_keep)
+        start_step = restore_or_initialize(sess, saver, config.checkpoint_dir, config.resume_from_checkpoint,
+                                           config.warm_start_checkpoint, config.how_many_training_steps)
+        if train_input is not None:
+            sess.run(train_iterator.initializer, feed_dict=train_iterator_feed)
+
+        ## 구간별 시간, steps/sec, samples/sec를 summaries_dir의 JSON 로그와 TensorBoard에 남긴다.
+        summary_writer = tf.summary.FileWriter(os.path.join(config.summaries_dir, 'train'), graph)
+        train_log = JsonLinesLog(os.path.join(config.summaries_dir, 'train_log.jsonl'))
+        train_log.write('start', how_many_training_steps=config.how_many_training_steps, start_step=start_step,
+                        train_batch_size=config.train_batch_size, class_count=class_count, phases=timers.summary(),
+                        config=config.as_dict())
+        throughput = ThroughputMeter(start_step, start_step * config.train_batch_size)
+        training_start = time.time()
+
+        for i in range(start_step, config.how_many_training_steps):
+
+            is_last_step = (i + 1 == config.how_many_training_steps)
+            is_eval_step = (i % config.eval_step_interval) == 0 or is_last_step
+
+            ## 보틀넥과 정답지를 준비한다.
+            ## tf.data 모드에서는 입력이 그래프 안에 있으므로 평가할 때만 배치를 따로 뽑는다.
+            with timers.phase('minibatch'):
+                if train_input is not None:
+                    if is_eval_step:
+                        (train_bottlenecks, train_ground_truth, _) = bottleneck_cache.sample(
+                            'training', config.train_batch_size)
+                elif do_distort_images:
+                    (train_images, train_ground_truth) = distorted_batches.get()
+                elif bottleneck_cache is not None:
+                    (train_bottlenecks, train_ground_truth, _) = bottleneck_cache.sample(
+                        'training', config.train_batch_size)
+                else:
+                    (train_bottlenecks, train_ground_truth, _) = get_random_cached_bottlenecks(
+                        sess, image_lists, config.train_batch_size, 'training', bottleneck_store, config.image_dir,
+                        jpeg_data_tensor, bottleneck_tensor, train_sampler, config.epoch_sampling)
+
+            ## 변형한 배치는 보틀넥 대신 배치 입력 텐서에 넣는다. (보틀넥은 그래프 안에서 계산된다)
+            ## tf.data 모드는 평가 스텝에서만 배치를 뽑으므로 feed_dict도 그때만 만든다.
+            ## (체크포인트에서 이어서 학습하면 첫 스텝이 평가 스텝이 아닐 수 있다)
+            if do_distort_images:
+                train_feed_dict = {jpeg_data_tensor: train_images, ground_truth_input: train_ground_truth}
+            elif train_input is None or is_eval_step:
+                train_feed_dict = {bottleneck_input: train_bottlenecks, ground_truth_input: train_ground_truth}
+            else:
+                train_feed_dict = None
+
+            ## 보틀넥과 정답지를 모델에 집어넣어 학습시킨다. (tf.data 모드는 feed 없이 그래프 안의 배치로 학습)
+            ## profile_steps에 든 스텝은 TF 스텝 프로파일러 trace를 남긴다.
+            with timers.phase('train_step'):
+                run_train_step(sess, train_step, None if train_input is not None else train_feed_dict,
+                               summary_writer, i, config.summaries_dir, trace=i in config.profile_steps)
+
+            if config.checkpoint_every_steps > 0 and ((i + 1) % config.checkpoint_every_steps == 0 or is_last_step):
+                save_checkpoint(sess, saver, config.checkpoint_dir, i + 1)
+
+            if (i + 1) % config.log_frequency == 0 or is_last_step:
+                log_training_progress(train_log, summary_writer, throughput, i, config.train_batch_size,
+                                      bottleneck_cache)
+
+            ## 특정 구간마다 트레이닝 정확도와 cross entropy 로그, 밸리데이션 정확도를 출력한다.
+            if is_eval_step:
+                eval_start = time.time()
+                eval_feed_dict = dict(train_feed_dict)
+                eval_feed_dict[dropout_input] = False
+                train_accuracy, cross_entropy_value = sess.run(
+                    [evaluation_step, cross_entropy],
+                    feed_dict = eval_feed_dict)
+
+                print('%s: Step %d: Train accuracy = %.1f%%'% (datetime.now(), i, train_accuracy * 100))
+                print('%s: Step %d: Cross entropy = %f' % (datetime.now(), i, cross_entropy_value))
+
+                ## full_validation이면 메모리에 올려둔 밸리데이션셋 전체를, 아니면 샘플링한 배치를 평가한다.
+                if config.full_validation and bottleneck_cache is not None:
+                    validation_chunks = bottleneck_cache.iter_chunks('validation', config.eval_chunk_size)
+                else:
+                    validation_chunks, _ = sample_evaluation_chunk(
+                        sess, image_lists, 'validation', config.validation_batch_size, bottleneck_cache,
+                        bottleneck_store, config.image_dir, jpeg_data_tensor, bottleneck_tensor)
+                validation_cm, _, _ = evaluate_chunks(predict_labels, validation_chunks, class_count)
+                validation_accuracy = float(validation_cm.trace()) / max(validation_cm.sum(), 1)
+                if is_last_step:
+                    write_metrics(config.metrics_dir, 'validation', validation_cm, list(image_lists.keys()))
+                print('%s: Step %d: Validation accuracy = %.1f%% (N=%d)'% (datetime.now(), i,
+                                                                           validation_accuracy * 100,
+                                                                           validation_cm.sum()))
+
+                ## 시각화를 위해 로그를 한벌 더 저장한다.
+                acc_list.append({"epoch": i, "train_accuracy": train_accuracy, "validation_accuracy": validation_accuracy})
+                timers.add('evaluation', time.time() - eval_start)
+                eval_values = {'train_accuracy': train_accuracy, 'cross_entropy': cross_entropy_value,
+                               'validation_accuracy': validation_accuracy}
+                write_scalar_summaries(summary_writer, i, eval_values)
+                train_log.write('eval', step=i, **eval_values)
 
-from sklearn.metrics import confusion_matrix
-import itertools
-def plot_confusion_matrix(cm, classes,
-                          normalize=False,
-                          title='Confusion matrix',
-                          cmap=plt.cm.Blues):
+        if do_distort_images:
+            distorted_batches.stop()
+            distorted_batches.report(time.time() - distortion_start)
+
+        training_sec = max(time.time() - training_start, 1e-9)
+        steps_run = max(config.how_many_training_steps - start_step, 0)
+        print('학습: %d steps, %.2fs (%.1f steps/sec, %.1f samples/sec)' % (
+            steps_run, training_sec, steps_run / training_sec, steps_run * config.train_batch_size / training_sec))
+        timers.report()
+        train_log.write('end', training_sec=training_sec, phases=timers.summary(), counters=dict(timers.counters))
+        train_log.close()
+        summary_writer.close()
+
+        ## 테스트셋 전체를 청크 단위로 분류해 정확도, 클래스별 지표, confusion matrix를 계산한다.
+        ## test_batch_size가 0 이상이면 기존처럼 그 수만큼 샘플링한 배치로 평가한다.
+        class_names = list(image_lists.keys())
+        if config.test_batch_size < 0:
+            test_chunks, test_filenames = get_evaluation_chunks(
+                sess, image_lists, 'testing', config.eval_chunk_size, bottleneck_cache, bottleneck_store,
+                config.image_dir, jpeg_data_tensor, bottleneck_tensor)
+        else:
+            test_chunks, test_filenames = sample_evaluation_chunk(
+                sess, image_lists, 'testing', config.test_batch_size, bottleneck_cache, bottleneck_store,
+                config.image_dir, jpeg_data_tensor, bottleneck_tensor)
+        test_cm, predictions, test_labels = evaluate_chunks(predict_labels, test_chunks, class_count)
+        bottleneck_store.flush()
+
+        ## 사영을 썼으면 비용(맞추기 / 사영 시간, 특징 크기)과 학습 속도를 테스트 지표와 함께 남겨 사영 없이 학습한 결과와 비교한다.
+        test_extra = None
+        if projection_report is not None:
+            test_extra = {'projection': dict(
+                projection_report, train_steps_per_sec=steps_run / training_sec,
+                train_samples_per_sec=steps_run * config.train_batch_size / training_sec)}
+        test_metrics = write_metrics(config.metrics_dir, 'test', test_cm, class_names, test_extra)
+        print_metrics('최종 테스트', test_metrics)
+        if config.print_misclassified_test_images:
+            print('=== 잘못 분류된 테스트 이미지 ===')
+            for k in np.flatnonzero(predictions != test_labels):
+                print('%70s  %s' % (test_filenames[k], class_names[predictions[k]]))
+
+        output_graph_def = graph_util.convert_variables_to_constants(
+            sess, graph.as_graph_def(), [config.final_tensor_name])
+        with gfile.FastGFile(config.output_graph, 'wb') as f:
+            f.write(output_graph_def.SerializeToString())
+        with gfile.FastGFile(config.output_labels, 'w') as f:
+            f.write('\n'.join(image_lists.keys()) + '\n')
+
+    return acc_list, test_cm, test_filenames, test_labels
+
+
+def save_reports(config, class_names, history, test_cm, test_filenames, test_labels):
     """
-    This function prints and plots the confusion matrix.
-    Normalization can be applied by setting `normalize=True`.
+    평가 기록과 그림을 metrics_dir에 저장하고, export_modes가 있으면 변환 그래프를 저장해 원래 그래프와 비교한다.
+    그림과 graph transform은 여기서만 쓰므로 matplotlib과 export 모듈도 이 단계에서 불러온다.
     """
-    if normalize:
-        cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
-        print("Normalized confusion matrix")
-    else:
-        print('Confusion matrix, without normalization')
-
-    print(cm)
+    ##################################### 평가 기록 저장 / 그리기 ###########################################################
+    ## 그림은 파일로 저장하고 show_plots일 때만 화면에 띄운다.
+    write_history(config.metrics_dir, history)
+    save_evaluation_plots(config.metrics_dir, history, test_cm, class_names, config.show_plots)
+    print('평가 결과 저장: %s' % config.metrics_dir)
 
-    plt.imshow(cm, interpolation='nearest', cmap=cmap)
-    plt.title(title)
-    plt.colorbar()
-    tick_marks = np.arange(len(classes))
-    plt.xticks(tick_marks, classes, rotation=45)
-    plt.yticks(tick_marks, classes)
+    ## 양자화 / float16 그래프를 저장하고 테스트셋에서 원래 그래프와 정확도, 속도, 크기를 비교한다.
+    if config.export_modes:
+        from export import export_and_compare
+        export_and_compare(config.output_graph, config.output_labels, config.export_modes, test_filenames,
+                           test_labels, os.path.join(config.metrics_dir, 'export_report.json'),
+                           config.bottleneck_batch_size, config.preprocess_workers)
 
-    fmt = '.2f' if normalize else 'd'
-    thresh = cm.max() / 2.
-    for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
-        plt.text(j, i, format(cm[i, j], fmt),
-                 horizontalalignment="center",
-                 color="white" if cm[i, j] > thresh else "black")
 
-    plt.tight_layout()
-    plt.ylabel('True label')
-    plt.xlabel('Predicted label')
+def main(config=None, argv=None):
+    """
+    python new_model.py [gc | watch | sweep | embed]
 
+        (없음) : 보틀넥을 만들고 FC 레이어를 학습한 뒤 평가 결과와 frozen graph를 저장한다.
+        gc     : 지금 이미지 목록에서 참조하지 않는 보틀넥을 정리한다.
+        watch  : 새로 들어오는 파일의 보틀넥을 계속 만들어 저장소에 추가한다. (Ctrl+C로 종료)
+        sweep  : 같은 보틀넥 캐시로 sweep_space의 설정들을 여러 프로세스에서 학습해 비교한다.
+        embed  : 보틀넥을 만들고 embedding_source의 임베딩을 embedding_dir에 저장한다.
+    """
+    if config is None:
+        config = PipelineConfig()
+    if argv is None:
+        argv = sys.argv
+    command = argv[1] if len(argv) > 1 else None
+    if command not in (None, 'gc', 'watch', 'sweep', 'embed'):
+        raise ValueError('Unknown command: %s' % command)
 
+    graph, bottleneck_tensor, jpeg_data_tensor, image_lists, bottleneck_store = load_pipeline(config)
 
+    class_count = len(image_lists.keys())
+    if class_count == 0:
+        print('이미지가 해당 경로에 없습니다: ' + config.image_dir)
+        return
+    elif class_count == 1:
+        print('해당 경로에 클래스가 1개만 발견되었습니다: ' + config.image_dir + ' - 분류를 위해 2개 이상의 클래스가 필요합니다.')
+        return
+
+    if command == 'gc':
+        garbage_collect_bottlenecks(image_lists, config.image_dir, bottleneck_store)
+        return
+
+    if command == 'watch':
+        with tf.Session(graph=graph) as sess:
+            watch_image_dir(sess, config.image_dir, bottleneck_store, jpeg_data_tensor, bottleneck_tensor,
+                            config.image_manifest_path or os.path.join(config.bottleneck_dir, 'watch_manifest.json'),
+                            config.testing_percentage, config.validation_percentage, config.watch_interval_sec,
+                            config.watch_settle_sec, config.bottleneck_batch_size, config.preprocess_workers,
+                            config.preprocess_queue_depth)
+        return
+
+    if command == 'sweep':
+        with tf.Session(graph=graph) as sess:
+            bottleneck_cache, _, _ = prepare_bottleneck_cache(config, sess, image_lists, bottleneck_store,
+                                                              jpeg_data_tensor, bottleneck_tensor)
+            run_config_sweep(config, image_lists, bottleneck_cache)
+        return
+
+    if command == 'embed':
+        with tf.Session(graph=graph) as sess:
+            fill_bottleneck_store(config, sess, image_lists, bottleneck_store, jpeg_data_tensor, bottleneck_tensor)
+        export_config_embeddings(config, image_lists, bottleneck_store)
+        return
 
-# Compute confusion matrix
-class_names = ['1', '2', '3', '4', '5', '6']
-cnf_matrix = confusion_matrix(test_ground_truth, predictions)#########
-np.set_printoptions(precision=2)
+    print("클래스가 2개 이상 있습니다. 학습을 시작합니다.")
+    history, test_cm, test_filenames, test_labels = train_and_evaluate(
+        config, graph, bottleneck_tensor, jpeg_data_tensor, image_lists, bottleneck_store)
+    save_reports(config, list(image_lists.keys()), history, test_cm, test_filenames, test_labels)
 
-# Plot non-normalized confusion matrix
-plt.figure()
-plot_confusion_matrix(cnf_matrix, classes=class_names, title='Confusion matrix, without normalization')
 
-plt.show()
+## import할 때는 아무것도 실행하지 않는다.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+보틀넥(2048차원)을 낮은 차원으로 줄이는 선형 사영.
+학습 보틀넥으로 한 번 맞춘 뒤 줄인 특징을 별도 저장소에 저장해두고 FC 레이어를 그 위에서 학습한다.
+같은 사영을 그래프 안에도 넣으므로(add_final_training_ops) 저장한 frozen graph는 이미지 입력을 그대로 받는다.
+
+    - 'pca'    : 학습 보틀넥의 평균을 빼고 공분산의 상위 고유벡터로 사영한다.
+    - 'random' : 평균을 빼고 N(0, 1/dim) 가우시안 행렬로 사영한다. 맞추는 비용이 없다.
+"""
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+
+from bottleneck_store import BottleneckStore, array_hash
+
+PROJECTION_METHODS = ['pca', 'random']
+
+
+class BottleneckProjection(object):
+    """projected = (bottlenecks - mean) @ components. components는 [input_dim, dim] float32"""
+
+    FILENAME = 'projection.npz'
+
+    def __init__(self, method, mean, components, explained_variance_ratio=None, source_fingerprint='',
+                 fit_sec=0.0, num_fit_examples=0, seed=0):
+        self.method = method
+        self.seed = seed
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance_ratio = explained_variance_ratio
+        self.source_fingerprint = source_fingerprint
+        self.fit_sec = fit_sec
+        self.num_fit_examples = num_fit_examples
+
+    @property
+    def input_dim(self):
+        return self.components.shape[0]
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    def fingerprint(self):
+        """줄인 특징 저장소의 fingerprint. 사영 행렬이나 원래 저장소가 바뀌면 달라진다."""
+        return hashlib.sha1('{}:{}:{}:{}'.format(self.method, self.source_fingerprint, array_hash(self.mean),
+                                                 array_hash(self.components)).encode('ascii')).hexdigest()
+
+    def transform(self, bottlenecks):
+        return np.dot(np.asarray(bottlenecks, dtype=np.float32) - self.mean, self.components)
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, method=self.method, mean=self.mean, components=self.components,
+                 explained_variance_ratio=-1.0 if self.explained_variance_ratio is None
+                 else self.explained_variance_ratio,
+                 source_fingerprint=self.source_fingerprint, fit_sec=self.fit_sec,
+                 num_fit_examples=self.num_fit_examples, seed=self.seed)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            explained_variance_ratio = float(f['explained_variance_ratio'])
+            return cls(str(f['method']), f['mean'], f['components'],
+                       None if explained_variance_ratio < 0 else explained_variance_ratio,
+                       str(f['source_fingerprint']), float(f['fit_sec']), int(f['num_fit_examples']),
+                       int(f['seed']))
+
+
+def fit_pca(bottleneck_store, rows, dim, chunk_size=4096):
+    """
+    bottleneck_store의 rows 행으로 PCA를 맞춘다.
+    평균과 공분산([input_dim, input_dim])을 chunk_size행씩 float64로 누적하므로 학습셋 전체를 메모리에 올리지 않는다.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if dim > bottleneck_store.dim or dim > len(rows):
+        raise ValueError('PCA dim %d는 입력 차원(%d)과 학습 예제 수(%d)보다 클 수 없습니다.' % (
+            dim, bottleneck_store.dim, len(rows)))
+    start = time.time()
+    total = np.zeros(bottleneck_store.dim, dtype=np.float64)
+    gram = np.zeros((bottleneck_store.dim, bottleneck_store.dim), dtype=np.float64)
+    for chunk_start in range(0, len(rows), chunk_size):
+        chunk = np.asarray(bottleneck_store.get_rows(rows[chunk_start:chunk_start + chunk_size]), dtype=np.float64)
+        total += chunk.sum(axis=0)
+        gram += np.dot(chunk.T, chunk)
+    mean = total / len(rows)
+    covariance = gram / len(rows) - np.outer(mean, mean)
+
+    ## eigh는 고유값을 오름차순으로 리턴한다.
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    eigenvalues = np.maximum(eigenvalues[::-1], 0.0)
+    components = eigenvectors[:, ::-1][:, :dim]
+    explained_variance_ratio = float(eigenvalues[:dim].sum() / max(eigenvalues.sum(), 1e-12))
+    return BottleneckProjection('pca', mean, components, explained_variance_ratio, bottleneck_store.fingerprint,
+                                time.time() - start, len(rows))
+
+
+def fit_random_projection(bottleneck_store, rows, dim, seed=0, chunk_size=4096):
+    """평균만 rows로 계산하고 사영 행렬은 seed로 만든 가우시안 행렬을 쓴다."""
+    rows = np.asarray(rows, dtype=np.int64)
+    start = time.time()
+    total = np.zeros(bottleneck_store.dim, dtype=np.float64)
+    for chunk_start in range(0, len(rows), chunk_size):
+        total += np.asarray(bottleneck_store.get_rows(rows[chunk_start:chunk_start + chunk_size]),
+                            dtype=np.float64).sum(axis=0)
+    mean = total / max(len(rows), 1)
+    components = np.random.RandomState(seed).normal(0.0, 1.0 / np.sqrt(dim), size=(bottleneck_store.dim, dim))
+    return BottleneckProjection('random', mean, components, None, bottleneck_store.fingerprint,
+                                time.time() - start, len(rows), seed)
+
+
+def fit_projection(method, bottleneck_store, rows, dim, seed=0):
+    if method == 'pca':
+        return fit_pca(bottleneck_store, rows, dim)
+    if method == 'random':
+        return fit_random_projection(bottleneck_store, rows, dim, seed)
+    raise ValueError('Unknown projection method: %s' % method)
+
+
+def projection_dir(bottleneck_dir, method, dim):
+    return os.path.join(bottleneck_dir, 'projection_%s_%d' % (method, dim))
+
+
+def load_or_fit_projection(store_dir, method, bottleneck_store, rows, dim, seed=0):
+    """
+    store_dir에 저장한 사영이 있고 같은 보틀넥 저장소(fingerprint)로 맞춘 것이면 그대로 쓰고,
+    아니면 store_dir를 비우고(예전 사영으로 줄인 특징 포함) 새로 맞춰 저장한다.
+    새 이미지가 추가되어도 다시 맞추지 않으므로 이미 줄여둔 특징을 다시 계산하지 않는다. 다시 맞추려면 store_dir를 지운다.
+    """
+    path = os.path.join(store_dir, BottleneckProjection.FILENAME)
+    if os.path.exists(path):
+        projection = BottleneckProjection.load(path)
+        if (projection.method == method and projection.dim == dim and
+                (method != 'random' or projection.seed == seed) and
+                projection.source_fingerprint == bottleneck_store.fingerprint):
+            return projection
+        shutil.rmtree(store_dir)
+    projection = fit_projection(method, bottleneck_store, rows, dim, seed)
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    projection.save(path)
+    return projection
+
+
+def project_store(bottleneck_store, projection, store_dir, keys, chunk_size=4096):
+    """
+    keys의 보틀넥을 사영해 store_dir/features 저장소(키는 원래 저장소와 같다)에 저장한다. 이미 저장된 키는 건너뛴다.
+    store_dir는 load_or_fit_projection이 사영을 새로 맞출 때 비우므로 저장된 특징은 항상 지금 사영으로 만든 것이다.
+    리턴: (줄인 특징 저장소, 새로 사영한 수, 걸린 시간)
+    """
+    store = BottleneckStore(os.path.join(store_dir, 'features'), projection.dim, capacity=len(keys),
+                            fingerprint=projection.fingerprint())
+    start = time.time()
+    missing = [key for key in keys if not store.is_valid(key)]
+    for chunk_start in range(0, len(missing), chunk_size):
+        chunk_keys = missing[chunk_start:chunk_start + chunk_size]
+        bottlenecks = bottleneck_store.get_rows([bottleneck_store.row(key) for key in chunk_keys])
+        store.put_many(chunk_keys, projection.transform(bottlenecks))
+    store.flush()
+    return store, len(missing), time.time() - start
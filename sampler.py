@@ -0,0 +1,119 @@
+"""
+정수 레이블 배열로 미니배치 인덱스를 뽑는 샘플러.
+클래스별 인덱스 배열을 미리 만들어 두고 배치 전체를 numpy 연산 몇 번으로 뽑으므로 클래스 수가 늘어도 비용이 거의 같다.
+
+    - 'balanced' : 클래스를 같은 확률로 고른 뒤 그 클래스 안에서 고른다. (get_random_cached_bottlenecks의 기존 방식)
+    - 'uniform'  : 모든 예제를 같은 확률로 고른다. 클래스 비율은 데이터 비율을 따른다.
+    - 'weighted' : class_weights 비율로 클래스를 고른 뒤 그 클래스 안에서 고른다.
+
+sample은 복원 추출, next_batch / epoch는 에폭 단위로 섞은 순서에서 복원 없이 차례로 뽑는다.
+"""
+import numpy as np
+
+SAMPLING_STRATEGIES = ['balanced', 'uniform', 'weighted']
+
+
+class Sampler(object):
+    """
+    labels(예제마다의 정수 레이블)로 만든 샘플러. 예제 인덱스(labels의 위치)를 리턴한다.
+    class_weights는 'weighted'에서 클래스마다의 가중치(길이 class_count)이다.
+    """
+
+    def __init__(self, labels, class_count, strategy='balanced', class_weights=None, rng=None):
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError('Unknown sampling strategy: %s' % strategy)
+        labels = np.asarray(labels, dtype=np.int64)
+        self.class_count = class_count
+        self.strategy = strategy
+        self.num_examples = len(labels)
+        ## np.random을 넘기면(기본값) 전역 seed를 따른다.
+        self.rng = np.random if rng is None else rng
+
+        ## order[class_starts[c]:class_starts[c] + class_sizes[c]]가 클래스 c의 예제 인덱스이다.
+        self.order = np.argsort(labels, kind='mergesort')
+        self.class_sizes = np.bincount(labels, minlength=class_count)
+        self.class_starts = np.concatenate(([0], np.cumsum(self.class_sizes)[:-1]))
+        self.class_probs = self._class_probs(class_weights)
+        self.epochs_completed = 0
+        self._epoch_order = np.zeros(0, dtype=np.int64)
+        self._position = 0
+
+    @classmethod
+    def from_class_sizes(cls, class_sizes, strategy='balanced', class_weights=None, rng=None):
+        """레이블 순서로 정렬된 예제(클래스 c의 예제가 class_sizes[c]개씩 이어진다)의 샘플러"""
+        class_sizes = np.asarray(class_sizes, dtype=np.int64)
+        return cls(np.repeat(np.arange(len(class_sizes)), class_sizes), len(class_sizes), strategy,
+                   class_weights, rng)
+
+    def _class_probs(self, class_weights):
+        """클래스를 고를 확률. 예제가 없는 클래스는 0이다."""
+        if self.strategy == 'uniform':
+            weights = self.class_sizes.astype(np.float64)
+        elif self.strategy == 'balanced':
+            weights = (self.class_sizes > 0).astype(np.float64)
+        else:
+            if class_weights is None:
+                raise ValueError("'weighted' 샘플링에는 class_weights가 필요합니다.")
+            weights = np.asarray(class_weights, dtype=np.float64).reshape(self.class_count)
+            if np.any(weights < 0):
+                raise ValueError('class_weights는 0 이상이어야 합니다.')
+            weights = weights * (self.class_sizes > 0)
+        total = weights.sum()
+        if total <= 0:
+            return weights
+        return weights / total
+
+    def sample(self, how_many):
+        """how_many개의 예제 인덱스를 복원 추출한다."""
+        if self.num_examples == 0 or self.class_probs.sum() <= 0:
+            raise ValueError('샘플링할 예제가 없습니다.')
+        if self.strategy == 'uniform':
+            return self.rng.randint(self.num_examples, size=how_many)
+        labels = self.rng.choice(self.class_count, size=how_many, p=self.class_probs)
+        offsets = (self.rng.random_sample(how_many) * self.class_sizes[labels]).astype(np.int64)
+        return self.order[self.class_starts[labels] + offsets]
+
+    def epoch_order(self):
+        """
+        에폭 하나의 예제 순서. 에폭 길이는 예제 수와 같고, 클래스마다 class_probs 비율만큼(최대 잔여 방식으로 반올림) 넣는다.
+        클래스 안에서는 섞은 순서를 돌아가며 쓰므로 작은 클래스도 한 바퀴를 다 돌기 전에는 같은 예제가 다시 나오지 않는다.
+        'uniform'이면 모든 예제를 한 번씩 섞은 순서와 같다.
+        """
+        quotas = self.class_probs * self.num_examples
+        counts = np.floor(quotas).astype(np.int64)
+        remainder = self.num_examples - counts.sum()
+        if remainder > 0:
+            counts[np.argsort(counts - quotas, kind='mergesort')[:remainder]] += 1
+
+        ## 클래스마다 counts[c]개를 섞은 인덱스에서 순환해서 가져온다.
+        class_of = np.repeat(np.arange(self.class_count), counts)
+        rank = np.arange(len(class_of)) - np.repeat(np.cumsum(counts) - counts, counts)
+        shuffled = self.order[np.argsort(np.repeat(np.arange(self.class_count), self.class_sizes) +
+                                         self.rng.random_sample(self.num_examples))]
+        sizes = np.maximum(self.class_sizes[class_of], 1)
+        order = shuffled[self.class_starts[class_of] + rank % sizes]
+        return order[self.rng.permutation(len(order))]
+
+    def next_batch(self, how_many):
+        """에폭 순서에서 다음 how_many개를 복원 없이 가져온다. 에폭이 끝나면 새로 섞어 이어서 가져온다."""
+        if self.num_examples == 0 or self.class_probs.sum() <= 0:
+            raise ValueError('샘플링할 예제가 없습니다.')
+        batches = []
+        needed = how_many
+        while needed > 0:
+            if self._position >= len(self._epoch_order):
+                if len(self._epoch_order):
+                    self.epochs_completed += 1
+                self._epoch_order = self.epoch_order()
+                self._position = 0
+            taken = self._epoch_order[self._position:self._position + needed]
+            self._position += len(taken)
+            needed -= len(taken)
+            batches.append(taken)
+        return np.concatenate(batches)
+
+    def epoch(self, batch_size):
+        """새로 섞은 에폭 하나를 batch_size개씩 (마지막은 남은 만큼) 나눠 리턴한다."""
+        order = self.epoch_order()
+        for start in range(0, len(order), batch_size):
+            yield order[start:start + batch_size]
@@ -0,0 +1,218 @@
+"""
+frozen graph(output_graph)를 불러와 localhost에서 HTTP로 분류 요청을 받는다.
+동시에 들어온 요청은 max_batch_size개가 모이거나 max_wait_ms가 지날 때까지 모아 한 번에 그래프에 넣는다.
+
+    POST /predict : body = np.save로 직렬화한 2D array (.npy 바이트)
+                    응답 = {"probabilities": [...], "prediction": 0, "label": "..."}
+    GET  /metrics : 큐 길이, 배치 크기 히스토그램, latency 카운터
+
+사용 예:
+    python serve.py --graph /tmp/output_graph_ch2.pb --labels /tmp/output_labels_ch2.txt --port 8500
+    python load_test.py --port 8500 --concurrency 16 --requests 50
+"""
+import argparse
+import collections
+import io
+import json
+import threading
+import time
+
+import numpy as np
+from six.moves import queue
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from inference import FrozenClassifier
+from input_pipeline import add_channel_axis, group_by_shape
+
+
+class _Request(object):
+    def __init__(self, image_data):
+        self.image_data = image_data
+        self.enqueued = time.time()
+        self.done = threading.Event()
+        self.probabilities = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """
+    요청을 큐에 모아 하나의 스레드에서 배치로 분류한다.
+    첫 요청이 들어온 뒤 max_wait_ms 안에 들어온 요청을 max_batch_size개까지 한 배치로 묶는다.
+    """
+
+    def __init__(self, classifier, max_batch_size=32, max_wait_ms=5.0, latency_window=10000):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait_sec = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._queue_waits = collections.deque(maxlen=latency_window)
+        self._requests = 0
+        self._errors = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, image_data):
+        """한 장을 큐에 넣고 배치가 처리될 때까지 기다려 확률을 리턴한다."""
+        request = _Request(image_data)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.probabilities
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait_sec
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _predict_group(self, group):
+        """
+        shape이 같은 요청들을 한 배치로 분류한다. 실패하면 한 장씩 다시 분류해
+        잘못된 요청만 에러를 받고 같은 배치의 다른 요청은 결과를 받게 한다.
+        """
+        try:
+            probabilities = self.classifier.predict_batch(np.stack([request.image_data for request in group]))
+            for request, request_probabilities in zip(group, probabilities):
+                request.probabilities = request_probabilities
+            return
+        except Exception as e:
+            if len(group) == 1:
+                group[0].error = e
+                return
+        for request in group:
+            try:
+                request.probabilities = self.classifier.predict_batch(request.image_data[np.newaxis])[0]
+            except Exception as e:
+                request.error = e
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.time()
+            for indices in group_by_shape([request.image_data for request in batch]):
+                self._predict_group([batch[i] for i in indices])
+            finished = time.time()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._requests += len(batch)
+                self._errors += sum(1 for request in batch if request.error is not None)
+                for request in batch:
+                    self._queue_waits.append(started - request.enqueued)
+                    self._latencies.append(finished - request.enqueued)
+            for request in batch:
+                request.done.set()
+
+    def metrics(self):
+        with self._lock:
+            latencies_ms = np.array(self._latencies) * 1000.0
+            queue_waits_ms = np.array(self._queue_waits) * 1000.0
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'requests': self._requests,
+                'errors': self._errors,
+                'batches': batches,
+                'mean_batch_size': float(self._requests) / batches if batches else 0.0,
+                'batch_size_histogram': dict((str(k), v) for k, v in sorted(self._batch_sizes.items())),
+                'latency_ms': _percentiles(latencies_ms),
+                'queue_wait_ms': _percentiles(queue_waits_ms),
+            }
+
+
+def _percentiles(values):
+    if not len(values):
+        return {}
+    return {'p50': float(np.percentile(values, 50)), 'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(batcher, labels):
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send_json(200, batcher.metrics())
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                image_data = np.load(io.BytesIO(self.rfile.read(length)), allow_pickle=False)
+                if image_data.ndim != 2:
+                    raise ValueError('2D array가 필요합니다. shape=%s' % (image_data.shape,))
+            except Exception as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            try:
+                probabilities = batcher.predict(add_channel_axis(image_data))
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+            prediction = int(np.argmax(probabilities))
+            self._send_json(200, {
+                'probabilities': [float(p) for p in probabilities],
+                'prediction': prediction,
+                'label': labels[prediction] if labels else str(prediction),
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='frozen graph 분류 서버 (micro-batching)')
+    parser.add_argument('--graph', default='/tmp/output_graph_ch2.pb')
+    parser.add_argument('--labels', default='/tmp/output_labels_ch2.txt')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    classifier = FrozenClassifier(args.graph, args.labels)
+    batcher = MicroBatcher(classifier, args.max_batch_size, args.max_wait_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, classifier.labels))
+    print('분류 서버 시작: http://%s:%d (max_batch_size=%d, max_wait_ms=%.1f)' % (
+        args.host, args.port, args.max_batch_size, args.max_wait_ms))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        classifier.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+하이퍼파라미터 sweep. 같은 보틀넥 캐시로 FC 레이어를 여러 설정으로 동시에 학습해 밸리데이션 정확도 순으로 정리한다.
+
+캐시의 training / validation 배열을 sweep_dir에 .npy로 한 번 저장하고,
+trial을 돌리는 프로세스들은 그 파일을 np.load(mmap_mode='r')로 읽기 전용으로 열어 같은 페이지 캐시를 공유한다.
+
+    space = {'learning_rate': [1e-4, 1e-3], 'dropout_rate': [0.2, 0.5], 'hidden_units': [[1000, 500], [256]]}
+    run_sweep(bottleneck_cache, grid_search(space), '/tmp/sweep_ch2', base_params, num_workers=4)
+
+base_params에는 trial이 바꾸지 않는 하이퍼파라미터(TRIAL_PARAMS 전부)를 넣는다.
+training 배치 샘플링(sampling_strategy / class_weights / epoch_sampling)은 모든 trial이 같은 설정을 쓴다.
+random_search의 space에는 값 리스트(그중 하나를 고른다) 대신 ('uniform', 최소, 최대) / ('log_uniform', 최소, 최대)도 쓸 수 있다.
+"""
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from bottleneck_cache import ArrayBottleneckCache
+from evaluation import evaluate_chunks
+from sampler import Sampler
+
+SWEEP_CATEGORIES = ['training', 'validation']
+TRIAL_PARAMS = ['learning_rate', 'train_batch_size', 'dropout_rate', 'hidden_units', 'how_many_training_steps']
+
+
+def grid_search(space):
+    """space({이름: 값 리스트})의 모든 조합을 dict 리스트로 리턴한다."""
+    names = sorted(space.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+def random_search(space, num_trials, seed=0):
+    """space에서 num_trials개의 조합을 뽑는다."""
+    random_state = np.random.RandomState(seed)
+    trials = []
+    for _ in range(num_trials):
+        params = {}
+        for name in sorted(space.keys()):
+            values = space[name]
+            if isinstance(values, tuple) and values[0] == 'uniform':
+                params[name] = float(random_state.uniform(values[1], values[2]))
+            elif isinstance(values, tuple) and values[0] == 'log_uniform':
+                params[name] = float(np.exp(random_state.uniform(np.log(values[1]), np.log(values[2]))))
+            else:
+                params[name] = values[random_state.randint(len(values))]
+        trials.append(params)
+    return trials
+
+
+def save_sweep_arrays(sweep_dir, bottleneck_cache, chunk_size=4096):
+    """캐시의 training / validation 보틀넥과 레이블을 <sweep_dir>/<category>_bottlenecks.npy, _labels.npy로 저장한다."""
+    if not os.path.exists(sweep_dir):
+        os.makedirs(sweep_dir)
+    for category in SWEEP_CATEGORIES:
+        labels = bottleneck_cache.labels[category]
+        bottlenecks = None
+        start = 0
+        for chunk, _ in bottleneck_cache.iter_chunks(category, chunk_size):
+            if bottlenecks is None:
+                bottlenecks = np.lib.format.open_memmap(
+                    os.path.join(sweep_dir, category + '_bottlenecks.npy'), mode='w+', dtype=np.float32,
+                    shape=(len(labels), chunk.shape[1]))
+            bottlenecks[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        if bottlenecks is None:
+            raise ValueError('sweep에 쓸 %s 보틀넥이 없습니다.' % category)
+        bottlenecks.flush()
+        del bottlenecks
+        np.save(os.path.join(sweep_dir, category + '_labels.npy'), labels)
+
+
+def load_sweep_cache(sweep_dir, class_count):
+    """save_sweep_arrays로 저장한 배열을 읽기 전용 memmap으로 연 캐시"""
+    bottleneck_cache = ArrayBottleneckCache(class_count)
+    for category in SWEEP_CATEGORIES:
+        bottleneck_cache.add_array(
+            category, np.load(os.path.join(sweep_dir, category + '_bottlenecks.npy'), mmap_mode='r'),
+            np.load(os.path.join(sweep_dir, category + '_labels.npy')))
+    return bottleneck_cache
+
+
+def _run_trial(task):
+    """
+    trial 하나를 학습하는 프로세스. 그래프와 세션을 trial마다 새로 만든다.
+    eval_step_interval 스텝마다 밸리데이션셋 전체의 정확도를 기록한다.
+    """
+    ## new_model이 이 모듈을 import하므로 워커 안에서 import한다.
+    import new_model
+
+    (trial_index, params, sweep_dir, class_count, eval_step_interval, eval_chunk_size, intra_op_threads, seed,
+     sampling) = task
+    start = time.time()
+    np.random.seed(seed + trial_index)
+    bottleneck_cache = load_sweep_cache(sweep_dir, class_count)
+    bottleneck_cache.set_sampling('training', *sampling)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(seed + trial_index)
+        bottleneck_tensor = tf.placeholder(
+            tf.float32, [None, bottleneck_cache.bottlenecks['training'].shape[1]], name='bottleneck')
+        (train_step, _, bottleneck_input, ground_truth_input, final_tensor) = new_model.add_final_training_ops(
+            class_count, new_model.FINAL_TENSOR_NAME, bottleneck_tensor, learning_rate=params['learning_rate'],
+            dropout_rate=params['dropout_rate'], hidden_units=params['hidden_units'])
+        _, prediction = new_model.add_evaluation_step(final_tensor, ground_truth_input)
+        dropout_input = graph.get_tensor_by_name('FC_layer/dropout_while_training:0')
+        init = tf.global_variables_initializer()
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads, inter_op_parallelism_threads=1)
+    how_many_training_steps = params['how_many_training_steps']
+    history = []
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run(init)
+
+        def predict_labels(bottlenecks):
+            return sess.run(prediction, feed_dict={bottleneck_input: bottlenecks, dropout_input: False})
+
+        train_sec = 0.0
+        for i in range(how_many_training_steps):
+            step_start = time.time()
+            train_bottlenecks, train_ground_truth, _ = bottleneck_cache.sample('training', params['train_batch_size'])
+            sess.run(train_step, feed_dict={bottleneck_input: train_bottlenecks,
+                                            ground_truth_input: train_ground_truth})
+            train_sec += time.time() - step_start
+            if (i + 1) % eval_step_interval == 0 or i + 1 == how_many_training_steps:
+                validation_cm, _, _ = evaluate_chunks(
+                    predict_labels, bottleneck_cache.iter_chunks('validation', eval_chunk_size), class_count)
+                history.append([i + 1, float(validation_cm.trace()) / max(validation_cm.sum(), 1)])
+
+    best_step, best_accuracy = max(history, key=lambda item: item[1]) if history else (0, 0.0)
+    return {
+        'trial': trial_index,
+        'params': params,
+        'validation_accuracy': history[-1][1] if history else 0.0,
+        'best_validation_accuracy': best_accuracy,
+        'best_step': best_step,
+        'history': history,
+        'wall_sec': time.time() - start,
+        'train_sec': train_sec,
+        'steps_per_sec': how_many_training_steps / train_sec if train_sec else 0.0,
+    }
+
+
+def run_sweep(bottleneck_cache, trials, sweep_dir, base_params, num_workers=2, eval_step_interval=100,
+              eval_chunk_size=4096, intra_op_threads=0, seed=0, sampling_strategy='balanced', class_weights=None,
+              epoch_sampling=False):
+    """
+    trials(하이퍼파라미터 dict 리스트)마다 base_params를 덮어쓴 설정으로 FC 레이어를 학습한다.
+    training 배치는 sampling_strategy / class_weights(레이블 순서의 리스트) / epoch_sampling으로 뽑는다.
+    num_workers개의 프로세스가 trial을 하나씩 가져가 돌리고, 결과를 마지막 밸리데이션 정확도 순으로 정렬해
+    <sweep_dir>/results.json, results.csv로 저장한 뒤 리턴한다.
+    """
+    unknown = set(name for params in trials for name in params) - set(TRIAL_PARAMS)
+    if unknown:
+        raise ValueError('sweep에서 바꿀 수 없는 하이퍼파라미터입니다: %s' % ', '.join(sorted(unknown)))
+    class_count = bottleneck_cache.class_count
+    ## 잘못된 샘플링 설정은 워커를 띄우기 전에 알린다.
+    Sampler(bottleneck_cache.labels['training'], class_count, sampling_strategy, class_weights)
+    sampling = (sampling_strategy, class_weights, epoch_sampling)
+    save_sweep_arrays(sweep_dir, bottleneck_cache, eval_chunk_size)
+    num_workers = max(1, min(num_workers, len(trials)))
+    if intra_op_threads <= 0:
+        intra_op_threads = max(1, multiprocessing.cpu_count() // num_workers)
+    tasks = [(trial_index, dict(base_params, **params), sweep_dir, class_count, eval_step_interval,
+              eval_chunk_size, intra_op_threads, seed, sampling)
+             for trial_index, params in enumerate(trials)]
+
+    print('sweep: trial %d개, 프로세스 %d개 (프로세스마다 intra-op 스레드 %d개)' % (
+        len(trials), num_workers, intra_op_threads))
+    start = time.time()
+    results = []
+    ## 세션이 열린 프로세스에서 부를 수 있으므로 fork 대신 spawn으로 띄운다.
+    pool = multiprocessing.get_context('spawn').Pool(num_workers)
+    try:
+        for result in pool.imap_unordered(_run_trial, tasks):
+            print('trial %d: 밸리데이션 정확도 %.1f%% (최고 %.1f%% @ %d), %.1fs  %s' % (
+                result['trial'], result['validation_accuracy'] * 100, result['best_validation_accuracy'] * 100,
+                result['best_step'], result['wall_sec'], _format_params(trials[result['trial']])))
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+
+    results.sort(key=lambda result: (-result['validation_accuracy'], result['wall_sec']))
+    print('sweep 완료: %.1fs' % (time.time() - start))
+    print_sweep_results(results, trials)
+    write_sweep_results(sweep_dir, results)
+    return results
+
+
+def _format_params(params):
+    return ', '.join('%s=%s' % (name, params[name]) for name in sorted(params))
+
+
+def print_sweep_results(results, trials):
+    print('%4s %5s %9s %9s %8s %9s  %s' % ('rank', 'trial', 'val acc', 'best acc', 'wall(s)', 'steps/s', 'params'))
+    for rank, result in enumerate(results):
+        print('%4d %5d %8.2f%% %8.2f%% %8.1f %9.1f  %s' % (
+            rank + 1, result['trial'], result['validation_accuracy'] * 100,
+            result['best_validation_accuracy'] * 100, result['wall_sec'], result['steps_per_sec'],
+            _format_params(trials[result['trial']])))
+
+
+def write_sweep_results(sweep_dir, results):
+    """순위대로 정렬한 결과를 results.json(스텝별 기록 포함)과 results.csv로 저장한다."""
+    with open(os.path.join(sweep_dir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    with open(os.path.join(sweep_dir, 'results.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'trial'] + TRIAL_PARAMS + ['validation_accuracy', 'best_validation_accuracy',
+                                                           'best_step', 'wall_sec', 'train_sec', 'steps_per_sec'])
+        for rank, result in enumerate(results):
+            writer.writerow([rank + 1, result['trial']] + [result['params'][name] for name in TRIAL_PARAMS] +
+                            [result['validation_accuracy'], result['best_validation_accuracy'],
+                             result['best_step'], result['wall_sec'], result['train_sec'],
+                             result['steps_per_sec']])
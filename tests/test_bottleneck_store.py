@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+
+from bottleneck_cache import InMemoryBottleneckCache, LRUBottleneckCache
+from bottleneck_store import BottleneckStore
+
+
+def make_store(store_dir, num_rows=10, dim=4):
+    store = BottleneckStore(str(store_dir), dim, capacity=2, fingerprint='f')
+    values = np.arange(num_rows * dim, dtype=np.float32).reshape(num_rows, dim)
+    store.put_many(['k%d' % i for i in range(num_rows)], values)
+    store.flush()
+    return store, values
+
+
+def test_store_grows_and_reopens(tmpdir):
+    store, values = make_store(tmpdir)
+    assert store.capacity >= 10 and len(store) == 10
+
+    reopened = BottleneckStore(str(tmpdir), 4, readonly=True)
+    assert len(reopened) == 10
+    for i in range(10):
+        assert reopened.is_valid('k%d' % i)
+        np.testing.assert_array_equal(reopened.get('k%d' % i), values[i])
+    assert reopened.get('missing') is None
+
+
+def test_store_rejects_other_dim(tmpdir):
+    make_store(tmpdir)
+    with pytest.raises(ValueError):
+        BottleneckStore(str(tmpdir), 8)
+
+
+def test_unflushed_rows_are_not_valid_after_reopen(tmpdir):
+    store, _ = make_store(tmpdir)
+    ## index.json에 기록되기 전의 행은 다시 열면 valid 비트맵에서 지워지고 행이 재할당된다.
+    store.put('late', np.ones(4, dtype=np.float32))
+    store.data.flush()
+    store.valid.flush()
+    assert store.valid[10] == 1
+
+    reopened = BottleneckStore(str(tmpdir), 4)
+    assert not reopened.is_valid('late')
+    assert reopened.valid[10] == 0
+    assert reopened.row('late', create=True) == 10
+
+
+def test_allocated_row_is_invalid_until_written(tmpdir):
+    store, _ = make_store(tmpdir)
+    store.row('pending', create=True)
+    assert 'pending' not in store
+    assert store.get('pending') is None
+    store.put('pending', np.ones(4, dtype=np.float32))
+    assert 'pending' in store
+
+
+def test_compact_keeps_values_and_shrinks_file(tmpdir):
+    store, values = make_store(tmpdir)
+    data_path = os.path.join(str(tmpdir), BottleneckStore.DATA_FILENAME)
+    size_before = os.path.getsize(data_path)
+    assert store.compact(set(['k1', 'k7'])) == 8
+    assert os.path.getsize(data_path) < size_before
+
+    reopened = BottleneckStore(str(tmpdir), 4, readonly=True)
+    assert sorted(reopened.rows) == ['k1', 'k7']
+    np.testing.assert_array_equal(reopened.get('k7'), values[7])
+    assert reopened.valid.sum() == 2
+
+
+def test_merge_copies_only_missing_rows(tmpdir):
+    store, values = make_store(tmpdir.join('main'), num_rows=3)
+    other = BottleneckStore(str(tmpdir.join('other')), 4, fingerprint='f')
+    other.put_many(['k2', 'new'], np.ones((2, 4), dtype=np.float32))
+    assert store.merge(other) == 1
+    np.testing.assert_array_equal(store.get('k2'), values[2])
+    np.testing.assert_array_equal(store.get('new'), np.ones(4))
+
+
+@pytest.mark.parametrize('make_cache', [
+    lambda store: InMemoryBottleneckCache(store, 2),
+    lambda store: LRUBottleneckCache(store, 2, max_bytes=64, block_rows=2),
+])
+def test_caches_gather_store_rows(tmpdir, make_cache):
+    store, values = make_store(tmpdir)
+    rows = [store.row('k%d' % i) for i in [9, 0, 4, 5]]
+    bottleneck_cache = make_cache(store)
+    bottleneck_cache.add_category('training', rows, [0, 0, 1, 1], ['a', 'b', 'c', 'd'])
+    chunks = list(bottleneck_cache.iter_chunks('training', 3))
+    np.testing.assert_array_equal(np.concatenate([chunk for chunk, _ in chunks]), values[rows])
+    np.testing.assert_array_equal(np.concatenate([labels for _, labels in chunks]), [0, 0, 1, 1])
@@ -0,0 +1,107 @@
+import numpy as np
+
+from bottleneck_store import BottleneckStore
+from embedding_index import (EmbeddingStore, ExactIndex, IVFIndex, create_index, find_duplicates, l2_normalize,
+                             load_index, load_or_create_index)
+
+
+def make_vectors(num_vectors=500, dim=16, seed=0):
+    return l2_normalize(np.random.RandomState(seed).randn(num_vectors, dim))
+
+
+def test_exact_search_matches_brute_force():
+    vectors = make_vectors()
+    ids = np.arange(len(vectors)) * 3
+    queries = make_vectors(40, seed=1)
+    scores, neighbors = ExactIndex.from_arrays(vectors, ids).search(queries, k=7, batch_size=16)
+
+    expected = np.argsort(-np.dot(queries, vectors.T), axis=1, kind='mergesort')[:, :7]
+    np.testing.assert_array_equal(neighbors, ids[expected])
+    np.testing.assert_allclose(scores, np.take_along_axis(np.dot(queries, vectors.T), expected, axis=1), atol=1e-5)
+
+
+def test_ivf_with_all_lists_probed_matches_exact():
+    vectors = make_vectors()
+    ids = np.arange(len(vectors))
+    queries = make_vectors(40, seed=1)
+    exact, _ = create_index('exact', vectors, ids)
+    ## num_probe == num_lists이면 모든 리스트를 보므로 근사가 아니라 정확한 결과와 같아야 한다.
+    ivf, _ = create_index('ivf', vectors, ids, num_lists=8, num_probe=8, chunk_size=64)
+    assert ivf.num_lists == 8 and len(ivf) == len(vectors)
+
+    exact_scores, exact_neighbors = exact.search(queries, k=10, batch_size=16)
+    ivf_scores, ivf_neighbors = ivf.search(queries, k=10, batch_size=16)
+    np.testing.assert_array_equal(ivf_neighbors, exact_neighbors)
+    np.testing.assert_allclose(ivf_scores, exact_scores, atol=1e-5)
+
+
+def test_ivf_single_probe_finds_stored_vector():
+    vectors = make_vectors()
+    ids = np.arange(len(vectors))
+    ivf, _ = create_index('ivf', vectors, ids, num_lists=8, num_probe=1)
+    _, exact_neighbors = ExactIndex.from_arrays(vectors, ids).search(vectors[:50], k=10)
+    _, ivf_neighbors = ivf.search(vectors[:50], k=10)
+    ## 자기 자신은 항상 자기 리스트에 있으므로 첫 이웃은 같다.
+    np.testing.assert_array_equal(ivf_neighbors[:, 0], exact_neighbors[:, 0])
+
+
+def test_search_pads_when_fewer_than_k():
+    index = ExactIndex.from_arrays(make_vectors(3), np.arange(3))
+    scores, neighbors = index.search(make_vectors(2, seed=1), k=5)
+    assert np.all(neighbors[:, 3:] == -1) and np.all(np.isneginf(scores[:, 3:]))
+
+    ivf = IVFIndex.train(make_vectors(3), 2, num_probe=1)
+    ivf.add(make_vectors(3), np.arange(3))
+    _, neighbors = ivf.search(make_vectors(2, seed=1), k=5)
+    assert np.all(neighbors[:, 3:] == -1)
+
+
+def test_incremental_add_and_save_round_trip(tmpdir):
+    vectors = make_vectors()
+    ids = np.arange(len(vectors))
+    queries = make_vectors(20, seed=1)
+    for index_type in ['exact', 'ivf']:
+        index, _ = create_index(index_type, vectors[:300], ids[:300], num_lists=8, num_probe=8)
+        index.add(vectors[300:], ids[300:])
+        assert sorted(index.all_ids()) == list(ids)
+
+        path = str(tmpdir.join(index_type + '.npz'))
+        index.save(path)
+        loaded = load_index(path)
+        assert type(loaded) is type(index) and len(loaded) == len(index)
+        np.testing.assert_array_equal(loaded.search(queries, k=5)[1], index.search(queries, k=5)[1])
+
+
+def test_find_duplicates_reports_each_pair_once():
+    vectors = make_vectors(50)
+    vectors[7] = vectors[3]
+    vectors[20] = l2_normalize(vectors[3:4] + 1e-4)[0]
+    ids = np.arange(len(vectors))
+    pairs = find_duplicates(ExactIndex.from_arrays(vectors, ids), vectors, ids, threshold=0.999)
+    assert sorted((a, b) for a, b, _ in pairs) == [(3, 7), (3, 20), (7, 20)]
+    assert all(score >= 0.999 for _, _, score in pairs)
+
+
+def test_embedding_store_skips_stored_keys_and_resets_on_new_fingerprint(tmpdir):
+    source_store = BottleneckStore(str(tmpdir.join('bottlenecks')), 16, fingerprint='f')
+    keys = ['k%d' % i for i in range(10)]
+    source_store.put_many(keys, make_vectors(10) * 5)
+    items = [[i % 2, 'file%d.jpg' % i] for i in range(10)]
+    embedding_dir = str(tmpdir.join('embeddings'))
+
+    embedding_store = EmbeddingStore(embedding_dir, 'bottleneck', 16, 'a')
+    assert embedding_store.add(source_store, keys[:6], items[:6])[0] == 6
+    assert embedding_store.add(source_store, keys, items)[0] == 4
+    rows, vectors = embedding_store.vectors()
+    assert len(rows) == 10
+    np.testing.assert_allclose(np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=1), 1, atol=1e-3)
+
+    reopened = EmbeddingStore.open(embedding_dir)
+    assert reopened.items[reopened.store.row('k9')] == items[9]
+    index, report = load_or_create_index(reopened, str(tmpdir.join('index.npz')))
+    assert report['num_added'] == 10 and len(index) == 10
+    _, report = load_or_create_index(reopened, str(tmpdir.join('index.npz')))
+    assert report['num_added'] == 0
+
+    changed = EmbeddingStore(embedding_dir, 'bottleneck', 16, 'b')
+    assert len(changed.store) == 0 and changed.items == []
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+import projection as projection_module
+from bottleneck_store import BottleneckStore
+from projection import BottleneckProjection, fit_pca, load_or_fit_projection, project_store
+
+
+def make_store(store_dir, fingerprint='f', num_rows=200, dim=8, seed=0):
+    """축마다 분산이 다르고 평균이 0이 아닌 보틀넥 저장소"""
+    random_state = np.random.RandomState(seed)
+    values = (random_state.randn(num_rows, dim) * np.linspace(5, 0.5, dim) + 3).astype(np.float32)
+    values = np.dot(values, np.linalg.qr(random_state.randn(dim, dim))[0]).astype(np.float32)
+    store = BottleneckStore(str(store_dir), dim, fingerprint=fingerprint)
+    keys = ['k%d' % i for i in range(num_rows)]
+    store.put_many(keys, values)
+    store.flush()
+    return store, keys, values
+
+
+def test_fit_pca_matches_svd(tmpdir):
+    store, keys, values = make_store(tmpdir)
+    rows = [store.row(key) for key in keys]
+    ## chunk_size가 행 수를 나누어떨어지지 않게 해서 청크 누적을 확인한다.
+    projection = fit_pca(store, rows, 3, chunk_size=37)
+
+    centered = values.astype(np.float64) - values.mean(axis=0)
+    _, singular_values, vt = np.linalg.svd(centered, full_matrices=False)
+    np.testing.assert_allclose(projection.mean, values.mean(axis=0), rtol=1e-5, atol=1e-5)
+    ## 고유벡터는 부호가 정해져 있지 않으므로 열마다 부호를 맞춰 비교한다.
+    signs = np.sign(np.sum(projection.components * vt[:3].T, axis=0))
+    np.testing.assert_allclose(projection.components * signs, vt[:3].T, atol=1e-4)
+    variances = singular_values ** 2
+    assert projection.explained_variance_ratio == pytest.approx(variances[:3].sum() / variances.sum(), rel=1e-5)
+    assert projection.num_fit_examples == len(rows) and projection.source_fingerprint == 'f'
+
+    np.testing.assert_allclose(projection.transform(values), np.dot(centered, projection.components), atol=1e-3)
+
+
+def test_fit_pca_rejects_too_large_dim(tmpdir):
+    store, keys, _ = make_store(tmpdir, num_rows=5)
+    with pytest.raises(ValueError):
+        fit_pca(store, [store.row(key) for key in keys], 6)
+
+
+def test_load_or_fit_projection_reuses_saved_projection(tmpdir, monkeypatch):
+    store, keys, _ = make_store(tmpdir.join('bottlenecks'))
+    store_dir = str(tmpdir.join('projection'))
+    rows = [store.row(key) for key in keys]
+    projection = load_or_fit_projection(store_dir, 'pca', store, rows, 3)
+    assert os.path.exists(os.path.join(store_dir, BottleneckProjection.FILENAME))
+
+    def fail_fit(*args, **kwargs):
+        raise AssertionError('저장한 사영이 있으면 다시 맞추지 않아야 한다.')
+    monkeypatch.setattr(projection_module, 'fit_projection', fail_fit)
+    reused = load_or_fit_projection(store_dir, 'pca', store, rows, 3)
+    np.testing.assert_array_equal(reused.components, projection.components)
+    assert reused.fingerprint() == projection.fingerprint()
+
+
+def test_changed_source_fingerprint_clears_store_dir(tmpdir):
+    store, keys, _ = make_store(tmpdir.join('bottlenecks'))
+    store_dir = str(tmpdir.join('projection'))
+    projection = load_or_fit_projection(store_dir, 'random', store, [store.row(key) for key in keys], 3, seed=1)
+    project_store(store, projection, store_dir, keys)
+    assert os.path.exists(os.path.join(store_dir, 'features'))
+
+    ## 원래 보틀넥 저장소가 바뀌면 예전 사영으로 줄인 특징까지 지우고 새로 맞춘다.
+    other_store, _, _ = make_store(tmpdir.join('other'), fingerprint='g', seed=1)
+    refit = load_or_fit_projection(store_dir, 'random', other_store, [other_store.row(key) for key in keys], 3,
+                                   seed=1)
+    assert refit.source_fingerprint == 'g'
+    assert not os.path.exists(os.path.join(store_dir, 'features'))
+    assert refit.fingerprint() != projection.fingerprint()
+
+
+def test_project_store_projects_only_new_keys(tmpdir):
+    store, keys, values = make_store(tmpdir.join('bottlenecks'))
+    store_dir = str(tmpdir.join('projection'))
+    projection = load_or_fit_projection(store_dir, 'pca', store, [store.row(key) for key in keys[:150]], 3)
+
+    features, num_projected, _ = project_store(store, projection, store_dir, keys[:120])
+    assert num_projected == 120
+    features, num_projected, _ = project_store(store, projection, store_dir, keys)
+    assert num_projected == 80
+    _, num_projected, _ = project_store(store, projection, store_dir, keys)
+    assert num_projected == 0
+
+    assert features.fingerprint == projection.fingerprint() and len(features) == len(keys)
+    projected = features.get_rows([features.row(key) for key in keys])
+    np.testing.assert_allclose(projected, projection.transform(values), atol=1e-4)
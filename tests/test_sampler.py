@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from bottleneck_cache import ArrayBottleneckCache
+from sampler import Sampler
+
+## 클래스 0, 1, 3에 900 / 90 / 10개, 클래스 2, 4는 비어 있다.
+CLASS_SIZES = [900, 90, 0, 10, 0]
+
+
+def make_labels(seed=0):
+    return np.random.RandomState(seed).permutation(np.repeat(np.arange(len(CLASS_SIZES)), CLASS_SIZES))
+
+
+def class_fractions(labels, indices):
+    return np.bincount(labels[indices], minlength=len(CLASS_SIZES)) / float(len(indices))
+
+
+def test_balanced_sample_picks_non_empty_classes_equally():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'balanced', rng=np.random.RandomState(1))
+    fractions = class_fractions(labels, sampler.sample(60000))
+    np.testing.assert_allclose(fractions, [1 / 3.0, 1 / 3.0, 0, 1 / 3.0, 0], atol=0.01)
+
+
+def test_uniform_sample_follows_class_sizes():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'uniform', rng=np.random.RandomState(1))
+    fractions = class_fractions(labels, sampler.sample(60000))
+    np.testing.assert_allclose(fractions, np.array(CLASS_SIZES) / 1000.0, atol=0.01)
+
+
+def test_weighted_sample_follows_weights_and_ignores_empty_classes():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'weighted', [1, 2, 5, 1, 5], rng=np.random.RandomState(1))
+    fractions = class_fractions(labels, sampler.sample(60000))
+    np.testing.assert_allclose(fractions, [0.25, 0.5, 0, 0.25, 0], atol=0.01)
+
+
+def test_sample_stays_within_class():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), rng=np.random.RandomState(1))
+    indices = sampler.sample(5000)
+    assert indices.min() >= 0 and indices.max() < len(labels)
+    ## 작은 클래스(10개)의 예제도 모두 뽑힌다.
+    assert set(np.flatnonzero(labels == 3)) <= set(indices)
+
+
+def test_uniform_epoch_is_a_permutation():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'uniform', rng=np.random.RandomState(1))
+    order = sampler.epoch_order()
+    np.testing.assert_array_equal(np.sort(order), np.arange(len(labels)))
+
+
+def test_balanced_epoch_covers_each_class_before_repeating():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'balanced', rng=np.random.RandomState(1))
+    order = sampler.epoch_order()
+    counts = np.bincount(labels[order], minlength=len(CLASS_SIZES))
+    np.testing.assert_array_equal(counts, [334, 333, 0, 333, 0])
+    for label in [0, 1, 3]:
+        ## 클래스 안에서는 섞은 순서를 돌아가며 쓰므로 예제마다 나온 횟수의 차이가 1 이하이다.
+        occurrences = np.bincount(order[labels[order] == label], minlength=len(labels))[labels == label]
+        assert occurrences.max() - occurrences.min() <= 1
+        assert occurrences.sum() == counts[label]
+
+
+def test_next_batch_continues_across_epochs():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'uniform', rng=np.random.RandomState(1))
+    batches = [sampler.next_batch(300) for _ in range(7)]
+    assert sampler.epochs_completed == 2
+    assert all(len(batch) == 300 for batch in batches)
+    first_epoch = np.concatenate(batches)[:len(labels)]
+    np.testing.assert_array_equal(np.sort(first_epoch), np.arange(len(labels)))
+
+
+def test_epoch_generator_yields_one_epoch():
+    labels = make_labels()
+    sampler = Sampler(labels, len(CLASS_SIZES), 'uniform', rng=np.random.RandomState(1))
+    batches = list(sampler.epoch(128))
+    assert [len(batch) for batch in batches] == [128] * 7 + [104]
+    np.testing.assert_array_equal(np.sort(np.concatenate(batches)), np.arange(len(labels)))
+
+
+def test_from_class_sizes_matches_sorted_labels():
+    sampler = Sampler.from_class_sizes([3, 0, 2], rng=np.random.RandomState(1))
+    np.testing.assert_array_equal(sampler.class_starts, [0, 3, 3])
+    np.testing.assert_allclose(sampler.class_probs, [0.5, 0, 0.5])
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        Sampler([0, 1], 2, 'stratified')
+    with pytest.raises(ValueError):
+        Sampler([0, 1], 2, 'weighted')
+    with pytest.raises(ValueError):
+        Sampler([0, 1], 2, 'weighted', [1, -1])
+    with pytest.raises(ValueError):
+        Sampler([], 2).sample(1)
+
+
+def test_cache_training_sampling_and_full_category():
+    labels = np.repeat([0, 2], [5, 2])
+    bottleneck_cache = ArrayBottleneckCache(3)
+    bottleneck_cache.add_array('training', np.arange(14, dtype=np.float32).reshape(7, 2), labels)
+    bottleneck_cache.set_sampling('training', 'uniform', epoch_sampling=True)
+
+    bottlenecks, ground_truths, filenames = bottleneck_cache.sample('training', 7)
+    np.testing.assert_array_equal(np.sort(bottlenecks[:, 0]), np.arange(0, 14, 2))
+    np.testing.assert_array_equal(ground_truths.sum(axis=0), [5, 0, 2])
+    assert filenames == [''] * 7
+
+    bottlenecks, ground_truths, _ = bottleneck_cache.sample('training', -1)
+    np.testing.assert_array_equal(bottlenecks[:, 0], np.arange(0, 14, 2))
+    np.testing.assert_array_equal(np.argmax(ground_truths, 1), labels)
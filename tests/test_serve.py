@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from serve import MicroBatcher
+
+
+class FakeClassifier(object):
+    """입력에 NaN이 있으면 배치 전체를 실패시키고, 아니면 이미지마다 [평균, 1 - 평균]을 리턴한다."""
+
+    def __init__(self):
+        self.batch_shapes = []
+
+    def predict_batch(self, images):
+        self.batch_shapes.append(images.shape)
+        if np.isnan(images).any():
+            raise ValueError('NaN input')
+        means = images.reshape(len(images), -1).mean(axis=1)
+        return np.stack([means, 1 - means], axis=1)
+
+
+def predict_concurrently(batcher, image_datas):
+    """image_datas를 동시에 요청해 (확률 또는 예외) 리스트를 요청 순서로 리턴한다."""
+    results = [None] * len(image_datas)
+
+    def request(i):
+        try:
+            results[i] = batcher.predict(image_datas[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(image_datas))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_bad_request_does_not_fail_its_micro_batch():
+    image_datas = [np.full((4, 4), 0.1), np.full((4, 4), np.nan), np.full((4, 4), 0.3),
+                   np.full((4, 4), np.nan), np.full((6, 6), 0.5)]
+    classifier = FakeClassifier()
+    ## 요청이 모두 모일 때까지 기다리도록 max_wait_ms를 넉넉히 두어 한 micro-batch로 묶는다.
+    batcher = MicroBatcher(classifier, max_batch_size=len(image_datas), max_wait_ms=5000)
+    results = predict_concurrently(batcher, image_datas)
+
+    for i in [1, 3]:
+        assert isinstance(results[i], ValueError)
+    for i in [0, 2, 4]:
+        np.testing.assert_allclose(results[i], [image_datas[i][0, 0], 1 - image_datas[i][0, 0]])
+
+    ## shape이 다른 요청은 따로 분류하고, 실패한 4x4 묶음만 한 장씩 다시 분류한다.
+    assert (1, 6, 6) in classifier.batch_shapes
+    assert classifier.batch_shapes.count((4, 4, 4)) == 1
+    assert classifier.batch_shapes.count((1, 4, 4)) == 4
+
+    metrics = batcher.metrics()
+    assert metrics['batches'] == 1 and metrics['requests'] == 5
+    ## errors는 실패한 배치 수가 아니라 요청 수를 센다.
+    assert metrics['errors'] == 2
+
+
+def test_single_bad_request_is_not_retried():
+    classifier = FakeClassifier()
+    batcher = MicroBatcher(classifier, max_batch_size=1)
+    with pytest.raises(ValueError):
+        batcher.predict(np.full((4, 4), np.nan))
+    np.testing.assert_allclose(batcher.predict(np.full((4, 4), 0.25)), [0.25, 0.75])
+    assert classifier.batch_shapes == [(1, 4, 4), (1, 4, 4)]
+    assert batcher.metrics()['errors'] == 1